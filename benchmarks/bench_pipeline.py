@@ -0,0 +1,234 @@
+"""
+Benchmark suite for the pipeline's public functions.
+
+Generates synthetic laps (see synthetic.py) at increasing sizes, times every
+Stage 1 / Stage 2 function individually plus the end-to-end build_dataset,
+and reports scaling curves and memory.
+
+    python benchmarks/bench_pipeline.py --sizes 10 100 1000
+    python benchmarks/bench_pipeline.py --sizes 1000 10000 --skip build_dataset --memory
+    python benchmarks/bench_pipeline.py --sizes 1000 100000 1000000 --batch-laps 1000
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import sys
+import tempfile
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import synthetic  # noqa: E402
+from src import config  # noqa: E402
+from src.config import FEATURES  # noqa: E402
+from src.profiling import RunProfiler  # noqa: E402
+from src.data_loader import load_race_data  # noqa: E402
+from src.data_cleaning import (  # noqa: E402
+    remove_other_tracks, remove_na, filter_by_distance, remove_lowinfo_laps
+)
+from src.track_features import (  # noqa: E402
+    car_edge_distances, calculate_track_width, compute_distace_to_apex,
+    compute_angle_to_apex, id_outoftrack, add_lap_id, car_from_ref_line
+)
+from src.track_moments import (  # noqa: E402
+    moment_generator, get_throttle_points, get_braking_points,
+    get_apex_points, get_steering_points
+)
+from src.online_moments import scan_moment_points  # noqa: E402
+
+
+RESULTS_FOLDER = Path(__file__).resolve().parent / "results"
+
+
+def _quiet(func, *args, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return func(*args, **kwargs)
+
+
+def _stage_steps(track):
+    ''' Ordered (name, function) pairs; each function reads and updates the shared state dict. '''
+    track_left, track_right, ref_line, turns = track
+
+    def clean(state):
+        df = remove_na(remove_other_tracks(state["df"]),
+                       subset=["WORLDPOSITIONX", "WORLDPOSITIONY"])
+        df = add_lap_id(filter_by_distance(df))
+        state["df"] = _quiet(remove_lowinfo_laps, df)
+
+    def track_width(state):
+        state["left"], state["right"] = calculate_track_width(track_left, track_right)
+
+    def moment(state):
+        points = state["braking_points"]
+        moment_generator(state["df"], "BPS", FEATURES, points[["lap_id", "BP_LD"]],
+                         points[["lap_id", "max_brake_LD"]])
+
+    return [
+        ("load_race_data", lambda s: s.update(df=load_race_data(None, s["raw"]))),
+        ("clean", clean),
+        ("calculate_track_width", track_width),
+        ("car_edge_distances", lambda s: s.update(
+            df=car_edge_distances(s["df"], s["left"], s["right"]))),
+        ("car_from_ref_line", lambda s: s.update(df=car_from_ref_line(s["df"], ref_line))),
+        ("compute_distace_to_apex", lambda s: s.update(df=compute_distace_to_apex(s["df"], turns))),
+        ("compute_angle_to_apex", lambda s: s.update(df=compute_angle_to_apex(s["df"], turns))),
+        ("id_outoftrack", lambda s: s.update(df=id_outoftrack(s["df"]))),
+        ("get_throttle_points", lambda s: s.update(throttle_points=get_throttle_points(s["df"]))),
+        ("get_braking_points", lambda s: s.update(braking_points=get_braking_points(s["df"]))),
+        ("get_apex_points", lambda s: s.update(apex_points=get_apex_points(s["df"]))),
+        ("get_steering_points", lambda s: s.update(steering_points=get_steering_points(s["df"]))),
+        ("scan_moment_points", lambda s: scan_moment_points(s["df"])),
+        ("moment_generator", moment),
+    ]
+
+
+def _run_build_dataset(raw, track, profiler):
+    import run_pipeline
+    from src import data_loader
+
+    with tempfile.TemporaryDirectory() as tmp:
+        synthetic.write_track(Path(tmp) / "track", track)
+        data_folder, output_folder = data_loader.DATAFOLDER, run_pipeline.OUTPUT_FOLDER
+        data_loader.DATAFOLDER = Path(tmp) / "track"
+        run_pipeline.OUTPUT_FOLDER = Path(tmp) / "out"
+        try:
+            with profiler.stage("build_dataset", rows_in=len(raw)) as rec:
+                output = _quiet(run_pipeline.build_dataset, raw.copy(), progress_mode="off")
+                rec["rows_out"] = len(output)
+        finally:
+            data_loader.DATAFOLDER, run_pipeline.OUTPUT_FOLDER = data_folder, output_folder
+
+
+def run_size(n_laps, track, seed=0, skip=(), trace_memory=False, raw=None):
+    ''' Benchmark every step at `n_laps` synthetic laps. Returns a list of records. '''
+    if raw is None:
+        raw = synthetic.generate_race_data(n_laps, seed=seed, track=track)
+    profiler = RunProfiler(trace_memory=trace_memory)
+    state = {"raw": raw}
+
+    for name, step in _stage_steps(track):
+        if name in skip:
+            # later steps still need the inputs, so run it untimed
+            _quiet(step, state)
+            continue
+        rows_in = len(state["df"]) if "df" in state else len(raw)
+        with profiler.stage(name, rows_in=rows_in):
+            _quiet(step, state)
+
+    if "build_dataset" not in skip:
+        _run_build_dataset(raw, track, profiler)
+
+    n_frames = len(raw)
+    return [dict(record, n_laps=n_laps, n_frames=n_frames) for record in profiler.records]
+
+
+def run_size_batched(n_laps, batch_laps, track, seed=0, **kwargs):
+    ''' Benchmark `n_laps` as consecutive batches of at most `batch_laps` laps.
+    Times and row counts are summed over batches and memory is the maximum, which
+    gives streaming throughput at sizes (10^5-10^6 laps) that do not fit in memory.
+    '''
+    records = []
+    for raw in synthetic.iter_race_data(n_laps, batch_laps=batch_laps, seed=seed, track=track):
+        laps = len(raw[["M_SESSIONUID", "M_CURRENTLAPNUM"]].drop_duplicates())
+        records += run_size(laps, track, raw=raw, **kwargs)
+
+    batches = pd.DataFrame(records)
+    summed = batches.groupby("stage", sort=False)[
+        ["wall_s", "cpu_s", "rows_in", "rows_out", "n_frames"]].sum(min_count=1)
+    peaks = batches.groupby("stage", sort=False)[
+        ["peak_traced_mb", "rss_mb", "max_rss_mb"]].max()
+    merged = summed.join(peaks).reset_index()
+    rows = merged["rows_out"].fillna(merged["rows_in"])
+    merged["rows_per_s"] = (rows / merged["wall_s"]).round(1)
+    merged["n_laps"] = n_laps
+    merged["batch_laps"] = batch_laps
+    return merged.to_dict("records")
+
+
+def scaling_exponents(results):
+    ''' Fit wall_s ~ n_laps^k per function on a log-log scale; k ~ 1 is linear, k ~ 2 quadratic. '''
+    exponents = {}
+    for stage, group in results.groupby("stage"):
+        group = group[group["wall_s"] > 0]
+        if group["n_laps"].nunique() < 2:
+            continue
+        slope = np.polyfit(np.log(group["n_laps"]), np.log(group["wall_s"]), 1)[0]
+        exponents[stage] = round(float(slope), 2)
+    return exponents
+
+
+def plot_scaling(results, path):
+    import matplotlib
+    matplotlib.use("Agg")
+    from matplotlib import pyplot as plt
+
+    fig, axs = plt.subplots(1, 2, figsize=(14, 6))
+    for stage, group in results.groupby("stage"):
+        group = group.sort_values("n_laps")
+        axs[0].plot(group["n_laps"], group["wall_s"], marker="o", label=stage)
+        axs[1].plot(group["n_laps"], group["max_rss_mb"], marker="o", label=stage)
+    for ax, label in zip(axs, ["wall time (s)", "max RSS (MB)"]):
+        ax.set_xscale("log")
+        ax.set_yscale("log")
+        ax.set_xlabel("laps")
+        ax.set_ylabel(label)
+    axs[0].legend(fontsize=7)
+    fig.tight_layout()
+    fig.savefig(path)
+    plt.close(fig)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch-laps", type=int, default=None,
+                        help="process sizes above this many laps in batches of this size")
+    parser.add_argument("--skip", nargs="*", default=[],
+                        help="step names to leave untimed (e.g. build_dataset)")
+    parser.add_argument("--memory", action="store_true",
+                        help="record tracemalloc peaks (slower)")
+    parser.add_argument("--plot", action="store_true", help="save scaling curves as PNG")
+    parser.add_argument("--out", default=str(RESULTS_FOLDER))
+    args = parser.parse_args(argv)
+
+    config.PROGRESS_MODE = "off"
+    track = synthetic.load_or_synthesise_track()
+
+    records = []
+    for n_laps in args.sizes:
+        print(f"Benchmarking {n_laps:,} laps...")
+        kwargs = dict(seed=args.seed, skip=set(args.skip), trace_memory=args.memory)
+        if args.batch_laps is not None and n_laps > args.batch_laps:
+            records += run_size_batched(n_laps, args.batch_laps, track, **kwargs)
+        else:
+            records += run_size(n_laps, track, **kwargs)
+    results = pd.DataFrame(records)
+
+    out = Path(args.out)
+    out.mkdir(parents=True, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    results.to_csv(out / f"bench_{stamp}.csv", index=False)
+    exponents = scaling_exponents(results)
+    with open(out / f"bench_{stamp}.json", "w") as f:
+        json.dump({"sizes": args.sizes, "scaling_exponents": exponents,
+                   "records": records}, f, indent=2, default=str)
+    if args.plot:
+        plot_scaling(results, out / f"bench_{stamp}.png")
+
+    table = results.pivot_table(index="stage", columns="n_laps", values="wall_s", sort=False)
+    table["scaling_k"] = pd.Series(exponents)
+    print(table.to_string())
+    print(f"\nResults written to {out / f'bench_{stamp}.csv'}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Equivalence check of the streaming moment detectors against the batch ones.
+
+src.online_moments.scan_moment_points must give exactly the same throttle,
+braking and steering points as get_throttle_points / get_braking_points /
+get_steering_points, including the label-lag behaviour of the batch slices
+(_LaggedFrames). Checked on cleaned synthetic laps (synthetic.py) and on random
+edge-case laps: frames below the distance window, repeated distances, NaN
+channels and NaN distances.
+
+    python benchmarks/check_online_moments.py
+    python benchmarks/check_online_moments.py --laps 500 --edge-laps 2000 --seed 3
+"""
+
+import argparse
+import contextlib
+import io
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import synthetic  # noqa: E402
+from src.data_loader import load_race_data  # noqa: E402
+from src.data_cleaning import remove_other_tracks, remove_na, filter_by_distance  # noqa: E402
+from src.track_features import add_lap_id  # noqa: E402
+from src.track_moments import (  # noqa: E402
+    get_throttle_points, get_braking_points, get_steering_points
+)
+from src.online_moments import scan_moment_points  # noqa: E402
+
+
+def synthetic_laps(n_laps, seed=0):
+    ''' Cleaned frames (lap_id, LAPDISTANCE, THROTTLE, BRAKE, STEER) of n_laps synthetic laps. '''
+    track = synthetic.load_or_synthesise_track()
+    raw = synthetic.generate_race_data(n_laps, seed=seed, track=track)
+    with contextlib.redirect_stdout(io.StringIO()):
+        df = remove_na(remove_other_tracks(load_race_data(None, raw)),
+                       subset=["WORLDPOSITIONX", "WORLDPOSITIONY"])
+        df = add_lap_id(filter_by_distance(df))
+    return df[["lap_id", "LAPDISTANCE", "THROTTLE", "BRAKE", "STEER"]]
+
+
+def edge_case_laps(n_laps, seed=0):
+    ''' Random short laps with starts around the distance window, repeated and rounded
+    distances, plateaus, NaN channel values and the odd NaN distance.
+    '''
+    rng = np.random.default_rng(seed)
+    laps = []
+    for lap in range(n_laps):
+        n = rng.integers(5, 300)
+        LD = np.sort(rng.choice([-5, 0, 5, 9.5, 10])
+                     + np.cumsum(rng.choice([0, 0.5, 1, 2, 3, 5], size=n)))
+        if rng.random() < 0.3:
+            LD = np.round(LD)
+        throttle = np.clip(rng.choice([0, 0.5, 1.0], size=n) * rng.random()
+                           + rng.normal(0, 0.05, n), 0, 1)
+        brake = np.clip(rng.normal(0.3, 0.4, n), 0, 1)
+        brake[rng.random(n) < 0.4] = 0
+        steer = rng.normal(0, 0.3, n)
+        steer[rng.random(n) < 0.2] = 0
+        channels = [throttle, brake, steer]
+        for i, values in enumerate(channels):
+            if rng.random() < 0.5:
+                channels[i] = values = np.round(values, 1)
+            values[rng.random(n) < 0.05] = np.nan
+            if rng.random() < 0.05:
+                values[:] = np.nan
+        if rng.random() < 0.05:
+            LD[rng.integers(n)] = np.nan
+        laps.append(pd.DataFrame({"lap_id": f"L{lap}", "LAPDISTANCE": LD, "THROTTLE": channels[0],
+                                  "BRAKE": channels[1], "STEER": channels[2]}))
+    return pd.concat(laps, ignore_index=True)
+
+
+def compare_points(df):
+    ''' Mismatching (detector, column, count) between the batch and streaming detectors. '''
+    # frames grouped by lap in distance order, so ties are seen in the same order by both
+    df = df.sort_values(["lap_id", "LAPDISTANCE"], kind="mergesort")
+    streamed = scan_moment_points(df)
+    batch = [get_throttle_points(df), get_braking_points(df), get_steering_points(df)]
+
+    mismatches = []
+    for name, expected, got in zip(["throttle", "braking", "steering"], batch, streamed):
+        expected, got = expected.reset_index(drop=True), got.reset_index(drop=True)
+        if list(expected.columns) != list(got.columns) or len(expected) != len(got):
+            mismatches.append((name, "<shape>", max(len(expected), len(got))))
+            continue
+        for column in expected.columns:
+            a, b = expected[column], got[column]
+            bad = ~((a == b) | (a.isna() & b.isna()))
+            if bad.any():
+                mismatches.append((name, column, int(bad.sum())))
+    return mismatches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--laps", type=int, default=100, help="synthetic laps")
+    parser.add_argument("--edge-laps", type=int, default=400, help="random edge-case laps")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    ok = True
+    for name, df in [("synthetic", synthetic_laps(args.laps, args.seed)),
+                     ("edge cases", edge_case_laps(args.edge_laps, args.seed))]:
+        mismatches = compare_points(df)
+        ok &= not mismatches
+        print(f"[{'FAIL' if mismatches else 'PASS'}] {name}: {df['lap_id'].nunique():,} laps")
+        for detector, column, n in mismatches:
+            print(f"    {detector}.{column}: {n:,} laps differ")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,295 @@
+"""
+Performance regression gate with golden-output equivalence.
+
+Runs the reference pandas pipeline and any alternative engines on the same
+inputs, checks every output column against a golden table within per-family
+tolerances, records stage timings in a history file and fails when a stage is
+slower than its baseline by more than the allowed margin. Each engine runs
+--repeats times and the fastest time of every stage is recorded; stages are
+only flagged when they are also at least MIN_SLOWDOWN_S seconds slower, so
+millisecond-scale stages do not fail the gate on timer noise.
+
+    # real data: compare against the committed final_data_product.csv
+    python benchmarks/regression_gate.py --golden final_data_product.csv
+    # synthetic data: the pandas engine's own output is the golden table
+    python benchmarks/regression_gate.py --synthetic 200 --engine fast=my_module:build_dataset
+
+An engine is any callable `engine(df) -> final DataFrame` with the same
+signature as run_pipeline.build_dataset; when it writes a run report into
+OUTPUT_FOLDER, its per-stage timings are gated as well.
+"""
+
+import argparse
+import contextlib
+import fnmatch
+import importlib
+import io
+import json
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import synthetic  # noqa: E402
+from src import config  # noqa: E402
+from src.config import DATAFOLDER, RUN_REPORT_NAME  # noqa: E402
+from src.table_io import read_table  # noqa: E402
+
+
+HISTORY_FILE = Path(__file__).resolve().parent / "results" / "timing_history.jsonl"
+
+# (pattern, atol, rtol) checked in order; the first matching pattern wins
+TOLERANCES = [
+    ("*_ext_LAPDISTANCE", 1e-3, 0.0),
+    ("*_LAPDISTANCE", 1e-3, 0.0),
+    ("*_TIMETOINMS", 1e-2, 0.0),
+    ("*_CURRENTLAPTIMEINMS", 1e-2, 0.0),
+    ("*_angle_to_apex*", 1e-4, 0.0),
+    ("*_STEER", 1e-6, 0.0),
+    ("*_YAW", 1e-6, 0.0),
+    ("*_PITCH", 1e-6, 0.0),
+    ("*_ROLL", 1e-6, 0.0),
+    ("*", 1e-6, 1e-6),
+]
+
+SLOWDOWN_MARGIN = 0.2
+MIN_SLOWDOWN_S = 0.05
+BASELINE_RUNS = 5
+REPEATS = 3
+
+
+def tolerance_for(column, tolerances=TOLERANCES):
+    for pattern, atol, rtol in tolerances:
+        if fnmatch.fnmatchcase(column, pattern):
+            return pattern, atol, rtol
+    return None, 0.0, 0.0
+
+
+def compare_outputs(reference, candidate, key="lap_id", tolerances=TOLERANCES):
+    ''' Column-by-column comparison of two lap tables aligned on `key`.
+    NaNs must line up exactly; numeric values must satisfy |a - b| <= atol + rtol * |a|.
+    Returns (passed, report DataFrame with one row per column, list of structural problems).
+    '''
+    problems = []
+    missing = sorted(set(reference.columns) - set(candidate.columns))
+    extra = sorted(set(candidate.columns) - set(reference.columns))
+    if missing:
+        problems.append(f"missing columns: {missing}")
+    if extra:
+        problems.append(f"unexpected columns: {extra}")
+
+    ref = reference.set_index(key)
+    cand = candidate.set_index(key)
+    if set(ref.index) != set(cand.index):
+        problems.append(f"lap sets differ: {len(set(ref.index) - set(cand.index))} missing, "
+                        f"{len(set(cand.index) - set(ref.index))} unexpected")
+    laps = ref.index.intersection(cand.index)
+    ref, cand = ref.loc[laps], cand.loc[laps]
+
+    rows = []
+    for column in [c for c in ref.columns if c in cand.columns]:
+        family, atol, rtol = tolerance_for(column, tolerances)
+        a, b = ref[column], cand[column]
+        if pd.api.types.is_numeric_dtype(a) and pd.api.types.is_numeric_dtype(b):
+            a, b = a.to_numpy(dtype=np.float64), b.to_numpy(dtype=np.float64)
+            nan_mismatch = np.isnan(a) != np.isnan(b)
+            both = ~np.isnan(a) & ~np.isnan(b)
+            err = np.abs(a[both] - b[both])
+            bad = int(nan_mismatch.sum() + (err > atol + rtol * np.abs(a[both])).sum())
+            max_err = float(err.max()) if err.size else 0.0
+        else:
+            bad = int((a.astype(str) != b.astype(str)).sum())
+            max_err = np.nan
+        rows.append({"column": column, "family": family, "atol": atol, "rtol": rtol,
+                     "n_laps": len(laps), "n_mismatch": bad, "max_abs_err": max_err,
+                     "passed": bad == 0})
+
+    report = pd.DataFrame(rows)
+    passed = not problems and bool(report["passed"].all()) if len(report) else not problems
+    return passed, report, problems
+
+
+def load_engine(spec):
+    ''' Resolve "module:function" (module relative to the project root) to a callable. '''
+    module_name, func_name = spec.split(":")
+    return getattr(importlib.import_module(module_name), func_name)
+
+
+def run_engine(engine, raw, track_folder):
+    ''' Run an engine with DATAFOLDER/OUTPUT_FOLDER redirected to scratch folders.
+    Returns (output, stage records, total wall seconds).
+    '''
+    import run_pipeline
+    from src import data_loader
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data_folder, output_folder = data_loader.DATAFOLDER, run_pipeline.OUTPUT_FOLDER
+        data_loader.DATAFOLDER = Path(track_folder)
+        run_pipeline.OUTPUT_FOLDER = Path(tmp)
+        try:
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                output = engine(raw.copy() if raw is not None else None)
+            total = time.perf_counter() - start
+        finally:
+            data_loader.DATAFOLDER, run_pipeline.OUTPUT_FOLDER = data_folder, output_folder
+
+        report_path = Path(tmp) / f"{RUN_REPORT_NAME}.json"
+        stages = []
+        if report_path.exists():
+            with open(report_path) as f:
+                stages = json.load(f)["stages"]
+
+    return output, stages, total
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def load_history(path=HISTORY_FILE):
+    path = Path(path)
+    if not path.exists():
+        return pd.DataFrame(columns=["commit", "timestamp", "input", "engine", "stage", "wall_s"])
+    return pd.read_json(path, lines=True)
+
+
+def append_history(records, path=HISTORY_FILE):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+
+def best_stage_times(stage_runs):
+    ''' Stage name -> fastest wall time over the run reports of repeated runs, in first-seen
+    order (a stage recorded several times in one run counts with its summed time).
+    '''
+    best = {}
+    for stages in stage_runs:
+        per_run = {}
+        for stage in stages:
+            per_run[stage["stage"]] = per_run.get(stage["stage"], 0.0) + stage["wall_s"]
+        for stage, wall_s in per_run.items():
+            best[stage] = min(best.get(stage, np.inf), wall_s)
+    return best
+
+
+def check_regressions(current, history, margin=SLOWDOWN_MARGIN, baseline_runs=BASELINE_RUNS,
+                      min_slowdown=MIN_SLOWDOWN_S):
+    ''' Compare each (engine, stage) time with the median of its last `baseline_runs`
+    entries for the same input. Returns a DataFrame of the stages slower than
+    baseline * (1 + margin) and by more than min_slowdown seconds.
+    '''
+    flagged = []
+    for record in current:
+        past = history[(history["input"] == record["input"]) &
+                       (history["engine"] == record["engine"]) &
+                       (history["stage"] == record["stage"])].tail(baseline_runs)
+        if past.empty:
+            continue
+        baseline = float(past["wall_s"].median())
+        slower = record["wall_s"] > baseline * (1 + margin)
+        if baseline > 0 and slower and record["wall_s"] - baseline > min_slowdown:
+            flagged.append(dict(record, baseline_s=round(baseline, 4),
+                                slowdown=round(record["wall_s"] / baseline, 3)))
+    return pd.DataFrame(flagged)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--golden", default=None,
+                        help="golden lap table (e.g. final_data_product.csv or .parquet); "
+                             "defaults to the pandas engine output")
+    parser.add_argument("--synthetic", type=int, default=None, metavar="N_LAPS",
+                        help="run on N synthetic laps instead of DATAFOLDER's export")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--engine", action="append", default=[], metavar="NAME=MODULE:FUNC",
+                        help="alternative engine to gate; may be repeated")
+    parser.add_argument("--margin", type=float, default=SLOWDOWN_MARGIN,
+                        help="allowed fractional slowdown per stage before failing")
+    parser.add_argument("--min-slowdown", type=float, default=MIN_SLOWDOWN_S, metavar="SECONDS",
+                        help="smallest absolute slowdown of a stage that can fail the gate")
+    parser.add_argument("--repeats", type=int, default=REPEATS,
+                        help="runs per engine; the fastest time of each stage is recorded")
+    parser.add_argument("--history", default=str(HISTORY_FILE))
+    parser.add_argument("--no-record", action="store_true",
+                        help="check against history without appending this run")
+    args = parser.parse_args(argv)
+
+    config.PROGRESS_MODE = "off"
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.synthetic is not None:
+            track_folder = Path(tmp) / "track"
+            track = synthetic.load_or_synthesise_track()
+            synthetic.write_track(track_folder, track)
+            raw = synthetic.generate_race_data(args.synthetic, seed=args.seed, track=track)
+            input_name = f"synthetic-{args.synthetic}-{args.seed}"
+        else:
+            track_folder, raw, input_name = DATAFOLDER, None, "UNSW F12024.csv"
+
+        engines = {"pandas": load_engine("run_pipeline:build_dataset")}
+        for spec in args.engine:
+            name, target = spec.split("=", 1)
+            engines[name] = load_engine(target)
+
+        outputs, records = {}, []
+        commit, stamp = _git_commit(), datetime.now().isoformat(timespec="seconds")
+        for name, engine in engines.items():
+            print(f"Running engine '{name}' ({args.repeats}x)...")
+            runs = [run_engine(engine, raw, track_folder) for _ in range(max(args.repeats, 1))]
+            outputs[name] = runs[0][0]
+            base = {"commit": commit, "timestamp": stamp, "input": input_name, "engine": name}
+            records.append(dict(base, stage="total", wall_s=round(min(r[2] for r in runs), 4)))
+            records += [dict(base, stage=stage, wall_s=wall_s)
+                        for stage, wall_s in best_stage_times(r[1] for r in runs).items()]
+
+    golden = read_table(args.golden) if args.golden else outputs["pandas"]
+    ok = True
+    for name, output in outputs.items():
+        passed, report, problems = compare_outputs(golden, output)
+        ok &= passed
+        status = "PASS" if passed else "FAIL"
+        print(f"\n[{status}] {name}: {int(report['passed'].sum())}/{len(report)} columns "
+              f"within tolerance")
+        for problem in problems:
+            print(f"    {problem}")
+        if not passed:
+            print(report[~report["passed"]].to_string(index=False))
+
+    timings = pd.DataFrame(records)
+    totals = timings[timings["stage"] == "total"].set_index("engine")["wall_s"]
+    print("\nTotal wall time and speedup over pandas:")
+    for name, total in totals.items():
+        print(f"    {name:<12} {total:8.2f}s  x{totals['pandas'] / total:.2f}")
+
+    history = load_history(args.history)
+    flagged = check_regressions(records, history, margin=args.margin,
+                                min_slowdown=args.min_slowdown)
+    if not flagged.empty:
+        ok = False
+        print(f"\nStages slower than baseline by more than {args.margin:.0%} "
+              f"and {args.min_slowdown:g}s:")
+        print(flagged[["engine", "stage", "wall_s", "baseline_s", "slowdown"]].to_string(index=False))
+    if not args.no_record:
+        append_history(records, args.history)
+
+    print("\nGate passed." if ok else "\nGate FAILED.")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
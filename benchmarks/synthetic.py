@@ -0,0 +1,234 @@
+"""
+Synthetic telemetry generator for benchmarks and equivalence checks.
+
+Produces raw exports in the "UNSW F12024.csv" layout (RELEVANT_COLS) by driving
+laps along a reference line: the real f1sim-ref-* geometry when it is present in
+DATAFOLDER, otherwise a generated two-turn circuit with the same file layout.
+"""
+
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.config import DATAFOLDER, RELEVANT_COLS  # noqa: E402
+
+
+FRAME_RATE = 60  # Hz
+TRACK_HALF_WIDTH = 8.0
+LAP_LENGTH = 1300.0
+
+
+def _arc_length(x, y):
+    return np.concatenate([[0.0], np.cumsum(np.hypot(np.diff(x), np.diff(y)))])
+
+
+def synthetic_track(spacing=1.0, half_width=TRACK_HALF_WIDTH):
+    ''' Build a track with a long straight into a right-left complex (Turns 1-2) and a third kink.
+    Returns track_left, track_right, ref_line, turns DataFrames in the f1sim-ref-* layout.
+    '''
+    s = np.arange(0, LAP_LENGTH + spacing, spacing)
+
+    # curvature profile (1/m): T1 right-hander, T2 left-hander, gentle T3
+    curvature = (-0.012 * np.exp(-0.5 * ((s - 390) / 28) ** 2)
+                 + 0.010 * np.exp(-0.5 * ((s - 500) / 30) ** 2)
+                 - 0.004 * np.exp(-0.5 * ((s - 800) / 45) ** 2))
+    heading = np.pi / 2 - np.cumsum(curvature) * spacing
+    x = 370 + np.cumsum(np.cos(heading)) * spacing
+    y = -200 + np.cumsum(np.sin(heading)) * spacing
+
+    normal_x, normal_y = -np.sin(heading), np.cos(heading)
+    ref_line = pd.DataFrame({"FRAME": np.arange(len(s)), "WORLDPOSX": x, "WORLDPOSY": y})
+    track_left = pd.DataFrame({"FRAME": np.arange(len(s)),
+                               "WORLDPOSX": x + half_width * normal_x,
+                               "WORLDPOSY": y + half_width * normal_y})
+    track_right = pd.DataFrame({"FRAME": np.arange(len(s)),
+                                "WORLDPOSX": x - half_width * normal_x,
+                                "WORLDPOSY": y - half_width * normal_y})
+
+    turns = []
+    for turn, (apex_s, inside) in enumerate([(390, -1), (500, 1), (800, -1)], start=1):
+        i = int(apex_s / spacing)
+        apex_x = x[i] + inside * (half_width - 1.5) * normal_x[i]
+        apex_y = y[i] + inside * (half_width - 1.5) * normal_y[i]
+        lo, hi = max(i - int(60 / spacing), 0), min(i + int(60 / spacing), len(s) - 1)
+        box_x = np.concatenate([track_left["WORLDPOSX"][lo:hi], track_right["WORLDPOSX"][lo:hi]])
+        box_y = np.concatenate([track_left["WORLDPOSY"][lo:hi], track_right["WORLDPOSY"][lo:hi]])
+        turns.append({"TURN": turn, "APEX_X1": apex_x, "APEX_Y1": apex_y,
+                      "CORNER_X1": box_x.min(), "CORNER_Y1": box_y.min(),
+                      "CORNER_X2": box_x.max(), "CORNER_Y2": box_y.max()})
+
+    return track_left, track_right, ref_line, pd.DataFrame(turns)
+
+
+def load_or_synthesise_track(data_folder=DATAFOLDER):
+    ''' Load the f1sim-ref-* files if they exist, otherwise return synthetic_track(). '''
+    names = ["f1sim-ref-left", "f1sim-ref-right", "f1sim-ref-line", "f1sim-ref-turns"]
+    paths = [os.path.join(data_folder, f"{name}.csv") for name in names]
+    if all(os.path.exists(p) for p in paths):
+        return tuple(pd.read_csv(p) for p in paths)
+    return synthetic_track()
+
+
+def write_track(folder, track=None):
+    ''' Write a track tuple to `folder` using the f1sim-ref-* file names. '''
+    track = track if track is not None else synthetic_track()
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    for name, frame in zip(["left", "right", "line", "turns"], track):
+        frame.to_csv(folder / f"f1sim-ref-{name}.csv", index=False)
+
+
+def _turn_stations(ref_line, turns, ref_s):
+    ref_xy = ref_line[["WORLDPOSX", "WORLDPOSY"]].to_numpy()
+    stations = []
+    for turn in (1, 2):
+        apex = turns.loc[turns["TURN"] == turn, ["APEX_X1", "APEX_Y1"]].to_numpy()[0]
+        stations.append(ref_s[np.argmin(((ref_xy - apex) ** 2).sum(axis=1))])
+    return stations
+
+
+def _smooth_noise(rng, s, n_terms, amplitude, wavelength):
+    phases = rng.uniform(0, 2 * np.pi, n_terms)
+    freqs = rng.uniform(0.5, 1.5, n_terms) * 2 * np.pi / wavelength
+    amps = rng.normal(0, amplitude / np.sqrt(n_terms), n_terms)
+    return (amps[:, None] * np.sin(freqs[:, None] * s[None, :] + phases[:, None])).sum(axis=0)
+
+
+def simulate_lap(rng, ref_line, ref_s, apex_stations, max_distance=1250.0,
+                 frame_rate=FRAME_RATE, off_track_prob=0.15):
+    ''' Simulate one lap's frames along the reference line.
+    Returns a dict of frame-level arrays keyed by cleaned column name.
+    '''
+    apex1, apex2 = apex_stations
+    grid = np.arange(0, max_distance, 0.25)
+
+    brake_start = apex1 - rng.normal(125, 25)
+    brake_len = max(rng.normal(70, 12), 20)
+    throttle_back = apex1 + rng.normal(25, 12)
+
+    top, corner = rng.normal(86, 2), rng.normal(45, 4)
+    v = np.full_like(grid, top)
+    braking = (grid >= brake_start) & (grid < brake_start + brake_len)
+    v[braking] = top - (top - corner) * (grid[braking] - brake_start) / brake_len
+    slow = (grid >= brake_start + brake_len) & (grid < throttle_back)
+    v[slow] = corner
+    accel = grid >= throttle_back
+    v[accel] = np.minimum(top, corner + 0.18 * (grid[accel] - throttle_back))
+    v = np.convolve(v, np.ones(40) / 40, mode="same")
+    v[:20], v[-20:] = v[20], v[-21]
+
+    # frames sampled at a fixed rate along the lap
+    t_grid = np.concatenate([[0.0], np.cumsum(np.diff(grid) / v[1:])])
+    t = np.arange(0, t_grid[-1], 1 / frame_rate)
+    s = np.interp(t, t_grid, grid)
+    speed = np.interp(s, grid, v)
+
+    brake = np.clip((s - brake_start) / 6, 0, 1) * np.clip((brake_start + brake_len - s) / 25, 0, 1)
+    brake = np.where(brake > 0, np.clip(brake + rng.normal(0, 0.02, len(s)), 0, 1), 0.0)
+    throttle = np.where((s >= brake_start - 3) & (s < throttle_back), 0.0, 1.0)
+    ramp = (s >= throttle_back) & (s < throttle_back + 60)
+    throttle[ramp] = (s[ramp] - throttle_back) / 60
+    throttle = np.clip(throttle + rng.normal(0, 0.01, len(s)) * (throttle < 1), 0, 1)
+    steer = (rng.normal(0.45, 0.08) * np.exp(-0.5 * ((s - apex1) / 35) ** 2)
+             - rng.normal(0.4, 0.08) * np.exp(-0.5 * ((s - apex2) / 35) ** 2))
+    steer = np.clip(steer + rng.normal(0, 0.005, len(s)), -1, 1)
+
+    offset = _smooth_noise(rng, s, 4, 2.5, 400)
+    if rng.random() < off_track_prob:
+        offset += rng.choice([-1, 1]) * 10 * np.exp(-0.5 * ((s - rng.uniform(380, 560)) / 25) ** 2)
+
+    ref_x = np.interp(s, ref_s, ref_line["WORLDPOSX"].to_numpy())
+    ref_y = np.interp(s, ref_s, ref_line["WORLDPOSY"].to_numpy())
+    fwd_x, fwd_y = np.gradient(ref_x), np.gradient(ref_y)
+    norm = np.hypot(fwd_x, fwd_y)
+    norm[norm == 0] = 1
+    fwd_x, fwd_y = fwd_x / norm, fwd_y / norm
+
+    return {
+        "SPEED": np.round(speed * 3.6),
+        "THROTTLE": throttle,
+        "STEER": steer,
+        "BRAKE": brake,
+        "GEAR": np.clip(np.round(speed / 12), 1, 8),
+        "ENGINERPM": 9000 + 2500 * np.sin(speed / 12),
+        "CURRENTLAPTIMEINMS": np.round(t * 1000),
+        "LAPDISTANCE": np.round(s),
+        "WORLDPOSITIONX": ref_x - offset * fwd_y,
+        "WORLDPOSITIONY": ref_y + offset * fwd_x,
+        "WORLDPOSITIONZ": np.full(len(s), 2.0),
+        "WORLDFORWARDDIRX": fwd_x,
+        "WORLDFORWARDDIRY": fwd_y,
+        "YAW": np.arctan2(fwd_x, fwd_y),
+        "PITCH": rng.normal(0.013, 0.005, len(s)),
+        "ROLL": rng.normal(0, 0.01, len(s)),
+    }
+
+
+def generate_race_data(n_laps, seed=0, laps_per_session=20, track=None, **lap_kwargs):
+    ''' Generate `n_laps` synthetic laps as a raw export DataFrame with RELEVANT_COLS. '''
+    rng = np.random.default_rng(seed)
+    track = track if track is not None else load_or_synthesise_track()
+    _, _, ref_line, turns = track
+    ref_s = _arc_length(ref_line["WORLDPOSX"].to_numpy(), ref_line["WORLDPOSY"].to_numpy())
+    apex_stations = _turn_stations(ref_line, turns, ref_s)
+
+    frames = []
+    for lap in range(n_laps):
+        session, lap_num = divmod(lap, laps_per_session)
+        lap_data = simulate_lap(rng, ref_line, ref_s, apex_stations, **lap_kwargs)
+        n = len(lap_data["SPEED"])
+        session_uid = np.uint64(10**18 + seed * 10**12 + session)
+        raw = {f"M_{name}_1": values for name, values in lap_data.items()}
+        raw.update({
+            "SESSION_GUID": f"guid-{seed}-{session}",
+            "M_CURRENTLAPNUM": lap_num + 1,
+            "M_SESSIONUID": session_uid,
+            "M_CURRENTLAPNUM_1": lap_num + 1,
+            "M_CURRENTLAPINVALID_1": 0,
+            "M_DRS_1": 0,
+            "M_TOTALDISTANCE_1": lap_data["LAPDISTANCE"] + lap_num * LAP_LENGTH,
+            "M_FRONTWHEELSANGLE": lap_data["STEER"] * 0.3,
+            "M_TRACKID": 0,
+            "R_STATUS": "Finished",
+            "LAPTIME": np.nan,
+            "CURRENTLAPTIME": lap_data["CURRENTLAPTIMEINMS"] / 1000,
+        })
+        for corner in ("RL", "RR", "FL", "FR"):
+            raw[f"M_BRAKESTEMPERATURE_{corner}_1"] = 500 + 300 * lap_data["BRAKE"]
+            raw[f"M_TYRESPRESSURE_{corner}_1"] = np.full(n, 23.5)
+        for axis in ("X", "Y", "Z"):
+            raw.setdefault(f"M_WORLDFORWARDDIR{axis}_1", np.zeros(n))
+            raw.setdefault(f"M_WORLDRIGHTDIR{axis}_1", np.zeros(n))
+        raw["M_WORLDRIGHTDIRX_1"] = lap_data["WORLDFORWARDDIRY"]
+        raw["M_WORLDRIGHTDIRY_1"] = -lap_data["WORLDFORWARDDIRX"]
+        frames.append(pd.DataFrame({col: np.broadcast_to(raw[col], n) for col in RELEVANT_COLS}))
+
+    return pd.concat(frames, ignore_index=True)
+
+
+def iter_race_data(n_laps, batch_laps=1000, seed=0, **kwargs):
+    ''' Yield generate_race_data batches so 10^5-10^6 laps never sit in memory at once. '''
+    for batch, start in enumerate(range(0, n_laps, batch_laps)):
+        yield generate_race_data(min(batch_laps, n_laps - start), seed=seed * 100003 + batch, **kwargs)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Write a synthetic telemetry export.")
+    parser.add_argument("n_laps", type=int)
+    parser.add_argument("--out", default=os.path.join(DATAFOLDER, "UNSW F12024.csv"))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--track-out", default=None,
+                        help="also write the synthetic f1sim-ref-* files to this folder")
+    args = parser.parse_args()
+
+    if args.track_out is not None:
+        write_track(args.track_out)
+    generate_race_data(args.n_laps, seed=args.seed).to_csv(args.out, index=False)
+    print(f"Wrote {args.n_laps} laps to {args.out}")
@@ -3,7 +3,29 @@ Main pipeline execution script.
 Run this from the project root directory.
 """
 import os
-from src.config import FEATURES, OUTPUT_FOLDER, SET_DISTANCES
+import argparse
+from src import config
+from src.config import (
+    FEATURES, MOMENTS, OUTPUT_FOLDER, SET_DISTANCES, TARGET_DISTANCE,
+    DENSE_DISTANCE_RANGE, DENSE_DISTANCE_STEP, RUN_REPORT_NAME, MODEL_BUNDLE_NAME,
+    PIPELINE_QUEUE_SIZE, COMPOSITE_CHANNELS, COMPOSITE_SECTOR_LENGTH
+)
+from src.geometry_utils import sample_at_distances
+from src.lap_table import LapTable
+from src.signals import DETECTOR_CHANNELS, add_signal_columns
+from src.table_io import load_output, resolve_format, write_table
+from src.model_bundle import write_model_bundle
+from src.out_of_core import (
+    parse_memory, session_sizes, plan_batches, spill_batches, load_batch, merge_batch_outputs,
+    pipelined as run_pipelined
+)
+from src.segment_features import corner_windows, distance_windows, segment_features
+from src.timing_gates import gates_from_ref_line, gate_times
+from src.composite_lap import composite_lap
+from src.online_moments import scan_moment_points
+from src.profiling import RunProfiler, progress
+from src.scheduler import Step, run_steps
+from src.feature_plan import plan_features
 from src.track_moments import (
     moment_generator,
     get_throttle_points,
@@ -13,13 +35,15 @@ from src.track_moments import (
 )
 from src.data_loader import (
     load_race_data,
+    race_data_files,
     load_entire_track
 )
 from src.data_cleaning import (
     remove_other_tracks,
     remove_na,
     filter_by_distance,
-    remove_lowinfo_laps
+    lap_quality,
+    dedup_laps
 )
 from src.track_features import (
     car_edge_distances,
@@ -31,10 +55,12 @@ from src.track_features import (
     car_from_ref_line
 )
 import sys
+import shutil
+import numpy as np
 import pandas as pd
 from pathlib import Path
-from tqdm import tqdm
-from functools import reduce
+from contextlib import nullcontext
+from functools import partial, reduce
 
 # Add src directory to Python path
 project_root = Path(__file__).parent
@@ -42,6 +68,10 @@ sys.path.insert(0, str(project_root / "src"))
 os.chdir(project_root)
 
 
+# points tables scan_moment_points returns, in its order
+SCANNED_POINTS = ["throttle", "braking", "steering"]
+
+
 def print_header(message):
     """Print a formatted header."""
     print("\n" + "=" * 70)
@@ -59,8 +89,83 @@ def print_info(message, indent=3):
     print(" " * indent + f" {message}")
 
 
-def build_dataset(df: pd.DataFrame = None, start_stage=0):
-    """Execute the complete data pipeline."""
+def build_dataset(df: pd.DataFrame = None, start_stage=0, progress_mode=None,
+                  profile_dir=None, trace_memory=False, columns=None,
+                  dense_step=None, dense_output="wide", gate_stations=None, segments=None,
+                  output_format=None, model_bundle=False, search=None, output_folder=None,
+                  writer=None, scheduler=None, jobs=None, data_source=None, multi_car=False,
+                  dedup=None, strict_quality=None):
+    """Execute the complete data pipeline.
+
+    data_source is the raw export to read when df is None: a file, a directory of
+    CSVs or a glob under DATAFOLDER (default config.RACE_DATA); several files are
+    parsed concurrently on `jobs` processes.
+    multi_car analyses every car slot in the export instead of slot 1 only: each
+    car's laps get their own lap_id (<session>_<car>_<lap>) and go through the
+    same steps, and processed_race_data gains a car_idx column.
+    dedup (default config.DEDUP_LAPS) collapses repeated copies of a lap, e.g. a
+    session present in several exports, before Stage 1 and writes their
+    provenance to lap_provenance.csv (see data_cleaning.dedup_laps).
+    strict_quality also removes laps failing the lap quality checks (backstep,
+    time reset, gaps) and drops duplicate and stationary frames; by default
+    (config.QUALITY_REJECT / QUALITY_DROP_FRAMES) only short laps are removed and
+    the checks are just reported in lap_quality.csv.
+    columns limits the final product to the given output columns (names or
+    patterns such as "BPS_*"); geometry steps, moment points and attributes
+    that none of them depend on are skipped (see src.feature_plan).
+    dense_step samples every dense_step metres over config.DENSE_DISTANCE_RANGE
+    (dense_output="long" without a step uses config.DENSE_DISTANCE_STEP):
+    dense_output="wide" adds dist_{d}_* columns on that grid to the SET_DISTANCES
+    ones, "long" keeps only the SET_DISTANCES columns and writes one row per
+    (lap, distance) to dense_features.
+    gate_stations (metres along the reference line) writes gate_times.csv with
+    position-based crossing and sector times per lap (see src.timing_gates).
+    segments adds per-lap window aggregates (min/mean speed, brake energy, time
+    braking/coasting/flat out, max offset) to the final product: a list of
+    "turns" (the f1sim-ref-turns corner boxes) and/or (start, end) distance ranges.
+    output_format ("parquet", "feather" or "csv", default config.OUTPUT_FORMAT)
+    is used for processed_race_data, final_data_product and dense_features;
+    without pyarrow they are written as CSV.
+    model_bundle also writes the final product as memory-mappable float32 arrays
+    (features, target, validity and NaN masks, manifest) in OUTPUT_FOLDER /
+    config.MODEL_BUNDLE_NAME (see src.model_bundle).
+    search ("kd" or "tracking", default config.NEAREST_SEGMENT_SEARCH) picks how
+    each frame's nearest track edge / reference line segment is found; "tracking"
+    walks each lap in time order from the previous frame's segment.
+    output_folder (default config.OUTPUT_FOLDER) receives every product.
+    scheduler ("serial", "thread" or "process", default config.SCHEDULER_EXECUTOR)
+    runs the independent Stage 1 geometry steps and the Stage 2 points tables
+    concurrently on `jobs` workers (src.scheduler); results do not change.
+    writer replaces table_io.write_table for the processed, dense and final tables
+    (the pipelined out-of-core mode passes one that hands writes to a writer thread).
+    progress_mode overrides config.PROGRESS_MODE ("full", "low" or "off").
+    A per-stage run report (wall/CPU time, rows, throughput, memory) is written
+    next to the outputs; profile_dir additionally dumps a cProfile file per stage
+    and trace_memory adds tracemalloc peaks to the report.
+    """
+
+    if progress_mode is not None:
+        config.PROGRESS_MODE = progress_mode
+    profiler = RunProfiler(trace_memory=trace_memory, profile_dir=profile_dir)
+    output_format = resolve_format(output_format)
+    search = search or config.NEAREST_SEGMENT_SEARCH
+    output_folder = OUTPUT_FOLDER if output_folder is None else Path(output_folder)
+    writer = writer or write_table
+    scheduler = scheduler or config.SCHEDULER_EXECUTOR
+    dedup = config.DEDUP_LAPS if dedup is None else dedup
+    reject = config.QUALITY_REJECT if strict_quality is None else strict_quality
+    drop_frames = config.QUALITY_DROP_FRAMES if strict_quality is None else strict_quality
+    jobs = jobs or config.SCHEDULER_WORKERS
+    dense_distances = []
+    if dense_step is None and dense_output == "long":
+        dense_step = DENSE_DISTANCE_STEP
+    if dense_step is not None:
+        start, end = DENSE_DISTANCE_RANGE
+        dense_distances = list(np.arange(start, end + dense_step / 2, dense_step))
+    dense_long = bool(dense_distances) and dense_output == "long"
+    # the dense grid adds to SET_DISTANCES so the baseline dist_{d}_* columns are kept
+    plan = plan_features(columns, distances=sorted(set(dense_distances) | set(SET_DISTANCES))
+                         if dense_distances and not dense_long else SET_DISTANCES)
 
     print_header("STARTING DATA PIPELINE")
 
@@ -68,72 +173,91 @@ def build_dataset(df: pd.DataFrame = None, start_stage=0):
     # STAGE 1: DATA PROCESSING
     # =====================================================================
 
+    # Reference track, read once for both stages (a missing track file fails here)
+    with profiler.stage("load_track"):
+        track_left, track_right, ref_line, turns = load_entire_track()
+
     if start_stage == 0:
-        total_steps = 7
+        total_steps = 5
 
         # Step 1: Load data
         print_step(1, total_steps, "Loading data...")
-        df = load_race_data("UNSW F12024.csv", df)
-        track_left, track_right, ref_line, turns = load_entire_track()
+        with profiler.stage("load") as rec:
+            df = load_race_data(data_source or config.RACE_DATA, df, workers=jobs,
+                                multi_car=multi_car)
+            rec["rows_out"] = len(df)
         print_info(f"Loaded {len(df):,} race records")
         print_info("Loaded track data (boundaries, reference line, turns)")
+        provenance = None
+        if dedup:
+            with profiler.stage("dedup", rows_in=len(df)) as rec:
+                df, provenance = dedup_laps(df)
+                rec["rows_out"] = len(df)
+            n_dropped = int((provenance["status"] != "kept").sum())
+            print_info(f"Collapsed {n_dropped:,} repeated lap copies "
+                       f"({len(provenance) - n_dropped:,} laps kept)")
 
         # Step 2: Clean data
         print_step(2, total_steps, "Cleaning data...")
         initial_count = len(df)
-        df = remove_other_tracks(df)
-        df = remove_na(df, subset=['WORLDPOSITIONX', "WORLDPOSITIONY"])
+        with profiler.stage("clean", rows_in=initial_count) as rec:
+            df = remove_other_tracks(df)
+            df = remove_na(df, subset=['WORLDPOSITIONX', "WORLDPOSITIONY"])
+            rec["rows_out"] = len(df)
         removed_count = initial_count - len(df)
         print_info(
             f"Removed {removed_count:,} records with missing/invalid data")
         print_info(f"Remaining: {len(df):,} records")
 
         # Step 3: Filter by distance
-        print_step(3, total_steps, "Filtering by distance and creating laps...")
+        print_step(3, total_steps, "Filtering by distance, creating laps and checking quality...")
         initial_count = len(df)
-        df = filter_by_distance(df)
-        removed_count = initial_count - len(df)
-        print_info(
-            f"Filtered {removed_count:,} records outside distance range")
-        df = add_lap_id(df)
-        print_info(
-            f"Created lap IDs for {len(df['lap_id'].unique()):,} unique laps")
-        df = remove_lowinfo_laps(df)
+        with profiler.stage("filter_laps", rows_in=initial_count) as rec:
+            df = filter_by_distance(df)
+            removed_count = initial_count - len(df)
+            print_info(
+                f"Filtered {removed_count:,} records outside distance range")
+            df = add_lap_id(df)
+            print_info(
+                f"Created lap IDs for {len(df['lap_id'].unique()):,} unique laps")
+            df, quality = lap_quality(df, reject=reject, drop_frames=drop_frames)
+            rec["rows_out"] = len(df)
         print_info(
-            f"Remaining: {len(df):,} records after low-info lap removal")
-
-        # Step 4: Compute track features
-        print_step(4, total_steps, "Computing track features...")
-        left_with_width, right_with_width = calculate_track_width(
-            track_left, track_right
-        )
-        print_info("Calculated track width at all points")
-        df = car_edge_distances(df, left_with_width, right_with_width)
-        print_info("Computed distances to track edges")
-        df = car_from_ref_line(df, ref_line)
-        print_info("Computed distances from reference line")
-
-        # Step 5: Compute apex features
-        print_step(5, total_steps, "Computing apex features...")
-        df = compute_distace_to_apex(df, turns)
-        print_info("Calculated distances to apex points")
-        df = compute_angle_to_apex(df, turns)
-        print_info("Calculated angles to apex points")
-
-        # Step 6: Identify off-track incidents
-        print_step(6, total_steps, "Identifying off-track incidents...")
-        df = id_outoftrack(df)
-        n_valid = len(df[df["invalid_lap"] == 0]["lap_id"].drop_duplicates())
-        n_invalid = len(df[df["invalid_lap"] == 1]["lap_id"].drop_duplicates())
-        print_info(f"Valid laps: {n_valid:,}")
-        print_info(f"Invalid laps (off-track): {n_invalid:,}")
-
-        # Step 7: Save processed data
-        print_step(7, total_steps, "Saving processed data...")
-        OUTPUT_FOLDER.mkdir(parents=True, exist_ok=True)
-        output_file = OUTPUT_FOLDER / "processed_race_data.csv"
-        df.to_csv(output_file, index=False)
+            f"Remaining: {len(df):,} records after lap quality checks")
+
+        # Step 4: Compute track, apex and off-track features (independent steps run
+        # concurrently with a thread/process scheduler)
+        print_step(4, total_steps, "Computing track, apex and off-track features...")
+        left_with_width = right_with_width = None
+        if plan.needs("edge_distances"):
+            with profiler.stage("track_width", rows_in=len(track_left) + len(track_right)):
+                left_with_width, right_with_width = calculate_track_width(
+                    track_left, track_right
+                )
+            print_info("Calculated track width at all points")
+        steps = geometry_steps(plan, left_with_width, right_with_width, ref_line, turns, search)
+        with profiler.stage("geometry", rows_in=len(df)) if scheduler != "serial" \
+                else nullcontext():
+            df, _ = run_steps(steps, data=df, executor=scheduler, workers=jobs,
+                              profiler=profiler if scheduler == "serial" else None)
+        print_info(f"Computed {', '.join(step.name for step in steps)} ({scheduler})")
+
+        if plan.needs("off_track"):
+            n_valid = len(df[df["invalid_lap"] == 0]["lap_id"].drop_duplicates())
+            n_invalid = len(df[df["invalid_lap"] == 1]["lap_id"].drop_duplicates())
+            print_info(f"Valid laps: {n_valid:,}")
+            print_info(f"Invalid laps (off-track): {n_invalid:,}")
+
+        # Step 5: Save processed data
+        print_step(5, total_steps, "Saving processed data...")
+        output_folder.mkdir(parents=True, exist_ok=True)
+        with profiler.stage("save_processed", rows_in=len(df)):
+            output_file = writer(df, output_folder, "processed_race_data", output_format)
+            quality.to_csv(output_folder / "lap_quality.csv", index=False)
+            if provenance is not None:
+                provenance.to_csv(output_folder / "lap_provenance.csv", index=False)
         print_info(f"Saved to: {output_file}")
+        print_info(f"Lap quality table: {output_folder / 'lap_quality.csv'}")
         print_info(
             f"Dataset shape: {df.shape[0]:,} rows × {df.shape[1]} columns")
 
@@ -145,175 +269,420 @@ def build_dataset(df: pd.DataFrame = None, start_stage=0):
 
     print_header("STAGE 2: CREATING FINAL FEATURE DATASET")
 
-    # Extract moment points
-    print("\nExtracting track moments...")
-    with tqdm(total=4, desc="Computing moment points", ncols=70) as pbar:
-        throttle_points = get_throttle_points(df)
-        pbar.update(1)
-        pbar.set_postfix_str("Throttle ")
-
-        braking_points = get_braking_points(df)
-        pbar.update(1)
-        pbar.set_postfix_str("Braking ")
-
-        apex_points = get_apex_points(df)
-        pbar.update(1)
-        pbar.set_postfix_str("Apex ")
-
-        steering_points = get_steering_points(df)
-        pbar.update(1)
-        pbar.set_postfix_str("Steering ")
-
-    features = FEATURES
-    all_moments = []
-
-    # Generate braking moments
-    print("\n Generating braking moments...")
-    with tqdm(total=2, desc="Braking features", ncols=70) as pbar:
-        brake_point_start = moment_generator(
-            df, "BPS", features,
-            braking_points[["lap_id", "BP_LD"]],
-            braking_points[["lap_id", "max_brake_LD"]]
-        )
-        pbar.update(1)
-
-        brake_point_end = moment_generator(
-            df, "BPE", features,
-            braking_points[["lap_id", "brake_decrease_LD"]],
-            braking_points[["lap_id", "brake_end_LD"]]
-        )
-        pbar.update(1)
-
-    # Generate throttle moments
-    print("Generating throttle moments...")
-    with tqdm(total=2, desc="Throttle features", ncols=70) as pbar:
-        throttle_point_start = moment_generator(
-            df, "THS", features,
-            throttle_points[["lap_id", "first_lift_LD"]],
-            throttle_points[["lap_id", "min_throttle_LD"]]
-        )
-        pbar.update(1)
-
-        throttle_point_end = moment_generator(
-            df, "THE", features,
-            throttle_points[["lap_id", "back_on_LD"]],
-            throttle_points[["lap_id", "back_on_max_LD"]]
-        )
-        pbar.update(1)
-
-    # Generate steering moments
-    print("Generating steering moments...")
-    with tqdm(total=3, desc="Steering features", ncols=70) as pbar:
-        steering_point_start = moment_generator(
-            df, "STS", features,
-            steering_points[["lap_id", "first_steer_LD"]],
-            steering_points[["lap_id", "max_pos_angle_steer_LD"]]
-        )
-        pbar.update(1)
+    # Sort the frames by (lap_id, LAPDISTANCE) once; every Stage 2 step reads lap slices of it
+    with profiler.stage("lap_table", rows_in=len(df)):
+        laps = LapTable(df)
+    print_info(f"Indexed {len(laps):,} laps")
 
-        steering_point_mid = moment_generator(
-            df, "STM", features,
-            steering_points[["lap_id", "middle_TP_LD"]]
-        )
-        pbar.update(1)
-
-        steering_point_end = moment_generator(
-            df, "STE", features,
-            steering_points[["lap_id", "end_steer_LD"]],
-            steering_points[["lap_id", "max_neg_LD"]]
-        )
-        pbar.update(1)
-
-    # Generate apex moments
-    print("Generating apex moments...")
-    with tqdm(total=2, desc="Apex features", ncols=70) as pbar:
-        apex_point1 = moment_generator(
-            df, "APX1", features,
-            apex_points[["lap_id", "apex1_LD"]]
-        )
-        pbar.update(1)
+    # throttle, braking and steering points come from one forward scan over the frames
+    # (src.online_moments) when all three are planned, otherwise from the batch detectors
+    scanned = all(name in plan.points for name in SCANNED_POINTS)
 
-        apex_point2 = moment_generator(
-            df, "APX2", features,
-            apex_points[["lap_id", "apex2_LD"]]
-        )
-        pbar.update(1)
+    # Per-frame changes and sign crossings of the channels the planned batch detectors read
+    signal_channels = [DETECTOR_CHANNELS[p] for p in plan.points
+                       if p in DETECTOR_CHANNELS and not scanned]
+    if signal_channels:
+        with profiler.stage("signals", rows_in=len(laps.data)):
+            add_signal_columns(laps, signal_channels)
+        print_info(f"Conditioned signals: {', '.join(signal_channels)}")
 
-    # Generate distance-based moments
+    # Extract moment points
+    print("\nExtracting track moments...")
+    points_functions = {
+        "throttle": get_throttle_points,
+        "braking": get_braking_points,
+        "apex": get_apex_points,
+        "steering": get_steering_points,
+    }
+    point_steps = [Step(name, points_functions[name], args=(laps,)) for name in plan.points
+                   if not (scanned and name in SCANNED_POINTS)]
+    if scanned:
+        point_steps.append(Step("scan", scan_moment_points, args=(laps.data,)))
+    with profiler.stage("moment_points", rows_in=len(df)):
+        _, points = run_steps(point_steps, executor=scheduler, workers=jobs)
+    if scanned:
+        points.update(zip(SCANNED_POINTS, points.pop("scan")))
+    print_info(f"Computed {', '.join(plan.points)} points")
+
+    # Generate moments, one family (braking, throttle, steering, apex) at a time
+    moment_frames = []
+    families = {}
+    for prefix in plan.moments:
+        families.setdefault(MOMENTS[prefix][0], []).append(prefix)
+
+    for family, prefixes in families.items():
+        print(f"Generating {family} moments...")
+        with profiler.stage(f"{family}_moments", rows_in=len(df)), \
+                progress(total=len(prefixes), desc=f"{family.capitalize()} features",
+                         ncols=70) as pbar:
+            for prefix in prefixes:
+                table, moment_col, extrema_col = MOMENTS[prefix]
+                extrema_LD = None
+                if extrema_col is not None and prefix in plan.extrema:
+                    extrema_LD = points[table][["lap_id", extrema_col]]
+                moment_frames.append(moment_generator(
+                    laps, prefix, plan.moments[prefix],
+                    points[table][["lap_id", moment_col]],
+                    extrema_LD
+                ))
+                pbar.update(1)
+
+    # Generate distance-based moments, all distances for all laps in one call
     print("Generating distance-based moments...")
-    laps_df = df[["lap_id"]].drop_duplicates().sort_values("lap_id").copy()
     dist_moments = []
-
-    for d in tqdm(SET_DISTANCES, desc="Distance features", ncols=70):
-        dist_df = laps_df.copy()
-        dist_df["dist"] = d
-        dist_moment = moment_generator(
-            df, f"dist_{d}", features, dist_df[["lap_id", "dist"]])
-        dist_moments.append(dist_moment)
+    with profiler.stage("distance_moments", rows_in=len(df)) as rec:
+        if plan.distances:
+            dist_features = [f for f in FEATURES
+                             if any(f in attrs for attrs in plan.distances.values())]
+            dist_moments.append(sample_at_distances(laps, list(plan.distances), dist_features))
+        if dense_long:
+            dense_df = sample_at_distances(laps, dense_distances, FEATURES, output="long")
+            rec["rows_out"] = len(dense_df)
+    print_info(f"Sampled {len(plan.distances) + len(dense_distances) * dense_long:,} "
+               f"distances per lap")
 
     # Generate target variable
     print("Generating target variable...")
-    dist_df = laps_df.copy()
-    dist_df["dist"] = 900
-    target_df = moment_generator(
-        df, "Target", ["CURRENTLAPTIMEINMS"], dist_df[["lap_id", "dist"]])
+    with profiler.stage("target", rows_in=len(df)):
+        target_df = sample_at_distances(laps, [TARGET_DISTANCE], ["CURRENTLAPTIMEINMS"])
+        target_df.columns = ["Target_CURRENTLAPTIMEINMS"]
+
+    # Position-based timing gates
+    if gate_stations:
+        print("Timing gates...")
+        with profiler.stage("timing_gates", rows_in=len(df)) as rec:
+            gates = gates_from_ref_line(ref_line, gate_stations)
+            gates_df = gate_times(df, gates, ref_line)
+            rec["rows_out"] = len(gates_df)
+        print_info(f"Timed {len(gates):,} gates")
+
+    # Segment aggregates over corner boxes and distance ranges
+    segment_df = None
+    if segments:
+        print("Aggregating segment features...")
+        with profiler.stage("segment_features", rows_in=len(df)) as rec:
+            windows = []
+            if "turns" in segments:
+                windows.append(corner_windows(turns))
+            ranges = [r for r in segments if r != "turns"]
+            if ranges:
+                windows.append(distance_windows(ranges))
+            segment_df = segment_features(laps, pd.concat(windows, ignore_index=True))
+            rec["rows_out"] = len(segment_df)
+        print_info(f"Added {segment_df.shape[1]:,} segment features")
 
     # Combine all features
     print("\nCombining all features...")
-    invalid_lap_flag = df[["lap_id", "invalid_lap"]].drop_duplicates(
-    ).set_index("lap_id").sort_index().copy()
-    all_moments = [
-        invalid_lap_flag,
-        brake_point_start,
-        brake_point_end,
-        throttle_point_start,
-        throttle_point_end,
-        steering_point_start,
-        steering_point_mid,
-        steering_point_end,
-        apex_point1,
-        apex_point2,
-        target_df
-    ] + dist_moments
-
-    def ensure_lap_id(df):
-        """Ensure 'lap_id' is a column, not an index."""
-        if df.index.name == "lap_id":
-            df = df.reset_index()
-        return df
-
-    all_moments = [ensure_lap_id(x) for x in all_moments]
-
-    # Merge all on lap_id (outer join to preserve all laps)
-    output = reduce(
-        lambda left, right: pd.merge(left, right, on="lap_id", how="outer"),
-        all_moments
-    )
-
-    output = output[output["Target_CURRENTLAPTIMEINMS"] != 0]
+    with profiler.stage("combine") as rec:
+        all_moments = moment_frames + [target_df] + dist_moments
+        if "invalid_lap" in plan.columns:
+            invalid_lap_flag = df[["lap_id", "invalid_lap"]].drop_duplicates(
+            ).set_index("lap_id").sort_index().copy()
+            all_moments = [invalid_lap_flag] + all_moments
+
+        def ensure_lap_id(df):
+            """Ensure 'lap_id' is a column, not an index."""
+            if df.index.name == "lap_id":
+                df = df.reset_index()
+            return df
+
+        all_moments = [ensure_lap_id(x) for x in all_moments]
+
+        # Merge all on lap_id (outer join to preserve all laps)
+        output = reduce(
+            lambda left, right: pd.merge(left, right, on="lap_id", how="outer"),
+            all_moments
+        )
+
+        output = output[output["Target_CURRENTLAPTIMEINMS"] != 0]
+        output = output[plan.columns]
+        if segment_df is not None:
+            output = output.merge(segment_df, left_on="lap_id", right_index=True, how="left")
+        rec["rows_out"] = len(output)
+
     # Save final output
     print("\nSaving final dataset...")
-    OUTPUT_FOLDER.mkdir(parents=True, exist_ok=True)
-    output_file = OUTPUT_FOLDER / "final_data_product.csv"
-    output.to_csv(output_file, index=False)
+    output_folder.mkdir(parents=True, exist_ok=True)
+    if dense_long:
+        with profiler.stage("save_dense", rows_in=len(dense_df)):
+            dense_file = writer(dense_df[dense_df["lap_id"].isin(output["lap_id"])],
+                                output_folder, "dense_features", output_format)
+        print_info(f"Saved dense samples to: {dense_file}")
+    if gate_stations:
+        gates_file = output_folder / "gate_times.csv"
+        gates_df[gates_df.index.isin(output["lap_id"])].to_csv(gates_file)
+        print_info(f"Saved gate times to: {gates_file}")
+    with profiler.stage("save_final", rows_in=len(output)):
+        output_file = writer(output, output_folder, "final_data_product", output_format)
     print_info(f"Saved to: {output_file}")
+    if model_bundle:
+        with profiler.stage("model_bundle", rows_in=len(output)):
+            bundle_folder = write_model_bundle(output, output_folder / MODEL_BUNDLE_NAME)
+        print_info(f"Saved model bundle to: {bundle_folder}")
     print_info(
         f"Final shape: {output.shape[0]:,} rows × {output.shape[1]} columns")
     print_info(f"Features: {output.shape[1]} total columns")
 
+    report_json, _ = profiler.write_report(output_folder, RUN_REPORT_NAME)
+
     print_header("PIPELINE COMPLETE! 🎉")
 
     print("\n Summary:")
     print(f"   • Total laps: {len(output):,}")
     print(f"   • Total features: {output.shape[1]}")
     print(f"   • Output file: {output_file}")
+    print(f"   • Run report: {report_json} ({profiler.total_wall_s():.1f}s total)")
 
     return output
 
 
+POSITION = ["WORLDPOSITIONX", "WORLDPOSITIONY"]
+HEADING = ["WORLDFORWARDDIRX", "WORLDFORWARDDIRY"]
+LAP_ORDER = ["lap_id", "CURRENTLAPTIMEINMS"]
+
+
+def geometry_steps(plan, track_left, track_right, ref_line, turns, search):
+    """Stage 1 feature steps the plan needs, with the columns each reads and adds."""
+    steps = []
+    if plan.needs("edge_distances"):
+        steps.append(Step("edge_distances", car_edge_distances, reads=POSITION + LAP_ORDER,
+                          writes=["left_dist", "right_dist", "l_width", "r_width"],
+                          args=(track_left, track_right), kwargs={"search": search}))
+    if plan.needs("ref_line"):
+        steps.append(Step("ref_line", car_from_ref_line, reads=POSITION + HEADING + LAP_ORDER,
+                          writes=["proj_from_ref"], args=(ref_line,), kwargs={"search": search}))
+    if plan.needs("apex_distance"):
+        steps.append(Step("apex_distance", compute_distace_to_apex, reads=POSITION,
+                          writes=["dist_apex_1", "dist_apex_2"], args=(turns,)))
+    if plan.needs("apex_angle"):
+        steps.append(Step("apex_angle", compute_angle_to_apex, reads=POSITION + HEADING,
+                          writes=["angle_to_apex1", "angle_to_apex2"], args=(turns,)))
+    if plan.needs("off_track"):
+        steps.append(Step("off_track", id_outoftrack,
+                          reads=["lap_id", "LAPDISTANCE", "left_dist", "right_dist",
+                                 "l_width", "r_width"],
+                          writes=["invalid_lap"]))
+    return steps
+
+
+def _run_batch(k, batch, writer=None, batch_folders=(), options=None):
+    # one out-of-core batch; module level so pipelined runs can send it to worker processes
+    print_header(f"BATCH {k + 1}/{len(batch_folders)}")
+    return len(build_dataset(batch, output_folder=batch_folders[k], writer=writer, **options))
+
+
+def build_out_of_core(max_memory, df: pd.DataFrame = None, source=None, spill_dir=None,
+                      keep_spill=False, output_folder=None, model_bundle=False,
+                      output_format=None, progress_mode=None, pipelined=False, workers=1,
+                      **kwargs):
+    """Run build_dataset in session batches that fit a memory budget.
+
+    max_memory is a size such as "4GB" (see src.out_of_core.parse_memory). The
+    raw export (source: a file, directory or glob, default config.RACE_DATA, or df) is streamed in
+    chunks and spilled to one CSV per batch of whole sessions under spill_dir
+    (default output_folder/spill, removed afterwards unless keep_spill). Each
+    batch runs Stage 1 and Stage 2 on its own and writes its products to the
+    spill folder; they are then merged into output_folder: lap-level tables are
+    concatenated, processed_race_data becomes a folder of part files. Other
+    keyword arguments are passed to build_dataset. Returns the final product.
+    pipelined overlaps parsing the next batch, running `workers` batches and
+    writing the previous batch's products (src.out_of_core.pipelined); the
+    budget is then shared by every batch in flight (parsing, queued, computing,
+    queued for writing and being written).
+    Lap deduplication runs per batch: every copy of a session (all export files)
+    is in the same batch, but copies filed under another SESSIONUID are only
+    collapsed when they happen to share a batch.
+    """
+    if progress_mode is not None:
+        config.PROGRESS_MODE = progress_mode
+    output_folder = OUTPUT_FOLDER if output_folder is None else Path(output_folder)
+    spill_dir = output_folder / "spill" if spill_dir is None else Path(spill_dir)
+    source = df if df is not None else race_data_files(source or config.RACE_DATA)
+    budget = parse_memory(max_memory)
+    # pipelined: one batch being parsed, PIPELINE_QUEUE_SIZE parsed and waiting, `workers`
+    # computing, PIPELINE_QUEUE_SIZE finished products queued and one being written
+    in_flight = workers + 2 * PIPELINE_QUEUE_SIZE + 2 if pipelined else 1
+    output_format = resolve_format(output_format)
+    profiler = RunProfiler()
+
+    print_header(f"OUT-OF-CORE RUN ({budget / 2 ** 30:.2f} GiB budget)")
+    with profiler.stage("session_sizes") as rec:
+        sizes, row_bytes = session_sizes(source, multi_car=kwargs.get("multi_car", False))
+        batch_of = plan_batches(sizes, row_bytes, budget / in_flight)
+        rec["rows_out"] = int(sizes.sum())
+    n_batches = int(batch_of.max()) + 1 if len(batch_of) else 0
+    print_info(f"{len(sizes):,} sessions, {int(sizes.sum()):,} frames -> {n_batches:,} batches")
+
+    with profiler.stage("spill", rows_in=int(sizes.sum())):
+        batch_files = spill_batches(source, batch_of, spill_dir,
+                                    multi_car=kwargs.get("multi_car", False))
+    del df, source
+
+    batch_folders = [spill_dir / batch_file.stem for batch_file in batch_files]
+
+    run_batch = partial(_run_batch, batch_folders=batch_folders,
+                        options=dict(kwargs, output_format=output_format,
+                                     progress_mode=config.PROGRESS_MODE))
+
+    with profiler.stage("batches", rows_in=int(sizes.sum())) as rec:
+        if pipelined:
+            load = partial(load_batch, multi_car=kwargs.get("multi_car", False))
+            laps, busy = run_pipelined(batch_files, load, run_batch, workers=workers)
+            print_info("Busy time: " + ", ".join(f"{stage} {s:.1f}s" for stage, s in busy.items()))
+        else:
+            laps = [run_batch(k, load_batch(path, kwargs.get("multi_car", False)))
+                    for k, path in enumerate(batch_files)]
+        rec["rows_out"] = sum(laps)
+
+    print_header("MERGING BATCHES")
+    with profiler.stage("merge") as rec:
+        output = merge_batch_outputs(batch_folders, output_folder, output_format)
+        rec["rows_out"] = len(output)
+    if model_bundle:
+        with profiler.stage("model_bundle", rows_in=len(output)):
+            bundle_folder = write_model_bundle(output, output_folder / MODEL_BUNDLE_NAME)
+        print_info(f"Saved model bundle to: {bundle_folder}")
+    if not keep_spill:
+        shutil.rmtree(spill_dir, ignore_errors=True)
+
+    report_json, _ = profiler.write_report(output_folder, RUN_REPORT_NAME)
+    print_info(f"Final shape: {output.shape[0]:,} rows × {output.shape[1]} columns")
+    print_info(f"Run report: {report_json} ({profiler.total_wall_s():.1f}s total)")
+    return output
+
+
+def build_composite_lap(df: pd.DataFrame = None, output_folder=None,
+                        sector_length=COMPOSITE_SECTOR_LENGTH, distance_range=(0, TARGET_DISTANCE),
+                        use_ref_line=False, output_format=None):
+    """Assemble the theoretical best run to TARGET_DISTANCE (Turns 1-2) from the
+    best mini-sectors of all valid laps (see src.composite_lap).
+
+    df is processed_race_data (default: read from output_folder, default
+    config.OUTPUT_FOLDER, including the part folders of out-of-core runs).
+    use_ref_line times the mini-sectors with gates along the reference line
+    instead of LAPDISTANCE. Writes composite_sectors.csv and the composite_lap
+    trace (winning laps, inputs and trajectory per sector) to output_folder and
+    returns (sectors, trace).
+    """
+    output_folder = OUTPUT_FOLDER if output_folder is None else Path(output_folder)
+    print_header("COMPOSITE LAP")
+    if df is None:
+        df = load_output("processed_race_data", folder=output_folder,
+                         columns=["lap_id", "LAPDISTANCE", "CURRENTLAPTIMEINMS", "invalid_lap"]
+                         + COMPOSITE_CHANNELS)
+    ref_line = load_entire_track()[2] if use_ref_line else None
+    sectors, trace = composite_lap(df, sector_length, distance_range, ref_line=ref_line)
+
+    n_valid = df.loc[df["invalid_lap"] == 0, "lap_id"].nunique() if "invalid_lap" in df.columns \
+        else df["lap_id"].nunique()
+    print_info(f"{len(sectors):,} mini-sectors of {sector_length:g} m from {n_valid:,} valid laps, "
+               f"won by {sectors['lap_id'].nunique():,} laps")
+    print_info(f"Theoretical best to {distance_range[1]:g} m: "
+               f"{sectors['COMPOSITE_TIME'].iloc[-1] / 1000:.3f}s")
+
+    output_folder.mkdir(parents=True, exist_ok=True)
+    sectors_file = output_folder / "composite_sectors.csv"
+    sectors.to_csv(sectors_file, index=False)
+    trace_file = write_table(trace, output_folder, "composite_lap", output_format)
+    print_info(f"Saved composite lap to: {sectors_file}, {trace_file}")
+    return sectors, trace
+
+
+def parse_segments(tokens):
+    """Turn CLI windows ("turns", "300:500") into build_dataset's segments list."""
+    if tokens is None:
+        return None
+    return [token if token == "turns" else tuple(float(v) for v in token.split(":"))
+            for token in tokens]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Build the ApexRacing dataset.")
+    parser.add_argument("--progress", choices=["full", "low", "off"], default=None,
+                        help="progress bar mode (default: config.PROGRESS_MODE)")
+    parser.add_argument("--profile", metavar="DIR", default=None,
+                        help="dump a cProfile file per stage into DIR")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="record tracemalloc peaks per stage (slower)")
+    parser.add_argument("--dense-step", nargs="?", type=float, default=None,
+                        const=DENSE_DISTANCE_STEP, metavar="METRES",
+                        help="sample features every METRES over DENSE_DISTANCE_RANGE "
+                             "(default: config.DENSE_DISTANCE_STEP)")
+    parser.add_argument("--dense-output", choices=["wide", "long"], default="wide",
+                        help="dense samples as final-product columns or a dense_features table")
+    parser.add_argument("--format", choices=["parquet", "feather", "csv"], default=None,
+                        help="output file format (default: config.OUTPUT_FORMAT)")
+    parser.add_argument("--gates", type=float, nargs="+", default=None, metavar="STATION",
+                        help="timing gates at these reference line stations (m)")
+    parser.add_argument("--segments", nargs="+", default=None, metavar="WINDOW",
+                        help="segment aggregates over 'turns' and/or START:END distance ranges")
+    parser.add_argument("--model-bundle", action="store_true",
+                        help="also write a memory-mappable float32 model bundle")
+    parser.add_argument("--search", choices=["kd", "tracking"], default=None,
+                        help="nearest segment search (default: config.NEAREST_SEGMENT_SEARCH)")
+    parser.add_argument("--max-memory", default=None, metavar="SIZE",
+                        help="out-of-core run in session batches within SIZE (e.g. 4GB)")
+    parser.add_argument("--keep-spill", action="store_true",
+                        help="keep the per-batch spill folder of an out-of-core run")
+    parser.add_argument("--pipelined", action="store_true",
+                        help="with --max-memory: overlap reading, computing and writing batches")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="batches computed at once with --pipelined")
+    parser.add_argument("--scheduler", choices=["serial", "thread", "process"], default=None,
+                        help="run independent feature steps concurrently "
+                             "(default: config.SCHEDULER_EXECUTOR)")
+    parser.add_argument("--jobs", type=int, default=None,
+                        help="scheduler / multi-file loading pool size (default: one per CPU)")
+    parser.add_argument("--data", default=None, metavar="SOURCE",
+                        help="raw export file, directory or glob under DATAFOLDER "
+                             "(default: config.RACE_DATA)")
+    parser.add_argument("--multi-car", action="store_true",
+                        help="analyse every car slot of the export, not only slot 1")
+    parser.add_argument("--no-dedup", dest="dedup", action="store_false", default=None,
+                        help="keep repeated copies of laps (see config.DEDUP_LAPS)")
+    parser.add_argument("--strict-quality", action="store_true", default=None,
+                        help="remove laps failing the lap quality checks and drop redundant "
+                             "frames (see config.QUALITY_REJECT)")
+    parser.add_argument("--composite-lap", nargs="?", type=float, default=None,
+                        const=COMPOSITE_SECTOR_LENGTH, metavar="METRES",
+                        help="also assemble the best run to TARGET_DISTANCE from mini-sectors "
+                             "of METRES (default: config.COMPOSITE_SECTOR_LENGTH)")
+    parser.add_argument("--columns", nargs="+", default=None, metavar="COLUMN",
+                        help="only build these output columns (patterns like 'BPS_*' allowed)")
+    args = parser.parse_args(argv)
+    if args.pipelined and not args.max_memory:
+        parser.error("--pipelined needs --max-memory to size the batches")
+    return args
+
+
 if __name__ == "__main__":
     try:
-        result = build_dataset()
+        args = parse_args()
+        options = dict(progress_mode=args.progress,
+                       columns=args.columns,
+                       dense_step=args.dense_step,
+                       dense_output=args.dense_output,
+                       gate_stations=args.gates,
+                       segments=parse_segments(args.segments),
+                       output_format=args.format,
+                       model_bundle=args.model_bundle,
+                       search=args.search,
+                       scheduler=args.scheduler,
+                       jobs=args.jobs,
+                       data_source=args.data,
+                       multi_car=args.multi_car,
+                       dedup=args.dedup,
+                       strict_quality=args.strict_quality)
+        if args.max_memory:
+            result = build_out_of_core(args.max_memory, keep_spill=args.keep_spill,
+                                       pipelined=args.pipelined, workers=args.workers,
+                                       **options)
+        else:
+            result = build_dataset(profile_dir=args.profile,
+                                   trace_memory=args.trace_memory,
+                                   **options)
+        if args.composite_lap:
+            build_composite_lap(sector_length=args.composite_lap, output_format=args.format)
         print("\n Pipeline executed successfully!\n")
     except Exception as e:
         print(f"\n Pipeline failed with error:")
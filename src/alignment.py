@@ -0,0 +1,245 @@
+"""
+Banded dynamic time warping of lap input traces.
+
+Comparing BRAKE / THROTTLE / STEER by raw LAPDISTANCE penalises a driver who
+does the same thing 10 m earlier as heavily as one who does something else.
+Here laps are resampled on a common distance grid and compared with DTW
+restricted to a Sakoe-Chiba band of ALIGN_BAND metres either side of the
+diagonal. The kernel walks the query one grid point at a time and updates the
+band cells of every reference lap at once, so one lap is compared with
+thousands of laps in a few numpy operations per cell of the band.
+
+    traces = lap_traces(load_output("processed_race_data"))
+    lap_dtw_distances(traces, "1000_1").head()
+    path, cost = dtw_path(traces.trace("1000_1"), traces.trace("1000_2"), band=6)
+    path_offsets(path, traces.step)   # metres lap 1000_2 is ahead (-) or behind (+)
+
+    python -m src.alignment processed_race_data.parquet 1000_1 --top 10
+"""
+
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from .config import (
+    ALIGN_BAND, ALIGN_BATCH_SIZE, ALIGN_CHANNELS, ALIGN_STEP, DENSE_DISTANCE_RANGE
+)
+from .geometry_utils import sample_at_distances
+from .table_io import read_table
+
+
+class LapTraces:
+    ''' Input channels of many laps sampled on one distance grid.
+
+    Attributes
+    ----------
+    lap_ids : np.ndarray
+        Lap ids, one per row of `values`.
+    distances : np.ndarray
+        Grid distances (m), one per trace point.
+    channels : list
+        Channel names in the last axis of `values`.
+    values : np.ndarray
+        float64 (n_laps, n_points, n_channels) traces.
+    '''
+
+    def __init__(self, lap_ids, distances, channels, values):
+        self.lap_ids = np.asarray(lap_ids)
+        self.distances = np.asarray(distances, dtype=np.float64)
+        self.channels = list(channels)
+        self.values = values
+        self._rows = {lap_id: i for i, lap_id in enumerate(self.lap_ids)}
+
+    @property
+    def step(self):
+        return float(self.distances[1] - self.distances[0]) if len(self.distances) > 1 else 0.0
+
+    def __len__(self):
+        return len(self.lap_ids)
+
+    def __contains__(self, lap_id):
+        return lap_id in self._rows
+
+    def rows(self, laps):
+        ''' Rows of `values` holding laps (KeyError for an unknown lap). '''
+        return np.array([self._rows[lap_id] for lap_id in laps], dtype=np.int64)
+
+    def trace(self, lap_id):
+        ''' (n_points, n_channels) trace of one lap. '''
+        return self.values[self._rows[lap_id]]
+
+    def band_points(self, band):
+        ''' A band half-width in metres as a number of grid points. '''
+        return int(round(band / self.step)) if self.step else 0
+
+
+def _fill_gaps(values):
+    # NaN samples take the previous sample of their lap, leading NaNs the first valid one
+    n_points = values.shape[1]
+    for reverse in (False, True):
+        v = values[:, ::-1] if reverse else values
+        last = np.where(np.isnan(v), 0, np.arange(n_points)[None, :, None])
+        np.maximum.accumulate(last, axis=1, out=last)
+        v[...] = np.take_along_axis(v, last, axis=1)
+    return values
+
+
+def lap_traces(data, channels=ALIGN_CHANNELS, step=ALIGN_STEP, distance_range=DENSE_DISTANCE_RANGE,
+               lap_col="lap_id"):
+    ''' Sample `channels` of every lap every `step` metres over distance_range (inclusive) with
+    geometry_utils.sample_at_distances. Samples it cannot place (outside the lap's frames)
+    are filled from the nearest sample of the same lap. data is a frame DataFrame or LapTable.
+    '''
+    start, end = distance_range
+    distances = np.arange(start, end + step / 2, step)
+    long = sample_at_distances(data, distances, list(channels), output="long", lap_col=lap_col)
+    n_points = len(distances)
+    values = long[list(channels)].to_numpy(dtype=np.float64, copy=True)
+    values = values.reshape(-1, n_points, len(channels))
+    lap_ids = long[lap_col].to_numpy()[::n_points]
+    return LapTraces(lap_ids, distances, channels, _fill_gaps(values))
+
+
+def _weights(weights, n_channels):
+    if weights is None:
+        return np.ones(n_channels)
+    weights = np.asarray(weights, dtype=np.float64)
+    if weights.shape != (n_channels,):
+        raise ValueError(f"Expected {n_channels} channel weights, got {weights.shape}")
+    return weights
+
+
+def _banded_dtw(query, refs, band, weights, keep_rows=False):
+    ''' Cumulative banded DTW cost of query (n, c) against every reference (n, c, batch),
+    computed one query point (row) at a time.
+
+    Row i holds D[i, j] for j = i - band .. i + band in cells k = j - i + band, with
+    D[i, j] = cost(i, j) + min(D[i-1, j-1], D[i-1, j], D[i, j-1]) and D[-1, -1] = 0, so
+    D[i-1, j-1] is cell k of the previous row and D[i-1, j] cell k + 1. Returns the final
+    cells D[n-1, n-1] (batch,), and with keep_rows also every row, (n, 2 band + 1, batch).
+    '''
+    n, batch = len(query), refs.shape[2]
+    width = 2 * band + 1
+    offsets = np.arange(-band, band + 1)
+    prev = np.full((width, batch), np.inf)
+    prev[band] = 0.0
+    up = np.empty_like(prev)
+    rows = np.empty((n, width, batch)) if keep_rows else None
+
+    for i in range(n):
+        j = i + offsets
+        outside = (j < 0) | (j >= n)
+        diff = refs[np.clip(j, 0, n - 1)] - query[i][None, :, None]
+        cost = np.einsum("kcb,c->kb", diff * diff, weights)
+        cost[outside] = np.inf
+
+        np.minimum(prev[:-1], prev[1:], out=up[:-1])
+        up[-1] = prev[-1]
+        cur = np.empty_like(prev)
+        cur[0] = up[0] + cost[0]
+        for k in range(1, width):
+            np.minimum(up[k], cur[k - 1], out=cur[k])
+            cur[k] += cost[k]
+        if keep_rows:
+            rows[i] = cur
+        prev = cur
+    return prev[band], rows
+
+
+def dtw_distances(query, references, band, weights=None, batch_size=ALIGN_BATCH_SIZE):
+    ''' Banded DTW distance from one trace to many.
+
+    query is (n_points, n_channels), references (n_refs, n_points, n_channels) on the same
+    grid; band is the Sakoe-Chiba half-width in grid points. The local cost is the squared
+    difference summed over channels with per-channel `weights` (default 1), so channels on
+    larger scales (e.g. SPEED) should be down-weighted. References are processed
+    batch_size at a time. A NaN in a trace gives a NaN distance.
+    '''
+    query = np.asarray(query, dtype=np.float64)
+    references = np.asarray(references, dtype=np.float64)
+    if references.ndim == 2:
+        references = references[None]
+    if references.shape[1:] != query.shape:
+        raise ValueError(f"References {references.shape[1:]} are not on the query's grid "
+                         f"{query.shape}")
+    weights = _weights(weights, query.shape[1])
+    band = max(int(band), 0)
+
+    out = np.empty(len(references))
+    for start in range(0, len(references), batch_size):
+        # (n_points, n_channels, batch) so each gathered band row is contiguous per channel
+        refs = np.ascontiguousarray(references[start:start + batch_size].transpose(1, 2, 0))
+        out[start:start + batch_size], _ = _banded_dtw(query, refs, band, weights)
+    return out
+
+
+def dtw_path(query, reference, band, weights=None):
+    ''' Optimal banded warping path between two traces and its cost.
+    Returns (path, cost), path being (length, 2) matched (query point, reference point) pairs
+    from (0, 0) to (n - 1, n - 1).
+    '''
+    query = np.asarray(query, dtype=np.float64)
+    reference = np.asarray(reference, dtype=np.float64)
+    if reference.shape != query.shape:
+        raise ValueError(f"Reference {reference.shape} is not on the query's grid {query.shape}")
+    band = max(int(band), 0)
+    cost, rows = _banded_dtw(query, np.ascontiguousarray(reference[:, :, None]), band,
+                             _weights(weights, query.shape[1]), keep_rows=True)
+    D = rows[:, :, 0]
+
+    i, k = len(query) - 1, band
+    path = [(i, i + k - band)]
+    while i > 0 or k != band:
+        # predecessors in band cells: (i-1, j-1) -> k, (i-1, j) -> k + 1, (i, j-1) -> k - 1
+        steps = [(i - 1, k), (i - 1, k + 1), (i, k - 1)]
+        steps = [(a, b) for a, b in steps if a >= 0 and 0 <= b <= 2 * band]
+        i, k = min(steps, key=lambda s: D[s])
+        path.append((i, i + k - band))
+    return np.array(path[::-1], dtype=np.int64), float(cost[0])
+
+
+def path_offsets(path, step=1.0):
+    ''' Mean (reference - query) grid offset of every query point along a warping path, times
+    step: a positive value means the reference reaches that part of the trace later in the lap.
+    '''
+    counts = np.bincount(path[:, 0])
+    return np.bincount(path[:, 0], weights=path[:, 1] - path[:, 0]) / counts * step
+
+
+def lap_dtw_distances(traces, lap_id, laps=None, band=ALIGN_BAND, weights=None,
+                      batch_size=ALIGN_BATCH_SIZE):
+    ''' Banded DTW distance (band in metres) from lap_id to every lap of traces (or only
+    `laps`), as a Series indexed by lap_id sorted from the closest lap; lap_id itself is 0.
+    '''
+    rows = np.arange(len(traces)) if laps is None else traces.rows(laps)
+    distances = dtw_distances(traces.trace(lap_id), traces.values[rows],
+                              traces.band_points(band), weights, batch_size)
+    result = pd.Series(distances, index=pd.Index(traces.lap_ids[rows], name="lap_id"),
+                       name="dtw_distance")
+    return result.sort_values(kind="stable")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("data", help="processed_race_data (.parquet, .feather or .csv)")
+    parser.add_argument("lap", help="lap id to compare every other lap with")
+    parser.add_argument("--channels", nargs="+", default=ALIGN_CHANNELS)
+    parser.add_argument("--weights", nargs="+", type=float, default=None)
+    parser.add_argument("--step", type=float, default=ALIGN_STEP, help="grid step (m)")
+    parser.add_argument("--band", type=float, default=ALIGN_BAND, help="band half-width (m)")
+    parser.add_argument("--top", type=int, default=10, help="closest laps to print")
+    args = parser.parse_args(argv)
+
+    data = read_table(args.data, columns=["lap_id", "LAPDISTANCE"] + args.channels)
+    data["lap_id"] = data["lap_id"].astype(str)
+    traces = lap_traces(data, args.channels, args.step)
+    if args.lap not in traces:
+        parser.error(f"lap {args.lap!r} is not in {args.data}")
+    distances = lap_dtw_distances(traces, args.lap, band=args.band, weights=args.weights)
+    print(distances.drop(args.lap).head(args.top).to_string())
+
+
+if __name__ == "__main__":
+    main()
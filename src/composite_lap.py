@@ -0,0 +1,108 @@
+"""
+Theoretical best lap assembled from the best mini-sectors of all valid laps.
+
+The run to TARGET_DISTANCE is cut into mini-sectors of COMPOSITE_SECTOR_LENGTH
+metres. The time every lap reaches every boundary is found in one vectorized
+pass (geometry_utils.sample_at_distances on LAPDISTANCE, or position-based
+timing gate crossings along the reference line), giving a laps x sectors matrix
+of sector times; the composite lap takes the fastest valid lap of each sector
+(a per-sector argmin) and stitches the frames of those sectors together.
+"""
+
+import numpy as np
+import pandas as pd
+
+from .config import COMPOSITE_CHANNELS, COMPOSITE_SECTOR_LENGTH, TARGET_DISTANCE
+from .geometry_utils import sample_at_distances
+from .lap_table import LapTable
+from .timing_gates import gate_times, gates_from_ref_line
+
+
+TIME_COL = "CURRENTLAPTIMEINMS"
+
+
+def sector_boundaries(start=0.0, end=TARGET_DISTANCE, length=COMPOSITE_SECTOR_LENGTH):
+    ''' Mini-sector boundaries every `length` metres from start, ending exactly at end. '''
+    inner = np.arange(start, end, length, dtype=np.float64)
+    return np.append(inner, float(end))
+
+
+def boundary_times(laps, boundaries, ref_line=None):
+    ''' (n_laps, n_boundaries) time (ms) each lap of a LapTable reaches each boundary, in
+    laps.lap_ids order. By default the lap time is sampled at LAPDISTANCE == boundary; with
+    ref_line the boundaries are reference line stations and the times are timing gate
+    crossings (a missing crossing of a gate at station 0 counts as the lap start, 0 ms).
+    '''
+    if ref_line is None:
+        sampled = sample_at_distances(laps, boundaries, [TIME_COL], output="wide")
+        return sampled.to_numpy(dtype=np.float64)
+
+    gates = gates_from_ref_line(ref_line, boundaries)
+    crossed = gate_times(laps.data, gates, ref_line, lap_col=laps.lap_col, sectors=False)
+    times = crossed.reindex(laps.lap_ids).to_numpy(dtype=np.float64, copy=True)
+    if boundaries[0] == 0:
+        times[:, 0] = np.nan_to_num(times[:, 0], nan=0.0)
+    return times
+
+
+def composite_lap(df, sector_length=COMPOSITE_SECTOR_LENGTH, distance_range=(0, TARGET_DISTANCE),
+                  channels=COMPOSITE_CHANNELS, ref_line=None, lap_col="lap_id"):
+    ''' Theoretical best run over distance_range from the best mini-sector times of the valid
+    laps (invalid_lap == 0 when that column is present) of frame data df.
+
+    Returns (sectors, trace):
+    sectors has one row per mini-sector with its start/end (m), the winning lap_col, its
+    SECTOR_TIME and the composite COMPOSITE_TIME at the sector end (both ms), and n_laps,
+    the number of laps timed over the sector. A sector no lap completed has a NaN time.
+    trace holds the winning laps' frames of each sector in order, with `channels`, the lap's
+    own CURRENTLAPTIMEINMS and COMPOSITE_TIME, the time on the composite lap.
+    '''
+    keep = df["LAPDISTANCE"].between(distance_range[0] - sector_length,
+                                     distance_range[1] + sector_length)
+    if "invalid_lap" in df.columns:
+        keep &= df["invalid_lap"] == 0
+    df = df[keep]  # frames a sector boundary can be timed from, one sector either side
+    positions = ["WORLDPOSITIONX", "WORLDPOSITIONY"] if ref_line is not None else []
+    columns = list(dict.fromkeys([lap_col, "LAPDISTANCE", TIME_COL] + positions + list(channels)))
+    # sorted integer lap codes: LapTable sorts them far faster than lap id strings
+    codes, lap_ids = pd.factorize(df[lap_col], sort=True)
+    frames = df[[c for c in columns[1:] if c in df.columns]].assign(**{lap_col: codes})
+    laps = LapTable(frames[[lap_col] + list(frames.columns[:-1])], lap_col=lap_col)
+    lap_ids = np.asarray(lap_ids)[laps.lap_ids]
+
+    boundaries = sector_boundaries(*distance_range, sector_length)
+    times = boundary_times(laps, boundaries, ref_line)
+    split = np.diff(times, axis=1)
+    split[~(split > 0)] = np.nan  # missing or non-increasing times are not sector times
+
+    timed = ~np.isnan(split)
+    has_time = timed.any(axis=0)
+    winner = np.argmin(np.where(timed, split, np.inf), axis=0)
+    best = np.where(has_time, split[winner, np.arange(split.shape[1])], np.nan)
+    composite_end = np.cumsum(np.nan_to_num(best))
+    composite_end[np.cumsum(~has_time) > 0] = np.nan
+
+    sectors = pd.DataFrame({
+        "sector": np.arange(len(best)),
+        "start": boundaries[:-1],
+        "end": boundaries[1:],
+        lap_col: np.where(has_time, lap_ids[winner], None),
+        "SECTOR_TIME": best,
+        "COMPOSITE_TIME": composite_end,
+        "n_laps": timed.sum(axis=0),
+    })
+
+    pieces = []
+    for s in np.flatnonzero(has_time):
+        lap = laps.lap_at(winner[s])
+        t0, t1 = times[winner[s], s], times[winner[s], s + 1]
+        t = lap[TIME_COL].to_numpy(dtype=np.float64)
+        piece = lap[(t >= t0) & (t < t1)].copy()
+        piece[lap_col] = lap_ids[winner[s]]
+        piece.insert(1, "sector", s)
+        piece["COMPOSITE_TIME"] = piece[TIME_COL] - t0 + (composite_end[s] - best[s])
+        pieces.append(piece)
+    trace = pd.concat(pieces, ignore_index=True) if pieces else pd.DataFrame(
+        columns=[lap_col, "sector"] + [c for c in columns[1:] if c in df.columns]
+        + ["COMPOSITE_TIME"])
+    return sectors, trace
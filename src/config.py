@@ -12,6 +12,28 @@ TRACK_DATA_FOLDER = Path("data")
 
 MIN_POINTS_LAP = 900
 
+# Output files (src.table_io): "parquet", "feather" or "csv"; without pyarrow installed
+# Parquet and Feather fall back to CSV (reported once per run)
+OUTPUT_FORMAT = "parquet"
+OUTPUT_FLOAT32 = True           # store float64 columns as float32 where values allow it
+OUTPUT_FLOAT32_TOLERANCE = 1e-6  # largest absolute float32 round-trip error a column may take
+OUTPUT_COMPRESSION = "zstd"     # Parquet codec; Feather is left uncompressed for memory-mapping
+OUTPUT_ROW_GROUP_SIZE = 128_000
+
+# Model bundle (src.model_bundle): folder name under OUTPUT_FOLDER and non-feature columns
+MODEL_BUNDLE_NAME = "model_bundle"
+MODEL_BUNDLE_TARGET = "Target_CURRENTLAPTIMEINMS"
+MODEL_BUNDLE_EXCLUDE = ["lap_id", "invalid_lap"]
+
+# Lap quality checks (data_cleaning.lap_quality), on the frames of each lap in lap time order
+QUALITY_MAX_BACKSTEP = 5        # m of LAPDISTANCE a frame may fall back before the lap is rejected
+QUALITY_MAX_DISTANCE_GAP = 50   # m of LAPDISTANCE between consecutive frames
+QUALITY_MAX_TIME_GAP = 1000     # ms of CURRENTLAPTIMEINMS between consecutive frames
+# By default only laps under MIN_POINTS_LAP frames are removed, as before the checks existed;
+# rejecting laps that fail them and dropping redundant frames are opt-in (--strict-quality)
+QUALITY_REJECT = False          # remove laps with a backstep, time reset or gap
+QUALITY_DROP_FRAMES = False     # drop duplicate and stationary frames before geometry
+
 
 # Column names
 RELEVANT_COLS = [
@@ -30,6 +52,36 @@ RELEVANT_COLS = [
 ]
 
 
+# Raw export(s) read by build_dataset: a file, a directory of CSVs or a glob, under DATAFOLDER
+RACE_DATA = "UNSW F12024.csv"
+
+# Multi-car runs (--multi-car): column holding each row's car slot
+CAR_COL = "car_idx"
+
+# Lap deduplication (data_cleaning.dedup_laps): column naming each frame's export file when
+# several are loaded, and the largest difference of a channel value between two copies of a
+# lap that are still the same lap
+SOURCE_COL = "SOURCE_FILE"
+DEDUP_LAPS = True
+DEDUP_TOLERANCE = 1e-3
+
+# Compact dtypes for raw export columns that no feature reads (small integers and low-precision
+# channels as float32, labels as category); the feature channels stay float64
+INGEST_DTYPES = {
+    **{c: "float32" for c in [
+        "M_GEAR_1", "M_ENGINERPM_1", "M_DRS_1", "M_CURRENTLAPINVALID_1", "M_TRACKID",
+        "M_BRAKESTEMPERATURE_RL_1", "M_BRAKESTEMPERATURE_RR_1",
+        "M_BRAKESTEMPERATURE_FL_1", "M_BRAKESTEMPERATURE_FR_1",
+        "M_TYRESPRESSURE_RL_1", "M_TYRESPRESSURE_RR_1",
+        "M_TYRESPRESSURE_FL_1", "M_TYRESPRESSURE_FR_1",
+        "M_WORLDFORWARDDIRZ_1", "M_WORLDRIGHTDIRX_1", "M_WORLDRIGHTDIRY_1",
+        "M_WORLDRIGHTDIRZ_1", "M_FRONTWHEELSANGLE",
+    ]},
+    "SESSION_GUID": "category",
+    SOURCE_COL: "category",
+    "R_STATUS": "category",
+}
+
 # Column renaming dictionary
 RENAME_COLS = {
 }
@@ -53,3 +105,77 @@ FEATURES = [
 ]
 
 SET_DISTANCES = [360, 430, 530]
+TARGET_DISTANCE = 900
+
+# Dense distance sampling (build_dataset(dense_step=...)): grid from start to end inclusive,
+# and the step used by --dense-step without a value or dense_output="long" without a step
+DENSE_DISTANCE_RANGE = (0, MAX_DISTANCE)
+DENSE_DISTANCE_STEP = 10
+
+# Signal conditioning (src.signals) shared by the moment detectors
+SIGNAL_CHANNELS = ["THROTTLE", "BRAKE", "STEER"]
+SIGNAL_SMOOTH_WINDOW = 3
+
+# Segment aggregates (src.segment_features): phase thresholds for time braking / coasting /
+# at full throttle
+SEGMENT_BRAKE_ON = 0.05
+SEGMENT_COAST_THROTTLE = 0.05
+SEGMENT_FULL_THROTTLE = 0.99
+
+# Nearest track segment search for car_edge_distances / car_from_ref_line:
+# "kd" queries the two nearest points per frame, "tracking" warm-starts each frame from the
+# previous frame's segment, checking TRACKING_WINDOW segments either side and falling back
+# to the global KD-tree after moves longer than TRACKING_JUMP metres
+NEAREST_SEGMENT_SEARCH = "kd"
+TRACKING_WINDOW = 3
+TRACKING_JUMP = 5.0
+
+# Out-of-core runs (run_pipeline --max-memory, src.out_of_core): rows per streamed CSV chunk
+# and the peak pipeline memory per raw frame, as a multiple of the frame's loaded size
+# (intermediate copies and the added geometry / signal columns)
+OUT_OF_CORE_CHUNKSIZE = 500_000
+OUT_OF_CORE_EXPANSION = 12
+# Pipelined out-of-core runs (--pipelined): batches parsed ahead / products waiting to be written
+PIPELINE_QUEUE_SIZE = 2
+
+# Stage scheduler (src.scheduler) for the independent geometry steps and points tables:
+# "serial", "thread" or "process", with SCHEDULER_WORKERS pool slots (None: one per CPU)
+SCHEDULER_EXECUTOR = "serial"
+SCHEDULER_WORKERS = None
+
+# Lap alignment (src.alignment): channels compared, resampling step (m) over
+# DENSE_DISTANCE_RANGE, Sakoe-Chiba band half-width (m) and reference laps per kernel batch
+ALIGN_CHANNELS = ["BRAKE", "THROTTLE", "STEER"]
+ALIGN_STEP = 5.0
+ALIGN_BAND = 30.0
+ALIGN_BATCH_SIZE = 4096
+
+# Composite lap (src.composite_lap): mini-sector length (m) over 0..TARGET_DISTANCE and the
+# channels copied from each winning sector into the composite trace
+COMPOSITE_SECTOR_LENGTH = 50.0
+COMPOSITE_CHANNELS = [
+    "SPEED", "THROTTLE", "BRAKE", "STEER", "GEAR", "WORLDPOSITIONX", "WORLDPOSITIONY"
+]
+
+# Timing gates (src.timing_gates): gate length either side of the reference line and the
+# largest reference line distance (m) a frame pair may span and still be tested
+TIMING_GATE_HALF_WIDTH = 20
+TIMING_GATE_MAX_SPAN = 50
+
+# Moment prefix -> (points table, moment distance column, extrema distance column)
+MOMENTS = {
+    "BPS": ("braking", "BP_LD", "max_brake_LD"),
+    "BPE": ("braking", "brake_decrease_LD", "brake_end_LD"),
+    "THS": ("throttle", "first_lift_LD", "min_throttle_LD"),
+    "THE": ("throttle", "back_on_LD", "back_on_max_LD"),
+    "STS": ("steering", "first_steer_LD", "max_pos_angle_steer_LD"),
+    "STM": ("steering", "middle_TP_LD", None),
+    "STE": ("steering", "end_steer_LD", "max_neg_LD"),
+    "APX1": ("apex", "apex1_LD", None),
+    "APX2": ("apex", "apex2_LD", None),
+}
+
+# Instrumentation
+# "full": all progress bars, "low": no per-row bars in the geometry loops, "off": no bars
+PROGRESS_MODE = "full"
+RUN_REPORT_NAME = "run_report"
@@ -1,5 +1,9 @@
+import numpy as np
 import pandas as pd
-from .config import TRACK_ID, MAX_DISTANCE, MIN_POINTS_LAP
+from .config import (
+    TRACK_ID, MAX_DISTANCE, MIN_POINTS_LAP, QUALITY_MAX_BACKSTEP, QUALITY_MAX_DISTANCE_GAP,
+    QUALITY_MAX_TIME_GAP, QUALITY_REJECT, QUALITY_DROP_FRAMES, CAR_COL, DEDUP_TOLERANCE, SOURCE_COL
+)
 
 
 def remove_other_tracks(data: pd.DataFrame) -> pd.DataFrame:
@@ -28,3 +32,212 @@ def remove_lowinfo_laps(data: pd.DataFrame, min_points=MIN_POINTS_LAP) -> pd.Dat
     data = data[~data["lap_id"].isin(lap_ids.index)]
     print(f"Removed {len_data - len(data)} rows")
     return data
+
+
+QUALITY_COLUMNS = [
+    "lap_id", "n_frames", "n_duplicate", "n_stationary", "n_backsteps", "n_time_resets",
+    "n_distance_gaps", "n_time_gaps", "max_distance_gap", "max_time_gap", "n_kept", "reason"
+]
+
+
+def lap_quality(data: pd.DataFrame, min_points=MIN_POINTS_LAP, max_backstep=QUALITY_MAX_BACKSTEP,
+                max_distance_gap=QUALITY_MAX_DISTANCE_GAP, max_time_gap=QUALITY_MAX_TIME_GAP,
+                reject=QUALITY_REJECT, drop_frames=QUALITY_DROP_FRAMES):
+    """
+    Runs every lap quality check in one vectorized pass over the frames grouped by lap
+    and ordered by CURRENTLAPTIMEINMS (then LAPDISTANCE) within each lap, since exports are
+    not guaranteed to be in time order.
+
+    Per lap it counts duplicate frames (same time, distance and position as the previous
+    frame), stationary frames (speed 0 and the same distance and position as the previous
+    frame), LAPDISTANCE steps back by more than max_backstep, time resets (two frames at
+    the same CURRENTLAPTIMEINMS more than max_backstep apart, as when a restarted lap
+    repeats its lap times) and distance/time gaps above the limits.
+
+    Laps with fewer than min_points frames are always removed. With reject, laps failing
+    any other check are removed too, and with drop_frames duplicate and stationary frames
+    are dropped before the min_points check; both default to off, so by default the kept
+    laps and frames are those of remove_lowinfo_laps.
+
+    Returns the cleaned data and a per-lap quality table (QUALITY_COLUMNS); `reason` is empty
+    for kept laps.
+    """
+    codes, lap_ids = pd.factorize(data["lap_id"])
+    t = data["CURRENTLAPTIMEINMS"].to_numpy(dtype=np.float64)
+    ld = data["LAPDISTANCE"].to_numpy(dtype=np.float64)
+    order = np.lexsort((ld, t, codes))
+    lap = codes[order]
+    t, ld = t[order], ld[order]
+    n_laps = len(lap_ids)
+
+    def column(name):
+        return data[name].to_numpy(dtype=np.float64)[order]
+
+    x, y, speed = column("WORLDPOSITIONX"), column("WORLDPOSITIONY"), column("SPEED")
+
+    # differences to the previous frame of the same lap (the first frame of a lap has none)
+    same_lap = np.zeros(len(lap), dtype=bool)
+    same_lap[1:] = lap[1:] == lap[:-1]
+    dt = np.zeros(len(lap))
+    dld = np.zeros(len(lap))
+    dt[1:], dld[1:] = np.diff(t), np.diff(ld)
+    same_pos = np.zeros(len(lap), dtype=bool)
+    same_pos[1:] = (x[1:] == x[:-1]) & (y[1:] == y[:-1])
+
+    still = same_lap & same_pos & (dld == 0)
+    duplicate = still & (dt == 0)
+    stationary = still & ~duplicate & (speed == 0)
+    backstep = same_lap & (dld < -max_backstep)
+    reset = same_lap & (dt == 0) & (np.abs(dld) > max_backstep)
+    distance_gap = same_lap & (dld > max_distance_gap)
+    time_gap = same_lap & (dt > max_time_gap)
+
+    dropped = (duplicate | stationary) if drop_frames else np.zeros(len(lap), dtype=bool)
+
+    def count(mask):
+        return np.bincount(lap, weights=mask, minlength=n_laps).astype(int)
+
+    def lap_max(values):
+        out = np.zeros(n_laps)
+        np.maximum.at(out, lap[same_lap], values[same_lap])
+        return out
+
+    quality = pd.DataFrame({
+        "lap_id": lap_ids,
+        "n_frames": np.bincount(lap, minlength=n_laps),
+        "n_duplicate": count(duplicate),
+        "n_stationary": count(stationary),
+        "n_backsteps": count(backstep),
+        "n_time_resets": count(reset),
+        "n_distance_gaps": count(distance_gap),
+        "n_time_gaps": count(time_gap),
+        "max_distance_gap": lap_max(dld),
+        "max_time_gap": lap_max(dt),
+    })
+    quality["n_kept"] = quality["n_frames"] - count(dropped)
+
+    reason = np.full(n_laps, "", dtype=object)
+    # the first failed check is reported
+    checks = [(quality["n_time_resets"] > 0, "time reset"),
+              (quality["n_backsteps"] > 0, "distance backstep"),
+              (quality["n_distance_gaps"] > 0, "distance gap"),
+              (quality["n_time_gaps"] > 0, "time gap")] if reject else []
+    for check, label in checks + [(quality["n_kept"] < min_points, "too few points")]:
+        reason[check.to_numpy() & (reason == "")] = label
+    quality["reason"] = reason
+
+    keep = np.zeros(len(data), dtype=bool)
+    keep[order] = (quality["reason"].to_numpy()[lap] == "") & ~dropped
+    print(f"Lap quality: removed {int((quality['reason'] != '').sum())} of {n_laps} laps "
+          f"and {int(dropped.sum())} redundant frames")
+    return data[keep], quality[QUALITY_COLUMNS]
+
+
+PROVENANCE_COLUMNS = [
+    "copy", "source", "lap_key", "n_frames", "content_mean", "status", "kept_copy"
+]
+
+# frame order used to line two copies of a lap up before comparing them
+_DEDUP_ORDER = ["CURRENTLAPTIMEINMS", "LAPDISTANCE"]
+
+
+def _same_content(a, b, tolerance):
+    # frames of two copies (already in canonical order) agree within tolerance, NaNs aligned
+    nan_a, nan_b = np.isnan(a), np.isnan(b)
+    if (nan_a != nan_b).any():
+        return False
+    with np.errstate(invalid="ignore"):
+        return bool((np.abs(a - b)[~nan_a] <= tolerance).all())
+
+
+def dedup_laps(data: pd.DataFrame, tolerance=DEDUP_TOLERANCE, source_col=SOURCE_COL):
+    """
+    Collapses repeated copies of laps before Stage 1, e.g. a session that appears in
+    several export files.
+
+    A copy is the frames of one (source file, SESSIONUID, car, CURRENTLAPNUM). A copy is a
+    "duplicate" of an earlier copy when both have the same number of frames and, with frames
+    ordered by lap time and distance, every channel value (identifiers and the source left
+    out) agrees within `tolerance`, so re-exports that differ only in the last digits match
+    wherever those digits round. Candidates are found by bucketing each copy's mean channel
+    value (content_mean) in steps of `tolerance` and checking the copy's own and both
+    neighbouring buckets; only those candidates are compared frame by frame. Of the copies
+    left for one lap key, the one with the most frames is kept and the others are dropped
+    as "superseded".
+
+    Out-of-core runs deduplicate each batch on its own. Batches hold whole sessions from all
+    export files, so copies sharing a SESSIONUID are always compared; copies of a lap filed
+    under another session id can be missed when they land in different batches.
+
+    Returns the remaining frames and a provenance table (PROVENANCE_COLUMNS) with one row per
+    copy; kept_copy is the copy that stands in for it.
+    """
+    key_cols = ["SESSIONUID"] + [c for c in [CAR_COL, "CURRENTLAPNUM"] if c in data.columns]
+    copy_cols = ([source_col] if source_col in data.columns else []) + key_cols
+    content = [c for c in data.columns
+               if c not in copy_cols + ["SESSION_GUID"] and data[c].dtype.kind in "biuf"]
+    order_cols = [content.index(c) for c in _DEDUP_ORDER if c in content]
+
+    # copies numbered in order of first appearance
+    copy_codes = data.groupby(copy_cols, sort=False, dropna=False).ngroup().to_numpy()
+    copies = data[copy_cols].drop_duplicates()
+    values = data[content].to_numpy(dtype=np.float64)
+
+    n_copies = len(copies)
+    n_frames = np.bincount(copy_codes, minlength=n_copies)
+    valid = ~np.isnan(values)
+    sums = np.bincount(copy_codes, weights=np.where(valid, values, 0.0).sum(axis=1),
+                       minlength=n_copies)
+    counts = np.bincount(copy_codes, weights=valid.sum(axis=1), minlength=n_copies)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        content_mean = sums / counts
+    # near-identical copies have means within tolerance, i.e. in the same or a neighbouring bucket
+    bucket = np.floor(np.nan_to_num(content_mean) / tolerance).astype(np.int64)
+
+    rows = np.argsort(copy_codes, kind="stable")
+    offsets = np.concatenate([[0], np.cumsum(n_frames)])
+
+    def frames(copy):
+        block = values[rows[offsets[copy]:offsets[copy + 1]]]
+        if order_cols:
+            block = block[np.lexsort([block[:, c] for c in reversed(order_cols)])]
+        return block
+
+    kept_copy = np.arange(n_copies)
+    representatives = {}
+    for copy in range(n_copies):
+        block = None
+        for b in (bucket[copy], bucket[copy] - 1, bucket[copy] + 1):
+            for other in representatives.get((n_frames[copy], b), []):
+                block = frames(copy) if block is None else block
+                if _same_content(block, frames(other), tolerance):
+                    kept_copy[copy] = other
+                    break
+            if kept_copy[copy] != copy:
+                break
+        else:
+            representatives.setdefault((n_frames[copy], bucket[copy]), []).append(copy)
+
+    table = copies.reset_index(drop=True)
+    table["copy"] = np.arange(n_copies)
+    table["n_frames"] = n_frames
+    table["content_mean"] = content_mean
+    table["lap_key"] = table[key_cols].astype(str).agg("_".join, axis=1)
+    table["source"] = table[source_col] if source_col in table.columns else ""
+    table["kept_copy"] = kept_copy
+    table["status"] = np.where(kept_copy == table["copy"], "kept", "duplicate")
+
+    # one copy per lap key: the longest (earliest on ties)
+    kept = table[table["status"] == "kept"]
+    longest = kept.sort_values(["n_frames", "copy"], ascending=[False, True], kind="stable")
+    best = longest.groupby("lap_key", sort=False)["copy"].first()
+    superseded = (table["status"] == "kept") & (table["lap_key"].map(best) != table["copy"])
+    table.loc[superseded, "status"] = "superseded"
+    table.loc[superseded, "kept_copy"] = table.loc[superseded, "lap_key"].map(best)
+    # a duplicate of a superseded copy points at the copy that replaced it
+    table["kept_copy"] = table["kept_copy"].map(table.set_index("copy")["kept_copy"])
+
+    keep = (table["status"] == "kept").to_numpy()[copy_codes]
+    if keep.all():
+        return data, table[PROVENANCE_COLUMNS]
+    return data[keep].reset_index(drop=True), table[PROVENANCE_COLUMNS]
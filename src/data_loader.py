@@ -1,7 +1,21 @@
-import pandas as pd
+import glob
 import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
 
-from .config import DATAFOLDER, RELEVANT_COLS, RENAME_COLS
+from .config import (
+    CAR_COL, DATAFOLDER, INGEST_DTYPES, RACE_DATA, RELEVANT_COLS, RENAME_COLS, SOURCE_COL
+)
+
+
+# per-car channels ("<name>_<slot>"); the rest of RELEVANT_COLS describe the whole frame
+SLOT_BASES = [c[:-2] for c in RELEVANT_COLS if c.endswith("_1")]
+_SLOT = re.compile(r"^(.+)_(\d+)$")
 
 
 def load_entire_track():
@@ -17,12 +31,110 @@ def load_entire_track():
     return track_left, track_right, track_line, turns
 
 
-def load_race_data(file_name, data=None):
+def race_data_files(source=RACE_DATA):
+    ''' Export CSVs named by `source`: a file, a directory (every *.csv in it, not the
+    f1sim-ref-* track files) or a glob pattern, relative to DATAFOLDER unless absolute.
+    Returns sorted paths; raises FileNotFoundError when nothing matches.
+    '''
+    path = Path(source)
+    if not path.is_absolute():
+        path = Path(DATAFOLDER) / path
+    if path.is_dir():
+        files = [p for p in path.glob("*.csv") if not p.name.startswith("f1sim-ref-")]
+    elif glob.has_magic(str(path)):
+        files = [Path(p) for p in glob.glob(str(path))]
+    else:
+        files = [path] if path.exists() else []
+    if not files:
+        raise FileNotFoundError(f"No race data CSVs match {path}")
+    return sorted(files)
+
+
+def export_column(column, multi_car=False):
+    ''' Whether a raw export column is loaded: RELEVANT_COLS, plus the other car slots'
+    copies of the per-car channels with multi_car.
+    '''
+    if column in RELEVANT_COLS or column == SOURCE_COL:
+        return True
+    match = _SLOT.match(column) if multi_car else None
+    return match is not None and match.group(1) in SLOT_BASES
+
+
+def car_slots(columns):
+    ''' Car slots k for which every per-car channel has a "<name>_<k>" column. '''
+    columns = set(columns)
+    found = {int(m.group(2)) for m in map(_SLOT.match, columns) if m and m.group(1) in SLOT_BASES}
+    return sorted(k for k in found if all(f"{base}_{k}" in columns for base in SLOT_BASES))
+
+
+def stack_car_slots(data, slots=None):
+    ''' Wide-to-long reshape of a raw export with several car slots: one row per
+    (frame, slot) in RELEVANT_COLS layout (each car's channels under the "_1" names) plus
+    a car_idx column. Each channel is gathered for all slots in one array operation;
+    frame-level columns are repeated per slot, except M_CURRENTLAPNUM, which becomes
+    the car's own M_CURRENTLAPNUM_<k> so laps are numbered per car.
+    '''
+    slots = car_slots(data.columns) if slots is None else list(slots)
+    n = len(slots)
+    long = {}
+    for column in RELEVANT_COLS:
+        if column.endswith("_1"):
+            # (frames, slots) -> frame-major (frame 0 slot 1, frame 0 slot 2, ...)
+            block = data[[f"{column[:-2]}_{k}" for k in slots]]
+            long[column] = block.to_numpy().ravel()
+        else:
+            long[column] = np.repeat(data[column].to_numpy(), n)
+    long["M_CURRENTLAPNUM"] = long["M_CURRENTLAPNUM_1"]
+    long[CAR_COL] = np.tile(np.asarray(slots, dtype=np.int16), len(data))
+    return pd.DataFrame(long)
+
+
+def compact_dtypes(data):
+    ''' Cast the raw export columns in INGEST_DTYPES (channels the features never read, and
+    string labels) to their compact dtypes, so every file and batch ends up with the same dtypes.
+    '''
+    casts = {c: t for c, t in INGEST_DTYPES.items() if c in data.columns and data[c].dtype != t}
+    return data.astype(casts) if casts else data
+
+
+def read_export(path, multi_car=False):
+    ''' One export CSV: RELEVANT_COLS only (every car slot, stacked, with multi_car),
+    compact dtypes where they are declared.
+    '''
+    dtypes = {c: t for c, t in INGEST_DTYPES.items() if t != "category"}
+    if not multi_car:
+        return compact_dtypes(pd.read_csv(path, usecols=RELEVANT_COLS, dtype=dtypes))
+    data = pd.read_csv(path, usecols=lambda c: export_column(c, multi_car=True))
+    return compact_dtypes(stack_car_slots(data))
+
+
+def load_race_data(file_name=RACE_DATA, data=None, workers=None, multi_car=False):
+    ''' Raw export(s) as a DataFrame with the M_ / _1 affixes stripped from RELEVANT_COLS.
+    file_name may be a file, directory or glob (see race_data_files); several files are
+    parsed concurrently on `workers` processes (default one per CPU) and concatenated in
+    file name order. A DataFrame passed as `data` is used instead of reading.
+    multi_car analyses every car slot of the export: rows are (frame, car) pairs with a
+    car_idx column (see stack_car_slots). When several files are read, SOURCE_FILE
+    names each frame's file.
+    '''
     if data is None:
-        data = pd.read_csv(os.path.join(DATAFOLDER, file_name),
-                           usecols=RELEVANT_COLS)
+        files = race_data_files(file_name)
+        read = partial(read_export, multi_car=multi_car)
+        if len(files) == 1 or workers == 1:
+            parts = [read(path) for path in files]
+        else:
+            with ProcessPoolExecutor(min(workers or os.cpu_count() or 1, len(files))) as pool:
+                parts = list(pool.map(read, files))
+        if len(parts) > 1:
+            for path, part in zip(files, parts):
+                part[SOURCE_COL] = path.name
+        data = parts[0] if len(parts) == 1 else pd.concat(parts, ignore_index=True)
+    elif multi_car and CAR_COL not in data.columns:
+        data = stack_car_slots(data)
 
-    data = data[RELEVANT_COLS]
+    extra = [CAR_COL] if multi_car else []
+    extra += [SOURCE_COL] if SOURCE_COL in data.columns else []
+    data = compact_dtypes(data[RELEVANT_COLS + extra])
 
     data.columns = [col.replace("M_", "").replace("_1", "")
                     for col in data.columns]
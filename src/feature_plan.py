@@ -0,0 +1,146 @@
+import fnmatch
+import re
+
+from .config import FEATURES, MOMENTS, SET_DISTANCES
+from .geometry_utils import distance_name
+
+
+EXTREMA_ATTRIBUTES = ["ext_LAPDISTANCE", "ext_TIMETOINMS"]
+
+# Stage 1 step that creates each engineered attribute
+ATTRIBUTE_STEPS = {
+    "left_dist": "edge_distances",
+    "right_dist": "edge_distances",
+    "proj_from_ref": "ref_line",
+    "dist_apex_1": "apex_distance",
+    "dist_apex_2": "apex_distance",
+    "angle_to_apex1": "apex_angle",
+    "angle_to_apex2": "apex_angle",
+}
+
+# Stage 1 steps each points table (get_*_points) reads from
+POINTS_STEPS = {
+    "throttle": set(),
+    "braking": set(),
+    "apex": {"apex_distance"},
+    "steering": set(),
+}
+
+POINTS_ORDER = ["throttle", "braking", "apex", "steering"]
+
+
+def moment_columns(prefix, extrema=None):
+    ''' Output columns produced by moment_generator for a moment prefix. '''
+    if extrema is None:
+        extrema = prefix in MOMENTS and MOMENTS[prefix][2] is not None
+    attributes = FEATURES + (EXTREMA_ATTRIBUTES if extrema else [])
+    return [f"{prefix}_{attr}" for attr in attributes]
+
+
+def output_columns(distances=SET_DISTANCES):
+    ''' Every column of the full final data product, in build_dataset's order. '''
+    columns = ["lap_id", "invalid_lap"]
+    for prefix in MOMENTS:
+        columns += moment_columns(prefix)
+    columns.append("Target_CURRENTLAPTIMEINMS")
+    for d in distances:
+        columns += moment_columns(f"dist_{distance_name(d)}", extrema=False)
+    return columns
+
+
+class FeaturePlan:
+    ''' Minimal execution plan for a set of requested final-product columns.
+
+    Attributes
+    ----------
+    columns : list
+        Requested output columns in build_dataset order (always includes lap_id and
+        Target_CURRENTLAPTIMEINMS, which is needed to drop unfinished laps).
+    moments : dict
+        Moment prefix -> attributes to sample at that moment.
+    extrema : set
+        Moment prefixes whose *_ext_* columns are needed.
+    distances : dict
+        Fixed distance -> attributes to sample there (SET_DISTANCES or the dense grid).
+    points : list
+        Points tables (get_*_points) to compute, in pipeline order.
+    steps : set
+        Stage 1 geometry steps to run ("edge_distances", "ref_line",
+        "apex_distance", "apex_angle", "off_track").
+    '''
+
+    def __init__(self, columns, moments, extrema, distances, points, steps):
+        self.columns = columns
+        self.moments = moments
+        self.extrema = extrema
+        self.distances = distances
+        self.points = points
+        self.steps = steps
+
+    def needs(self, step):
+        return step in self.steps
+
+    def __repr__(self):
+        return (f"FeaturePlan({len(self.columns)} columns, moments={list(self.moments)}, "
+                f"distances={list(self.distances)}, points={self.points}, "
+                f"steps={sorted(self.steps)})")
+
+
+def _split_column(column):
+    match = re.match(r"^dist_(\d+(?:\.\d+)?)_(.+)$", column)
+    if match:
+        return f"dist_{match.group(1)}", match.group(2)
+    for prefix in sorted(list(MOMENTS) + ["Target"], key=len, reverse=True):
+        if column.startswith(prefix + "_"):
+            return prefix, column[len(prefix) + 1:]
+    return None, None
+
+
+def plan_features(columns=None, distances=SET_DISTANCES):
+    ''' Build a FeaturePlan for `columns` (names or fnmatch patterns such as "BPS_*").
+    columns=None plans the full final data product.
+    Raises ValueError for columns the pipeline cannot produce.
+    '''
+    available = output_columns(distances)
+    if columns is None:
+        requested = list(available)
+    else:
+        requested, unknown = set(), []
+        for pattern in columns:
+            matches = fnmatch.filter(available, pattern)
+            if not matches:
+                unknown.append(pattern)
+            requested.update(matches)
+        if unknown:
+            raise ValueError(f"Unknown output columns: {unknown}")
+        requested.update(["lap_id", "Target_CURRENTLAPTIMEINMS"])
+        requested = [c for c in available if c in requested]
+
+    moments, extrema, dist_attrs = {}, set(), {}
+    steps = set()
+    if "invalid_lap" in requested:
+        steps.update(["edge_distances", "off_track"])
+
+    for column in requested:
+        prefix, attr = _split_column(column)
+        if prefix is None or prefix == "Target":
+            continue
+        if attr in EXTREMA_ATTRIBUTES:
+            extrema.add(prefix)
+            # ext_TIMETOINMS is measured from the moment's own lap time
+            attr = "CURRENTLAPTIMEINMS"
+        target = dist_attrs if prefix.startswith("dist_") else moments
+        target.setdefault(prefix, set()).add(attr)
+        if attr in ATTRIBUTE_STEPS:
+            steps.add(ATTRIBUTE_STEPS[attr])
+
+    moments = {p: [f for f in FEATURES if f in moments[p]] for p in MOMENTS if p in moments}
+    dist_attrs = {d: [f for f in FEATURES if f in dist_attrs[f"dist_{distance_name(d)}"]]
+                  for d in distances if f"dist_{distance_name(d)}" in dist_attrs}
+
+    points = [name for name in POINTS_ORDER
+              if any(MOMENTS[p][0] == name for p in moments)]
+    for name in points:
+        steps.update(POINTS_STEPS[name])
+
+    return FeaturePlan(requested, moments, extrema, dist_attrs, points, steps)
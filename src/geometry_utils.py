@@ -3,6 +3,8 @@ import pandas as pd
 import numpy as np
 from scipy.spatial import KDTree
 
+from .lap_table import LapTable
+
 
 def euclidean_distance(point1, point2):
     return np.sqrt((point1[0] - point2[0])**2 + (point1[1] - point2[1])**2)
@@ -47,12 +49,22 @@ def angle_between(v1, v2):
     return np.degrees(angle)
 
 
+def session_laps(df):
+    ''' ((SESSIONUID, CURRENTLAPNUM), frames sorted by LAPDISTANCE) for every lap of a
+    DataFrame or LapTable (whose laps are already sorted).
+    '''
+    if isinstance(df, LapTable):
+        for _, L in df:
+            yield (L["SESSIONUID"].iat[0], L["CURRENTLAPNUM"].iat[0]), L
+    else:
+        for key, L in df.groupby(["SESSIONUID", "CURRENTLAPNUM"]):
+            yield key, L.sort_values("LAPDISTANCE").copy()
+
+
 def interpolate_time_atime(df, target):
     results = []
-    grouped = df.groupby(["SESSIONUID", "CURRENTLAPNUM"])
 
-    for (session, lap), L in grouped:
-        L = L.sort_values("LAPDISTANCE").copy()
+    for (session, lap), L in session_laps(df):
 
         # find the two points surrounding the "finish line"
         before = L[L["LAPDISTANCE"] <= target].tail(1)
@@ -89,10 +101,8 @@ def interpolate_time_atime(df, target):
 
 def interpolate_at_distance(df, distance_target, features=["CURRENTLAPTIMEINMS"]):
     results = []
-    grouped = df.groupby(["SESSIONUID", "CURRENTLAPNUM"])
 
-    for (session, lap), L in grouped:
-        L = L.sort_values("LAPDISTANCE").copy()
+    for (session, lap), L in session_laps(df):
 
         # find the two points surrounding the target distance
         before = L[L["LAPDISTANCE"] <= distance_target].tail(1)
@@ -126,4 +136,187 @@ def interpolate_at_distance(df, distance_target, features=["CURRENTLAPTIMEINMS"]
 
         results.append(result)
 
-    return pd.DataFrame(results)
\ No newline at end of file
+    return pd.DataFrame(results)
+
+
+def distance_name(distance):
+    ''' Label used for a fixed distance in "dist_{d}_*" column names (360.0 -> 360). '''
+    distance = float(distance)
+    return int(distance) if distance.is_integer() else distance
+
+
+def sample_at_distances(df, distances, features=["CURRENTLAPTIMEINMS"], epsilon=0.1,
+                        output="wide", lap_col="lap_id"):
+    ''' Sample `features` at every distance in `distances` for every lap in one vectorized pass.
+    Matches moment_generator at a fixed distance: the nearest frame is used when it lies within
+    `epsilon` of the target, otherwise values are linearly interpolated between the last frame
+    at or before and the first frame at or after the target (NaN if either is missing).
+
+    output="long" returns one row per (lap, distance) with columns lap_col, "distance", features.
+    output="wide" returns one row per lap indexed by lap_col with "dist_{d}_{feature}" columns.
+    df may be a LapTable, in which case its sorted frames are used as they are.
+    '''
+    distances = np.asarray(distances, dtype=np.float64)
+    laps = df if isinstance(df, LapTable) else LapTable(df, lap_col=lap_col)
+    lap_ids = laps.lap_ids
+    data = laps.data
+    # NaN distances are sorted last in each lap; leave them out
+    valid = ~np.isnan(laps.column("LAPDISTANCE").astype(np.float64))
+    data = data[valid]
+
+    lap_codes = laps.codes[valid]
+    LD = data["LAPDISTANCE"].to_numpy(dtype=np.float64)
+    # the table sort is stable, so sorted position breaks ties the way input order would
+    input_pos = np.arange(len(LD))
+    n_laps, n_dist, n_rows = len(lap_ids), len(distances), len(LD)
+
+    lap_start = np.searchsorted(lap_codes, np.arange(n_laps), side="left")
+    lap_end = np.searchsorted(lap_codes, np.arange(n_laps), side="right")
+    # first frame (in input order) of each run of equal LAPDISTANCE within a lap
+    new_run = np.ones(n_rows, dtype=bool)
+    new_run[1:] = (LD[1:] != LD[:-1]) | (lap_codes[1:] != lap_codes[:-1])
+    run_start = np.maximum.accumulate(np.where(new_run, np.arange(n_rows), 0))
+
+    sample_lap = np.repeat(np.arange(n_laps), n_dist)
+    sample_LD = np.tile(distances, n_laps)
+    n_samples = len(sample_LD)
+
+    # merge samples into the frame order; frames sort before samples at equal distance,
+    # so the number of frames ahead of a sample is the count of frames with LD <= target
+    is_sample = np.concatenate([np.zeros(n_rows, dtype=np.int8), np.ones(n_samples, dtype=np.int8)])
+    order = np.lexsort((is_sample, np.concatenate([LD, sample_LD]),
+                        np.concatenate([lap_codes, sample_lap])))
+    frames_ahead = np.cumsum(is_sample[order] == 0)
+    sample_slots = is_sample[order] == 1
+    before = np.empty(n_samples, dtype=np.int64)
+    before[order[sample_slots] - n_rows] = frames_ahead[sample_slots] - 1
+
+    has_before = before >= lap_start[sample_lap]
+    before_c = np.clip(before, 0, max(n_rows - 1, 0))
+    after = np.where(has_before & (LD[before_c] == sample_LD), before, before + 1)
+    has_after = after < lap_end[sample_lap]
+    after_c = np.clip(after, 0, max(n_rows - 1, 0))
+
+    # nearest frame within epsilon, ties going to the frame that came first in the input
+    d_before = np.where(has_before, np.abs(LD[before_c] - sample_LD), np.inf)
+    d_after = np.where(has_after, np.abs(LD[after_c] - sample_LD), np.inf)
+    nearest_before = run_start[before_c]
+    pick_before = (d_before < d_after) | (
+        (d_before == d_after) & (input_pos[nearest_before] <= input_pos[after_c]))
+    nearest = np.where(pick_before, nearest_before, after_c)
+    use_nearest = np.minimum(d_before, d_after) <= epsilon
+
+    interpolate = ~use_nearest & has_before & has_after
+    d0, d1 = LD[before_c], LD[after_c]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = (sample_LD - d0) / (d1 - d0)
+
+    result = {}
+    for feat in features:
+        out = np.full(n_samples, np.nan)
+        if feat in data.columns and n_rows:
+            values = data[feat].to_numpy(dtype=np.float64)
+            v0, v1 = values[before_c], values[after_c]
+            with np.errstate(invalid="ignore"):
+                out[interpolate] = np.where(d0 == d1, v0, v0 + ratio * (v1 - v0))[interpolate]
+            out[use_nearest] = values[nearest[use_nearest]]
+        result[feat] = out
+
+    if output == "long":
+        return pd.DataFrame({lap_col: lap_ids[sample_lap], "distance": sample_LD, **result})
+
+    names = [distance_name(d) for d in distances]
+    values = np.stack([result[feat].reshape(n_laps, n_dist) for feat in features], axis=2)
+    return pd.DataFrame(values.reshape(n_laps, n_dist * len(features)),
+                        index=pd.Index(lap_ids, name=lap_col),
+                        columns=[f"dist_{d}_{feat}" for d in names for feat in features])
+
+
+def _segment_candidates(points, polyline, candidates):
+    ''' Clamped projection of each point onto each of its candidate segments
+    (segment j joins polyline[j] and polyline[j + 1]).
+    Returns (t, distance), both shaped like candidates.
+    '''
+    A = polyline[candidates]
+    AB = polyline[candidates + 1] - A
+    AP = points[:, None, :] - A
+    length_sq = (AB ** 2).sum(axis=2)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        t = np.where(length_sq > 1e-12, (AP * AB).sum(axis=2) / length_sq, 0.0)
+    t = np.clip(t, 0.0, 1.0)
+    closest = A + t[..., None] * AB
+    return t, np.sqrt(((points[:, None, :] - closest) ** 2).sum(axis=2))
+
+
+def track_polyline(points, lap_lengths, polyline, window=3, jump=5.0, tree=None):
+    ''' Nearest polyline segment for consecutive frames, warm-started from the previous frame.
+
+    points holds the frames of each lap in driving order, laps back to back with the given
+    lengths. All laps advance in lockstep one frame at a time: each frame only checks the
+    `window` segments either side of its predecessor's segment. A lap falls back to the
+    global KD-tree on the polyline vertices at its first frame, when the car moved more than
+    `jump` metres since the previous frame (e.g. a reset) and when the best segment lies on
+    the edge of the window (the true nearest segment may be further along).
+
+    Returns (segment, t, distance): segment j joins polyline[j] and polyline[j + 1], t in [0, 1]
+    is the projection along it, distance is from the point to the projection.
+    '''
+    points = np.asarray(points, dtype=np.float64)
+    polyline = np.asarray(polyline, dtype=np.float64)
+    lap_lengths = np.asarray(lap_lengths, dtype=np.int64)
+    n_seg = len(polyline) - 1
+    if tree is None:
+        tree = KDTree(polyline)
+
+    segment = np.zeros(len(points), dtype=np.int64)
+    t_out = np.zeros(len(points))
+    dist_out = np.zeros(len(points))
+    starts = np.cumsum(lap_lengths) - lap_lengths
+    offsets = np.arange(-window, window + 1)
+
+    def best_in_window(rows, centre):
+        candidates = np.clip(centre[:, None] + offsets, 0, n_seg - 1)
+        t, d = _segment_candidates(points[rows], polyline, candidates)
+        pick = np.argmin(d, axis=1)
+        k = np.arange(len(rows))
+        return candidates[k, pick], t[k, pick], d[k, pick], pick
+
+    prev_seg = np.zeros(len(lap_lengths), dtype=np.int64)
+    for step in range(int(lap_lengths.max()) if len(lap_lengths) else 0):
+        laps = np.flatnonzero(lap_lengths > step)
+        rows = starts[laps] + step
+
+        if step == 0:
+            lost = np.ones(len(rows), dtype=bool)
+        else:
+            seg, t, d, pick = best_in_window(rows, prev_seg[laps])
+            moved = np.sqrt(((points[rows] - points[rows - 1]) ** 2).sum(axis=1))
+            at_edge = (((pick == 0) & (seg > 0)) |
+                       ((pick == 2 * window) & (seg < n_seg - 1)))
+            lost = (moved > jump) | at_edge
+            keep = ~lost
+            segment[rows[keep]], t_out[rows[keep]], dist_out[rows[keep]] = \
+                seg[keep], t[keep], d[keep]
+
+        if lost.any():
+            lost_rows = rows[lost]
+            _, vertex = tree.query(points[lost_rows])
+            seg, t, d, _ = best_in_window(lost_rows, np.minimum(vertex, n_seg - 1))
+            segment[lost_rows], t_out[lost_rows], dist_out[lost_rows] = seg, t, d
+
+        prev_seg[laps] = segment[rows]
+
+    return segment, t_out, dist_out
+
+
+def lap_order(data, lap_col="lap_id", time_col="CURRENTLAPTIMEINMS"):
+    ''' Row order that groups frames by lap in driving (time) order, and each lap's length.
+    Without a lap column every frame is treated as one lap in its current order.
+    '''
+    if lap_col not in data.columns:
+        return np.arange(len(data)), np.array([len(data)])
+    codes, _ = pd.factorize(data[lap_col], sort=True)
+    keys = [codes] if time_col not in data.columns else \
+        [data[time_col].to_numpy(dtype=np.float64), codes]
+    order = np.lexsort(keys)
+    return order, np.bincount(codes, minlength=codes.max() + 1 if len(codes) else 0)
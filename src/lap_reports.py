@@ -0,0 +1,171 @@
+"""
+Batch rendering of per-lap diagnostic figures (visualisation.plot_lap).
+
+Figures are drawn headless on the Agg backend across a process pool. Each worker
+loads the track geometry once and finds the boundary points near a lap with a
+single boundary KD-tree built at start-up, instead of a new KD-tree per lap.
+
+    python -m src.lap_reports processed_race_data.parquet reports/
+    python -m src.lap_reports processed_race_data.csv reports/ --pdf --laps 1000_1 1000_2
+"""
+
+import argparse
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.backends.backend_pdf import PdfPages
+from matplotlib.figure import Figure
+from scipy.spatial import KDTree
+
+from .data_loader import load_entire_track
+from .lap_table import as_lap_table
+from .table_io import read_table
+from .visualisation import plot_lap
+
+
+REPORT_COLUMNS = ["lap_id", "WORLDPOSITIONX", "WORLDPOSITIONY"]
+
+
+class TrackGeometry:
+    ''' Track boundaries and apexes with one KD-tree over every boundary point, shared by
+    all laps rendered in a process.
+    '''
+
+    def __init__(self, track_left, track_right, turns):
+        self.track_left = track_left
+        self.track_right = track_right
+        self.apex = turns[["APEX_X1", "APEX_Y1"]].dropna()
+        points = np.vstack([
+            track_left[["WORLDPOSX", "WORLDPOSY"]].to_numpy(),
+            track_right[["WORLDPOSX", "WORLDPOSY"]].to_numpy(),
+        ])
+        self.n_left = len(track_left)
+        self.tree = KDTree(points)
+
+    def nearby(self, lap_points, radius):
+        ''' (track_left, track_right, apex) points within radius of any lap point; the same
+        sets plot_lap finds with a per-lap tree.
+        '''
+        near = np.zeros(self.tree.n, dtype=bool)
+        hits = self.tree.query_ball_point(lap_points, r=radius, return_sorted=False)
+        if len(hits):
+            near[np.concatenate([np.asarray(h, dtype=np.int64) for h in hits])] = True
+
+        apex = self.apex.to_numpy()
+        d2 = ((apex[:, None, :] - lap_points[None, :, :]) ** 2).sum(axis=2)
+        apex_near = d2.min(axis=1) <= radius ** 2 if len(lap_points) else np.zeros(len(apex), bool)
+        return (self.track_left[near[:self.n_left]], self.track_right[near[self.n_left:]],
+                self.apex[apex_near])
+
+
+_GEOMETRY = None
+
+
+def _init_worker(track_left, track_right, turns):
+    global _GEOMETRY
+    _GEOMETRY = TrackGeometry(track_left, track_right, turns)
+
+
+def _render(task):
+    # one lap -> PNG bytes, drawn on a pyplot-free Agg figure
+    lap_id, lap, color_col, radius, dpi = task
+    fig = Figure(figsize=(10, 10))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    points = lap[["WORLDPOSITIONX", "WORLDPOSITIONY"]].to_numpy(dtype=np.float64)
+    plot_lap(lap, _GEOMETRY.track_left, _GEOMETRY.track_right, None, color_col=color_col,
+             title=f"Lap {lap_id}", radius=radius, ax=ax,
+             near=_GEOMETRY.nearby(points, radius))
+    fig.colorbar(ax.collections[0], ax=ax, label=color_col)
+    ax.set_aspect("equal")
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", dpi=dpi)
+    return lap_id, buffer.getvalue()
+
+
+def _safe_name(lap_id):
+    return "".join(ch if ch.isalnum() or ch in "-_." else "_" for ch in str(lap_id))
+
+
+def render_lap_reports(data, out, fmt="png", laps=None, color_col="SPEED", radius=30,
+                       dpi=100, workers=None, track=None, chunksize=8):
+    ''' Render plot_lap for every lap (or only `laps`) of a LapTable or frame DataFrame.
+
+    fmt="png" writes <out>/<lap_id>.png; fmt="pdf" writes one page per lap to the file `out`.
+    workers is the process count (default os.cpu_count(), 1 renders in this process).
+    track is (track_left, track_right, ref_line, turns), loaded from DATAFOLDER by default.
+    Returns the written paths.
+    '''
+    if track is None:
+        track = load_entire_track()
+    track_left, track_right, _, turns = track
+
+    table = as_lap_table(data)
+    lap_ids = table.lap_ids if laps is None else [l for l in laps if l in table]
+    columns = REPORT_COLUMNS + [color_col]
+    tasks = ((lap_id, table.lap(lap_id)[columns], color_col, radius, dpi) for lap_id in lap_ids)
+
+    out = Path(out)
+    if fmt == "png":
+        out.mkdir(parents=True, exist_ok=True)
+    else:
+        out.parent.mkdir(parents=True, exist_ok=True)
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        _init_worker(track_left, track_right, turns)
+        rendered = map(_render, tasks)
+        return _collect(rendered, out, fmt, dpi)
+    with ProcessPoolExecutor(workers, initializer=_init_worker,
+                             initargs=(track_left, track_right, turns)) as pool:
+        return _collect(pool.map(_render, tasks, chunksize=chunksize), out, fmt, dpi)
+
+
+def _collect(rendered, out, fmt, dpi):
+    if fmt == "png":
+        paths = []
+        for lap_id, png in rendered:
+            path = out / f"{_safe_name(lap_id)}.png"
+            path.write_bytes(png)
+            paths.append(path)
+        return paths
+
+    from matplotlib.image import imread
+    with PdfPages(out) as pdf:
+        for lap_id, png in rendered:
+            image = imread(io.BytesIO(png))
+            page = Figure(figsize=(image.shape[1] / dpi, image.shape[0] / dpi), dpi=dpi)
+            page.figimage(image)
+            pdf.savefig(page)
+    return [out]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("data", help="processed_race_data (.parquet, .feather or .csv)")
+    parser.add_argument("out", help="folder for PNGs, or the PDF file with --pdf")
+    parser.add_argument("--pdf", action="store_true", help="write one multi-page PDF")
+    parser.add_argument("--laps", nargs="+", default=None, help="only these lap ids")
+    parser.add_argument("--color", default="SPEED")
+    parser.add_argument("--radius", type=float, default=30)
+    parser.add_argument("--dpi", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    data = read_table(args.data, columns=REPORT_COLUMNS + ["LAPDISTANCE", args.color])
+    out = Path(args.out)
+    if args.pdf and out.suffix != ".pdf":
+        out = out / "lap_reports.pdf"
+    paths = render_lap_reports(data, out, fmt="pdf" if args.pdf else "png", laps=args.laps,
+                               color_col=args.color, radius=args.radius, dpi=args.dpi,
+                               workers=args.workers)
+    print(f"Wrote {len(paths):,} file(s) to {out}")
+
+
+if __name__ == "__main__":
+    main()
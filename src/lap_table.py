@@ -0,0 +1,162 @@
+"""
+Frame data sorted once by (lap_id, LAPDISTANCE) with per-lap offsets.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+class LapTable:
+    ''' Frames sorted by lap and lap distance, with lap i stored in rows offsets[i]:offsets[i + 1].
+
+    The sort is stable, so frames at the same distance keep their input order, and NaN
+    distances sort to the end of their lap. Every lap view is a slice of `data` whose index
+    is the frame's position inside the lap (0..n-1), i.e. what
+    `group.sort_values(LAPDISTANCE).reset_index(drop=True)` used to give per groupby group.
+
+    Attributes
+    ----------
+    data : pd.DataFrame
+        The sorted frames.
+    lap_ids : np.ndarray
+        Lap ids in sorted order (the order groupby("lap_id") iterates in).
+    offsets : np.ndarray
+        len(lap_ids) + 1 row offsets into `data`.
+    '''
+
+    def __init__(self, df, lap_col="lap_id", distance_col="LAPDISTANCE"):
+        self.lap_col = lap_col
+        self.distance_col = distance_col
+
+        lap_ids, codes = np.unique(df[lap_col].to_numpy(), return_inverse=True)
+        distance = df[distance_col].to_numpy(dtype=np.float64)
+        order = np.lexsort((distance, codes))
+
+        self.lap_ids = lap_ids
+        self.codes = codes[order]
+        self.offsets = np.searchsorted(self.codes, np.arange(len(lap_ids) + 1))
+        self.data = df.take(order)
+        self.data.index = pd.Index(np.arange(len(order)) - np.repeat(
+            self.offsets[:-1], np.diff(self.offsets)))
+        self._lap_index = {lap_id: i for i, lap_id in enumerate(lap_ids)}
+        self._keys = None
+
+    @classmethod
+    def from_frame(cls, df, **kwargs):
+        return df if isinstance(df, cls) else cls(df, **kwargs)
+
+    def __len__(self):
+        return len(self.lap_ids)
+
+    def __iter__(self):
+        ''' (lap_id, lap view) pairs, like iterating a groupby on lap_id. '''
+        for i, lap_id in enumerate(self.lap_ids):
+            yield lap_id, self.lap_at(i)
+
+    def __contains__(self, lap_id):
+        return lap_id in self._lap_index
+
+    @property
+    def n_frames(self):
+        return len(self.data)
+
+    def add_columns(self, columns):
+        ''' Store per-frame arrays (in table order) as new columns of `data`. '''
+        for name, values in columns.items():
+            self.data[name] = values
+
+    def column(self, name):
+        return self.data[name].to_numpy()
+
+    def lap_at(self, i):
+        return self.data.iloc[self.offsets[i]:self.offsets[i + 1]]
+
+    def lap(self, lap_id):
+        ''' Frames of one lap (empty if the lap is not in the table). '''
+        i = self._lap_index.get(lap_id)
+        if i is None:
+            return self.data.iloc[:0]
+        return self.lap_at(i)
+
+    def window(self, start, end):
+        ''' Row bounds (begin, stop) per lap of the frames with start <= distance <= end.
+        start and end are scalars or per-lap arrays.
+        '''
+        keys = self._search_keys()
+        base = np.arange(len(self)) * self._span
+        start = np.broadcast_to(np.asarray(start, dtype=np.float64), (len(self),))
+        end = np.broadcast_to(np.asarray(end, dtype=np.float64), (len(self),))
+        begin = np.searchsorted(keys, base + np.clip(start - self._low, 0, self._span - 1),
+                                side="left")
+        stop = np.searchsorted(keys, base + np.clip(end - self._low, -1, self._span - 1),
+                               side="right")
+        begin = np.clip(begin, self.offsets[:-1], self.offsets[1:])
+        return begin, np.maximum(np.clip(stop, self.offsets[:-1], self.offsets[1:]), begin)
+
+    def lap_window(self, i, start, end):
+        ''' Frames of lap i with start <= distance <= end. '''
+        begin, stop = self.window(start, end)
+        return self.data.iloc[begin[i]:stop[i]]
+
+    def select(self, begin=None, stop=None, laps=None):
+        ''' Frames of every [begin, stop) row range (e.g. from window()) as one DataFrame,
+        optionally only for the lap positions in `laps`.
+        '''
+        if begin is None:
+            begin, stop = self.offsets[:-1], self.offsets[1:]
+        if laps is not None:
+            begin, stop = begin[laps], stop[laps]
+        rows = self._ranges(begin, stop)[0]
+        return self.data.iloc[rows]
+
+    def _search_keys(self):
+        # distance made monotonic across the whole table: lap code * span + distance,
+        # with NaN distances after every real distance of their lap
+        if self._keys is None:
+            distance = self.column(self.distance_col).astype(np.float64)
+            finite = distance[~np.isnan(distance)]
+            self._low = finite.min() if len(finite) else 0.0
+            self._span = (finite.max() - self._low if len(finite) else 0.0) + 2.0
+            shifted = np.where(np.isnan(distance), self._span - 0.5, distance - self._low)
+            self._keys = self.codes * self._span + shifted
+        return self._keys
+
+    def _ranges(self, begin, stop):
+        # rows of every [begin, stop) range laid end to end, and the range each row belongs to
+        if begin is None:
+            begin, stop = self.offsets[:-1], self.offsets[1:]
+        lengths = stop - begin
+        starts = np.cumsum(lengths) - lengths
+        rows = np.arange(lengths.sum()) - np.repeat(starts - begin, lengths)
+        return rows, np.repeat(np.arange(len(begin)), lengths), starts, lengths
+
+    def reduce(self, name, ufunc=np.add, begin=None, stop=None):
+        ''' ufunc reduction of a column over each lap (or each [begin, stop) row range).
+        Empty ranges give NaN.
+        '''
+        rows, _, starts, lengths = self._ranges(begin, stop)
+        values = self.column(name).astype(np.float64)[rows]
+        out = np.full(len(lengths), np.nan)
+        nonempty = lengths > 0
+        if nonempty.any():
+            out[nonempty] = ufunc.reduceat(values, starts[nonempty])
+        return out
+
+    def argextreme(self, name, kind="min", begin=None, stop=None):
+        ''' Row (into `data`) of the first minimum or maximum of a column in each lap (or each
+        [begin, stop) row range), skipping NaNs like idxmin/idxmax; -1 where there is no value.
+        '''
+        rows, segment, starts, lengths = self._ranges(begin, stop)
+        values = self.column(name).astype(np.float64)[rows]
+        order = np.lexsort((values if kind == "min" else -values, segment))
+        out = np.full(len(lengths), -1, dtype=np.int64)
+        # the first row of each range in sorted order is its extreme (NaNs sort last)
+        has = (lengths > 0)
+        has[has] = ~np.isnan(values[order[starts[has]]])
+        out[has] = rows[order[starts[has]]]
+        return out
+
+
+def as_lap_table(data, **kwargs):
+    ''' Return `data` if it already is a LapTable, otherwise build one from the DataFrame. '''
+    return LapTable.from_frame(data, **kwargs)
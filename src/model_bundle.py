@@ -0,0 +1,106 @@
+"""
+Model-ready export of the final data product.
+
+A bundle folder holds
+    features.npy   float32 (n_laps, n_features), C-contiguous
+    target.npy     float32 (n_laps,)
+    valid.npy      bool (n_laps,): lap is valid and has a target
+    nan_mask.npy   bool (n_laps, n_features): feature is missing
+    manifest.json  columns (with NaN counts), lap ids, target name and shapes
+so training code can np.load(..., mmap_mode="r") the arrays without parsing
+and take contiguous lap ranges per worker.
+"""
+
+import json
+from pathlib import Path
+
+import numpy as np
+
+from .config import MODEL_BUNDLE_EXCLUDE, MODEL_BUNDLE_TARGET
+
+
+ARRAYS = ["features", "target", "valid", "nan_mask"]
+
+
+def write_model_bundle(output, folder, target=MODEL_BUNDLE_TARGET, exclude=MODEL_BUNDLE_EXCLUDE):
+    ''' Write the final data product `output` as a model bundle in `folder`; returns the folder.
+    Features are every numeric column except lap_id, invalid_lap and the target.
+    '''
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+
+    columns = [c for c in output.columns if c not in exclude and c != target
+               and output[c].dtype.kind in "biuf"]
+    features = np.ascontiguousarray(output[columns].to_numpy(dtype=np.float32))
+    target_values = output[target].to_numpy(dtype=np.float32)
+    nan_mask = np.isnan(features)
+    valid = np.isfinite(target_values)
+    if "invalid_lap" in output.columns:
+        valid &= output["invalid_lap"].to_numpy() == 0
+
+    for name, values in zip(ARRAYS, [features, target_values, valid, nan_mask]):
+        np.save(folder / f"{name}.npy", values)
+
+    manifest = {
+        "n_laps": len(output),
+        "n_features": len(columns),
+        "target": target,
+        "columns": [{"name": c, "index": i, "n_nan": int(n)}
+                    for i, (c, n) in enumerate(zip(columns, nan_mask.sum(axis=0)))],
+        "lap_ids": output["lap_id"].astype(str).tolist(),
+        "n_valid": int(valid.sum()),
+    }
+    with open(folder / "manifest.json", "w") as f:
+        json.dump(manifest, f, indent=1)
+    return folder
+
+
+def shard_bounds(n_laps, n_shards):
+    ''' (start, stop) row ranges splitting n_laps into n_shards contiguous, near-equal shards. '''
+    edges = np.linspace(0, n_laps, n_shards + 1).round().astype(int)
+    return [(int(start), int(stop)) for start, stop in zip(edges[:-1], edges[1:])]
+
+
+class ModelBundle:
+    ''' Arrays of a model bundle (memory-mapped by default), optionally one lap-range shard.
+
+    Attributes
+    ----------
+    X, y, valid, nan_mask : np.ndarray
+        Feature matrix, target, validity mask and NaN mask for the shard's laps.
+    columns : list
+        Feature names in X's column order.
+    lap_ids : list
+        Lap ids of the shard's rows.
+    rows : tuple
+        (start, stop) rows of the full bundle covered by this shard.
+    '''
+
+    def __init__(self, folder, shard=None, n_shards=1, mmap_mode="r"):
+        folder = Path(folder)
+        with open(folder / "manifest.json") as f:
+            self.manifest = json.load(f)
+
+        n_laps = self.manifest["n_laps"]
+        start, stop = (0, n_laps) if shard is None else shard_bounds(n_laps, n_shards)[shard]
+        self.rows = (start, stop)
+        arrays = {name: np.load(folder / f"{name}.npy", mmap_mode=mmap_mode)[start:stop]
+                  for name in ARRAYS}
+        self.X, self.y = arrays["features"], arrays["target"]
+        self.valid, self.nan_mask = arrays["valid"], arrays["nan_mask"]
+        self.columns = [c["name"] for c in self.manifest["columns"]]
+        self.lap_ids = self.manifest["lap_ids"][start:stop]
+
+    def __len__(self):
+        return self.rows[1] - self.rows[0]
+
+    def __repr__(self):
+        return (f"ModelBundle({len(self)} laps, {len(self.columns)} features, "
+                f"rows={self.rows}, valid={int(np.sum(self.valid))})")
+
+
+def load_model_bundle(folder, shard=None, n_shards=1, mmap_mode="r"):
+    ''' Open a bundle written by write_model_bundle. With shard=i of n_shards, only that
+    contiguous lap range is exposed (slices of the memory maps, nothing is copied).
+    '''
+    return ModelBundle(folder, shard=shard, n_shards=n_shards, mmap_mode=mmap_mode)
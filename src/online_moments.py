@@ -0,0 +1,382 @@
+"""
+Streaming (single forward scan) versions of the throttle, braking and steering
+detectors in track_moments.
+
+scan_moment_points(df) returns the same three points tables as
+get_throttle_points / get_braking_points / get_steering_points, and
+MomentStream takes frames one at a time (grouped by lap, in LAPDISTANCE order)
+holding only the current lap's state, for data that arrives as a stream.
+build_dataset uses scan_moment_points for these three tables whenever all of them
+are planned; benchmarks/check_online_moments.py checks that it agrees with the
+batch detectors frame for frame.
+"""
+
+import math
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+
+def _isnan(value):
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+class _LaggedFrames:
+    ''' Keeps the last `lag` in-window frames and folds older frames into a running summary.
+
+    The batch detectors slice "before the max" with `group.loc[:group.index.get_loc(max_idx)]`.
+    Because each lap is reset *before* the distance filter, the labels of the window start at
+    the number of frames below distance_range[0], so that slice ends `lag` frames before the max
+    and the "after the max" slice starts `lag - 1` frames before it. This buffer reproduces that
+    offset with O(lag) state so both paths agree frame for frame.
+    '''
+
+    def __init__(self, lag, is_zero):
+        self.lag = lag
+        self.is_zero = is_zero
+        self.recent = deque()
+        self.popped = False
+        self.last_LD = None
+        self.last_zero_LD = None
+
+    def push(self, value, LD):
+        self.recent.append((value, LD))
+        while len(self.recent) > self.lag:
+            old_value, old_LD = self.recent.popleft()
+            self.popped = True
+            self.last_LD = old_LD
+            if self.is_zero(old_value):
+                self.last_zero_LD = old_LD
+
+
+class BrakeDetector:
+    ''' Incremental version of get_braking_points for a single lap.
+
+    Frames must arrive in LAPDISTANCE order. Each update is O(1) amortised and the
+    state is bounded by the number of frames before the distance window.
+    '''
+
+    def __init__(self, distance_range=(10, 800)):
+        self.distance_range = distance_range
+        self.lag = 0
+        self.frames = None
+        self.prev = None
+        self.max_val = None
+        self.max_LD = None
+        self.bp_LD = None
+        self.dec_LD = None
+        self.skip_pair = False
+        self.first_zero_LD = None
+        self.min_val = None
+        self.min_LD = None
+
+    def _start_end_search(self, value, LD):
+        self.dec_LD = LD
+        self.first_zero_LD = LD if value == 0 else None
+        self.min_val, self.min_LD = value, LD
+
+    def _update_end_search(self, value, LD):
+        if self.first_zero_LD is None and value == 0:
+            self.first_zero_LD = LD
+        if not _isnan(value) and value < self.min_val:
+            self.min_val, self.min_LD = value, LD
+
+    def update(self, LD, brake):
+        if _isnan(LD) or LD > self.distance_range[1]:
+            return
+        if LD < self.distance_range[0]:
+            self.lag += 1
+            return
+        if self.frames is None:
+            self.frames = _LaggedFrames(self.lag, lambda v: v == 0)
+        self.frames.push(brake, LD)
+
+        if not _isnan(brake) and (self.max_val is None or brake > self.max_val):
+            self.max_val, self.max_LD = brake, LD
+            if self.frames.last_zero_LD is not None:
+                self.bp_LD = self.frames.last_zero_LD
+            else:
+                self.bp_LD = self.frames.last_LD if self.frames.popped else None
+
+            # Re-run the decrease search over the buffered part of the "after max" slice.
+            # With no lag the slice starts on the next frame, so its first pair is skipped.
+            self.dec_LD = None
+            self.skip_pair = self.lag == 0
+            prev = None
+            for value, frame_LD in self.frames.recent:
+                if self.dec_LD is not None:
+                    self._update_end_search(value, frame_LD)
+                elif prev is not None and value < prev:
+                    self._start_end_search(value, frame_LD)
+                prev = value
+        elif self.max_val is not None:
+            if self.dec_LD is not None:
+                self._update_end_search(brake, LD)
+            elif self.skip_pair:
+                self.skip_pair = False
+            elif brake < self.prev:
+                self._start_end_search(brake, LD)
+
+        self.prev = brake
+
+    def finalise(self, lap_id):
+        if self.max_val is None:
+            return {
+                'lap_id': lap_id,
+                'max_brake_LD': None,
+                'BP_LD': None,
+                'brake_decrease_LD': None,
+                'brake_end_LD': None
+            }
+
+        brake_end_LD = None
+        if self.dec_LD is not None:
+            brake_end_LD = self.first_zero_LD if self.first_zero_LD is not None else self.min_LD
+
+        return {
+            'lap_id': lap_id,
+            'BP_LD': self.bp_LD,
+            'max_brake_LD': self.max_LD,
+            'brake_decrease_LD': self.dec_LD,
+            'brake_end_LD': brake_end_LD
+        }
+
+
+class ThrottleDetector:
+    ''' Incremental version of get_throttle_points for a single lap.
+
+    Frames must arrive in LAPDISTANCE order; state is a fixed handful of scalars.
+    '''
+
+    def __init__(self, distance_range=(10, 710), lift_threshold=0.02):
+        self.distance_range = distance_range
+        self.lift_threshold = lift_threshold
+        self.prev = None
+        self.first_lift_LD = None
+        self.min_val = None
+        self.min_LD = None
+        self.back_on_LD = None
+        self.max_val = None
+        self.max_LD = None
+        # frames sharing the current LAPDISTANCE, needed for the ">= back_on_LD" slice
+        self.run_LD = None
+        self.run_max = None
+
+    def update(self, LD, throttle):
+        if _isnan(LD) or not self.distance_range[0] <= LD <= self.distance_range[1]:
+            return
+
+        diff = throttle - self.prev if self.prev is not None else math.nan
+
+        if self.first_lift_LD is None:
+            if diff < -self.lift_threshold:
+                self.first_lift_LD = LD
+                self.min_val, self.min_LD = throttle, LD
+        elif not _isnan(throttle) and throttle < self.min_val:
+            self.min_val, self.min_LD = throttle, LD
+            self.back_on_LD = None
+            self.max_val = self.max_LD = None
+        elif self.back_on_LD is None:
+            if diff > self.lift_threshold:
+                self.back_on_LD = LD
+                if self.run_LD == LD and self.run_max is not None:
+                    self.max_val, self.max_LD = self.run_max, LD
+                if self.max_val is None or throttle > self.max_val:
+                    self.max_val, self.max_LD = throttle, LD
+        elif not _isnan(throttle) and throttle > self.max_val:
+            self.max_val, self.max_LD = throttle, LD
+
+        if self.run_LD != LD:
+            self.run_LD, self.run_max = LD, None
+        if not _isnan(throttle) and (self.run_max is None or throttle > self.run_max):
+            self.run_max = throttle
+        self.prev = throttle
+
+    def finalise(self, lap_id):
+        if self.first_lift_LD is None:
+            return {
+                'lap_id': lap_id,
+                'first_lift_LD': None,
+                'min_throttle_LD': None,
+                'back_on_LD': None,
+                'back_on_max_LD': None
+            }
+
+        return {
+            'lap_id': lap_id,
+            'first_lift_LD': self.first_lift_LD,
+            'min_throttle_LD': self.min_LD,
+            'back_on_LD': self.back_on_LD,
+            'back_on_max_LD': self.max_LD if self.back_on_LD is not None else None
+        }
+
+
+class _SignChangeSearch:
+    ''' Finds the first zero crossing after an extremum and interpolates its LAPDISTANCE. '''
+
+    def __init__(self):
+        self.crossing_LD = None
+        self.skip_pair = False
+
+    def reset(self, recent, skip_next):
+        self.crossing_LD = None
+        self.skip_pair = False
+        prev = None
+        for value, LD in recent:
+            if prev is not None:
+                self.check(prev, (value, LD))
+            prev = (value, LD)
+        self.skip_pair = skip_next
+
+    def check(self, prev, frame):
+        if self.skip_pair:
+            self.skip_pair = False
+            return
+        if self.crossing_LD is not None:
+            return
+        steer_A, LD_A = prev
+        steer_B, LD_B = frame
+        if steer_A * steer_B < 0:
+            self.crossing_LD = LD_A + (LD_B - LD_A) * (steer_A) / (steer_A - steer_B)
+
+
+class SteeringDetector:
+    ''' Incremental version of get_steering_points for a single lap.
+
+    Frames must arrive in LAPDISTANCE order. State is bounded by the number of
+    frames before the distance window (see _LaggedFrames).
+    '''
+
+    def __init__(self, distance_range=(10, 800), zero_threshold=0.01):
+        self.distance_range = distance_range
+        self.zero_threshold = zero_threshold
+        self.lag = 0
+        self.frames = None
+        self.prev = None
+        self.max_pos_val = self.max_pos_LD = None
+        self.max_neg_val = self.max_neg_LD = None
+        self.first_steer_LD = None
+        self.middle = _SignChangeSearch()
+        self.end = _SignChangeSearch()
+
+    def update(self, LD, steer):
+        if _isnan(LD) or LD > self.distance_range[1]:
+            return
+        if LD < self.distance_range[0]:
+            self.lag += 1
+            return
+        if self.frames is None:
+            self.frames = _LaggedFrames(
+                self.lag, lambda v: abs(v) <= self.zero_threshold)
+        self.frames.push(steer, LD)
+
+        new_pos = new_neg = False
+        if not _isnan(steer):
+            if self.max_pos_val is None or steer > self.max_pos_val:
+                self.max_pos_val, self.max_pos_LD = steer, LD
+                self.first_steer_LD = self.frames.last_zero_LD
+                self.middle.reset(self.frames.recent, self.lag == 0)
+                new_pos = True
+            if self.max_neg_val is None or steer < self.max_neg_val:
+                self.max_neg_val, self.max_neg_LD = steer, LD
+                self.end.reset(self.frames.recent, self.lag == 0)
+                new_neg = True
+
+        if self.prev is not None:
+            if not new_pos and self.max_pos_val is not None:
+                self.middle.check(self.prev, (steer, LD))
+            if not new_neg and self.max_neg_val is not None:
+                self.end.check(self.prev, (steer, LD))
+        self.prev = (steer, LD)
+
+    def finalise(self, lap_id):
+        if self.max_pos_val is None:
+            return {
+                'lap_id': lap_id,
+                'first_steer_LD': None,
+                'max_pos_angle_steer_LD': None,
+                'middle_TP_LD': None,
+                'max_neg_LD': None,
+                'end_steer_LD': None
+            }
+
+        return {
+            'lap_id': lap_id,
+            'first_steer_LD': self.first_steer_LD,
+            'max_pos_angle_steer_LD': self.max_pos_LD,
+            'middle_TP_LD': self.middle.crossing_LD,
+            'max_neg_LD': self.max_neg_LD,
+            'end_steer_LD': self.end.crossing_LD
+        }
+
+
+class MomentStream:
+    ''' Routes incoming frames to per-lap detectors and finalises each lap when the next one starts.
+
+    Frames must be grouped by lap and arrive in LAPDISTANCE order within a lap. Only the
+    current lap's detectors are held in memory; finished laps are appended to the
+    throttle/braking/steering result lists.
+    '''
+
+    def __init__(self, throttle_range=(10, 710), brake_range=(10, 800),
+                 steer_range=(10, 800), lift_threshold=0.02):
+        self.throttle_range = throttle_range
+        self.brake_range = brake_range
+        self.steer_range = steer_range
+        self.lift_threshold = lift_threshold
+        self.lap_id = None
+        self.throttle_results = []
+        self.braking_results = []
+        self.steering_results = []
+
+    def _start_lap(self, lap_id):
+        self.lap_id = lap_id
+        self.throttle = ThrottleDetector(self.throttle_range, self.lift_threshold)
+        self.brake = BrakeDetector(self.brake_range)
+        self.steer = SteeringDetector(self.steer_range)
+
+    def update(self, lap_id, LD, throttle, brake, steer):
+        if lap_id != self.lap_id:
+            self.end_lap()
+            self._start_lap(lap_id)
+        self.throttle.update(LD, throttle)
+        self.brake.update(LD, brake)
+        self.steer.update(LD, steer)
+
+    def end_lap(self):
+        ''' Finalise the current lap, returning its (throttle, braking, steering) dicts. '''
+        if self.lap_id is None:
+            return None
+        finished = (self.throttle.finalise(self.lap_id),
+                    self.brake.finalise(self.lap_id),
+                    self.steer.finalise(self.lap_id))
+        self.throttle_results.append(finished[0])
+        self.braking_results.append(finished[1])
+        self.steering_results.append(finished[2])
+        self.lap_id = None
+        return finished
+
+    def results(self):
+        ''' Finalise any open lap and return the throttle, braking and steering DataFrames. '''
+        self.end_lap()
+        return (pd.DataFrame(self.throttle_results),
+                pd.DataFrame(self.braking_results),
+                pd.DataFrame(self.steering_results))
+
+
+def scan_moment_points(df, **kwargs):
+    ''' Single forward scan equivalent of get_throttle_points, get_braking_points and get_steering_points.
+    Sorts once by (lap_id, LAPDISTANCE) and feeds every frame through a MomentStream.
+    Returns throttle_points, braking_points, steering_points DataFrames.
+    '''
+    ordered = df[["lap_id", "LAPDISTANCE", "THROTTLE", "BRAKE", "STEER"]].sort_values(
+        ["lap_id", "LAPDISTANCE"], kind="mergesort")
+
+    stream = MomentStream(**kwargs)
+    columns = [ordered[col].to_numpy(dtype=object if col == "lap_id" else np.float64).tolist()
+               for col in ordered.columns]
+    for lap_id, LD, throttle, brake, steer in zip(*columns):
+        stream.update(lap_id, LD, throttle, brake, steer)
+
+    return stream.results()
@@ -0,0 +1,297 @@
+"""
+Memory-budgeted, out-of-core execution of the pipeline.
+
+The raw export is streamed twice in chunks: once to count frames per session,
+once to spill every session's rows to the CSV of the batch it was packed into.
+Batches hold whole sessions (so every lap is complete) and are sized so that
+rows x bytes per row x OUT_OF_CORE_EXPANSION stays within the memory budget;
+run_pipeline.build_out_of_core then runs Stage 1 and Stage 2 on one batch at a
+time and merges the per-batch products with the helpers below.
+
+With pipelined=True the batches flow through `pipelined`: a reader thread parses
+batch k+1 while worker processes run the pipeline on batch k and a writer thread
+writes the products of batch k-1, with bounded queues between them.
+"""
+
+import queue
+import re
+import shutil
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .config import (
+    OUT_OF_CORE_CHUNKSIZE, OUT_OF_CORE_EXPANSION, PIPELINE_QUEUE_SIZE, RELEVANT_COLS, SOURCE_COL
+)
+from .data_loader import export_column, stack_car_slots
+from .table_io import EXTENSIONS, find_table, read_table, table_path, write_table
+
+
+SESSION_COL = "M_SESSIONUID"
+
+# lap-level products concatenated across batches; processed_race_data is kept as parts
+LAP_PRODUCTS = ["final_data_product", "dense_features"]
+CSV_PRODUCTS = ["lap_quality", "lap_provenance", "gate_times"]
+
+_UNITS = {"": 1, "B": 1, "K": 2 ** 10, "M": 2 ** 20, "G": 2 ** 30, "T": 2 ** 40}
+
+
+def parse_memory(text):
+    ''' Bytes in a memory size such as "4GB", "512M", "1.5 GiB" or a plain byte count. '''
+    if isinstance(text, (int, float)):
+        return int(text)
+    match = re.fullmatch(r"\s*([\d.]+)\s*([KMGT]?)(I?B)?\s*", str(text).upper())
+    if match is None:
+        raise ValueError(f"Cannot parse memory size {text!r}, expected e.g. '4GB' or '512MB'")
+    return int(float(match.group(1)) * _UNITS[match.group(2)])
+
+
+def _paths(source):
+    return list(source) if isinstance(source, (list, tuple)) else [source]
+
+
+def _chunks(source, chunksize, columns=RELEVANT_COLS):
+    # DataFrame slices, or chunked CSV readers over one path or a list of paths;
+    # columns is a list or a column -> bool predicate
+    if isinstance(source, pd.DataFrame):
+        keep = [c for c in source.columns if c in columns] if isinstance(columns, list) \
+            else [c for c in source.columns if columns(c)]
+        for start in range(0, len(source), chunksize):
+            yield source.iloc[start:start + chunksize][keep]
+        return
+    paths = _paths(source)
+    for path in paths:
+        for chunk in pd.read_csv(path, usecols=columns, chunksize=chunksize):
+            if len(paths) > 1:
+                chunk[SOURCE_COL] = Path(path).name
+            yield chunk
+
+
+def session_sizes(source, chunksize=OUT_OF_CORE_CHUNKSIZE, sample_rows=10_000, multi_car=False):
+    ''' Frames per session of a DataFrame or export path(s) (Series indexed by M_SESSIONUID,
+    in first-seen order) and the in-memory bytes per frame of the relevant columns, measured
+    on the first sample_rows. With multi_car, the bytes per frame are measured after
+    stack_car_slots, i.e. over all of the frame's car rows. Only the session column is read
+    to count.
+    '''
+    loaded = partial(export_column, multi_car=multi_car)
+    if isinstance(source, pd.DataFrame):
+        sample = source.iloc[:sample_rows][[c for c in source.columns if loaded(c)]]
+    else:
+        sample = pd.read_csv(_paths(source)[0], usecols=loaded, nrows=sample_rows)
+    frames = len(sample)
+    if multi_car:
+        sample = stack_car_slots(sample)
+    row_bytes = sample.memory_usage(deep=True).sum() / frames if frames else 0.0
+
+    counts = {}
+    for chunk in _chunks(source, chunksize, [SESSION_COL]):
+        for session, n in chunk[SESSION_COL].value_counts(sort=False).items():
+            counts[session] = counts.get(session, 0) + n
+    return pd.Series(counts, dtype=np.int64, name="frames"), row_bytes
+
+
+def plan_batches(sizes, row_bytes, max_memory, expansion=OUT_OF_CORE_EXPANSION):
+    ''' Pack whole sessions, in order, into batches whose estimated pipeline memory
+    (frames x row_bytes x expansion) fits max_memory bytes. A session larger than the
+    budget gets a batch of its own. Returns a Series session -> batch number.
+    '''
+    limit = max(int(max_memory / (row_bytes * expansion)), 1) if row_bytes else np.inf
+    batch = np.zeros(len(sizes), dtype=np.int64)
+    current, used = 0, 0
+    for i, n in enumerate(sizes.to_numpy()):
+        if used and used + n > limit:
+            current, used = current + 1, 0
+        batch[i] = current
+        used += n
+    too_big = sizes[sizes > limit]
+    if len(too_big):
+        print(f"{len(too_big):,} session(s) exceed the memory budget on their own "
+              f"(largest {too_big.max():,} frames); they are processed alone")
+    return pd.Series(batch, index=sizes.index, name="batch")
+
+
+def spill_batches(source, batch_of, folder, chunksize=OUT_OF_CORE_CHUNKSIZE, multi_car=False):
+    ''' Stream source again and append each frame to <folder>/batch_<k>.csv by its session
+    (with multi_car, keeping every car slot's columns). Returns the batch file paths in
+    batch order.
+    '''
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    n_batches = int(batch_of.max()) + 1 if len(batch_of) else 0
+    paths = [folder / f"batch_{k:05d}.csv" for k in range(n_batches)]
+    for path in paths:
+        path.unlink(missing_ok=True)
+
+    for chunk in _chunks(source, chunksize, partial(export_column, multi_car=multi_car)):
+        chunk = chunk[sorted(chunk.columns)]  # one column order for every file appended
+        batches = chunk[SESSION_COL].map(batch_of).to_numpy()
+        for k in np.unique(batches):
+            path = paths[int(k)]
+            chunk[batches == k].to_csv(path, mode="a", header=not path.exists(), index=False)
+    return paths
+
+
+def load_batch(path, multi_car=False):
+    ''' Frames of one spilled batch, with floats parsed back exactly as they were spilled. '''
+    return pd.read_csv(path, usecols=partial(export_column, multi_car=multi_car),
+                       float_precision="round_trip")
+
+
+_DONE = object()
+
+
+def _compute_collecting(compute, k, batch):
+    # compute in a worker process; table writes are collected and handed back to the writer
+    pending = []
+
+    def write(df, folder, stem, fmt):
+        pending.append((df, folder, stem, fmt))
+        return table_path(folder, stem, fmt)
+
+    return compute(k, batch, write), pending
+
+
+def pipelined(items, load, compute, workers=1, queue_size=PIPELINE_QUEUE_SIZE, processes=True):
+    ''' Overlap loading, computing and writing over `items`.
+
+    A reader thread calls load(item) and `workers` compute slots call
+    compute(k, loaded, write), where write(df, folder, stem, fmt) stands in for
+    table_io.write_table: the write is done by a writer thread and the path it will
+    write is returned. With processes=True each slot runs compute in a worker process
+    (compute must then be picklable, e.g. a module-level function or a partial of one)
+    so it does not share the GIL with the reader and writer; otherwise in a thread.
+    At most queue_size loaded items and queue_size pending writes are held at a time,
+    so a slow stage holds the others back.
+    Returns (results in item order, busy seconds of the read / compute / write stages).
+    The first exception raised in any stage is re-raised once all threads have stopped.
+    '''
+    loaded = queue.Queue(maxsize=queue_size)
+    writes = queue.Queue(maxsize=queue_size)
+    results, errors = {}, []
+    busy = {"read": 0.0, "compute": 0.0, "write": 0.0}
+    lock = threading.Lock()
+
+    def timed(stage, fn, *args):
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            with lock:
+                busy[stage] += time.perf_counter() - start
+
+    def write(df, folder, stem, fmt):
+        writes.put(partial(write_table, df, folder, stem, fmt))
+        return table_path(folder, stem, fmt)
+
+    pool = ProcessPoolExecutor(workers) if processes else None
+
+    def run(k, batch):
+        if pool is None:
+            return compute(k, batch, write)
+        result, pending = pool.submit(_compute_collecting, compute, k, batch).result()
+        for args in pending:
+            write(*args)
+        return result
+
+    def reader():
+        try:
+            for k, item in enumerate(items):
+                if errors:
+                    break
+                loaded.put((k, timed("read", load, item)))
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            for _ in range(workers):
+                loaded.put(_DONE)
+
+    def worker():
+        while (job := loaded.get()) is not _DONE:
+            k, batch = job
+            if errors:
+                continue  # keep draining so the reader is never blocked
+            try:
+                results[k] = timed("compute", run, k, batch)
+            except BaseException as e:
+                errors.append(e)
+
+    def writer():
+        while (job := writes.get()) is not _DONE:
+            try:
+                timed("write", job)
+            except BaseException as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=reader, name="reader")]
+    threads += [threading.Thread(target=worker, name=f"worker-{i}") for i in range(workers)]
+    write_thread = threading.Thread(target=writer, name="writer")
+    for thread in threads + [write_thread]:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    writes.put(_DONE)
+    write_thread.join()
+    if pool is not None:
+        pool.shutdown()
+
+    if errors:
+        raise errors[0]
+    return [results[k] for k in sorted(results)], busy
+
+
+def merge_batch_outputs(batch_folders, out_folder, output_format=None):
+    ''' Merge the products written by build_dataset into each of batch_folders:
+    lap-level tables are concatenated (final_data_product sorted by lap_id) and written
+    once to out_folder; processed_race_data parts are moved to
+    <out_folder>/processed_race_data/part-<k> (table_io.read_table reads the folder).
+    Returns the merged final data product.
+    '''
+    out_folder = Path(out_folder)
+    out_folder.mkdir(parents=True, exist_ok=True)
+    merged = {}
+
+    for stem in LAP_PRODUCTS:
+        parts = [read_table(find_table(folder, stem)) for folder in batch_folders
+                 if _has_table(folder, stem)]
+        if not parts:
+            continue
+        table = pd.concat(parts, ignore_index=True)
+        if stem == "final_data_product":
+            table = table.sort_values("lap_id", kind="stable", ignore_index=True)
+        merged[stem] = table
+        write_table(table, out_folder, stem, output_format)
+
+    for stem in CSV_PRODUCTS:
+        parts = [pd.read_csv(Path(folder) / f"{stem}.csv", float_precision="round_trip")
+                 for folder in batch_folders
+                 if (Path(folder) / f"{stem}.csv").exists()]
+        if parts:
+            pd.concat(parts, ignore_index=True).to_csv(out_folder / f"{stem}.csv", index=False)
+
+    # replace earlier single-file or part outputs so find_table picks up this run's parts
+    processed = out_folder / "processed_race_data"
+    for ext in EXTENSIONS.values():
+        (out_folder / f"processed_race_data{ext}").unlink(missing_ok=True)
+    if processed.exists():
+        shutil.rmtree(processed)
+    processed.mkdir()
+    for k, folder in enumerate(batch_folders):
+        if _has_table(folder, "processed_race_data"):
+            part = find_table(folder, "processed_race_data")
+            shutil.move(part, processed / f"part-{k:05d}{part.suffix}")
+
+    return merged.get("final_data_product")
+
+
+def _has_table(folder, stem):
+    try:
+        find_table(folder, stem)
+    except FileNotFoundError:
+        return False
+    return True
@@ -0,0 +1,147 @@
+"""
+Stage-level instrumentation for the data pipeline.
+"""
+
+import cProfile
+import csv
+import json
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+from tqdm import tqdm
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from . import config
+
+
+REPORT_FIELDS = [
+    "stage", "wall_s", "cpu_s", "rows_in", "rows_out", "rows_per_s",
+    "peak_traced_mb", "rss_mb", "max_rss_mb"
+]
+
+
+def progress(iterable=None, per_row=False, **kwargs):
+    ''' tqdm wrapper honouring config.PROGRESS_MODE.
+    "full" shows every bar, "low" drops the bars on per-row loops (where tqdm's
+    per-iteration bookkeeping is measurable) and "off" disables all bars.
+    '''
+    mode = config.PROGRESS_MODE
+    if mode == "off" or (mode == "low" and per_row):
+        if iterable is not None:
+            return iterable
+        return tqdm(disable=True, **kwargs)
+    return tqdm(iterable, **kwargs)
+
+
+def _current_rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _max_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(max_rss / 1e6 if sys.platform == "darwin" else max_rss * 1024 / 1e6, 2)
+
+
+class RunProfiler:
+    ''' Records wall time, CPU time, row counts and memory for each pipeline stage.
+
+    Use as `with profiler.stage("name", rows_in=len(df)) as rec: ...; rec["rows_out"] = len(df)`.
+    With trace_memory=True, tracemalloc reports the Python-allocation peak of each stage
+    (this slows allocation-heavy stages noticeably). With profile_dir set, every stage is
+    also run under cProfile and dumped to `<profile_dir>/<stage>.prof`.
+    '''
+
+    def __init__(self, trace_memory=False, profile_dir=None):
+        self.trace_memory = trace_memory
+        self.profile_dir = Path(profile_dir) if profile_dir is not None else None
+        self.records = []
+        self.started = datetime.now().isoformat(timespec="seconds")
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        record = {"stage": name, "rows_in": rows_in, "rows_out": None}
+
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+
+        profiler = None
+        if self.profile_dir is not None:
+            profiler = cProfile.Profile()
+            profiler.enable()
+
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield record
+        finally:
+            wall = time.perf_counter() - wall_start
+            cpu = time.process_time() - cpu_start
+
+            if profiler is not None:
+                profiler.disable()
+                self.profile_dir.mkdir(parents=True, exist_ok=True)
+                profiler.dump_stats(self.profile_dir / f"{name}.prof")
+
+            rows = record["rows_out"] if record["rows_out"] is not None else record["rows_in"]
+            record.update({
+                "wall_s": round(wall, 4),
+                "cpu_s": round(cpu, 4),
+                "rows_per_s": round(rows / wall, 1) if rows and wall > 0 else None,
+                "peak_traced_mb": round(tracemalloc.get_traced_memory()[1] / 1e6, 2)
+                if self.trace_memory else None,
+                "rss_mb": _current_rss_mb(),
+                "max_rss_mb": _max_rss_mb(),
+            })
+            if record["rss_mb"] is not None:
+                record["rss_mb"] = round(record["rss_mb"], 2)
+            self.records.append({field: record.get(field) for field in REPORT_FIELDS})
+
+    def total_wall_s(self):
+        return round(sum(r["wall_s"] for r in self.records), 4)
+
+    def write_report(self, folder, stem="run_report"):
+        ''' Write the stage records as <stem>.json (with run metadata) and <stem>.csv.
+        Returns the paths of both files.
+        '''
+        folder = Path(folder)
+        folder.mkdir(parents=True, exist_ok=True)
+        json_path = folder / f"{stem}.json"
+        csv_path = folder / f"{stem}.csv"
+
+        report = {
+            "started": self.started,
+            "total_wall_s": self.total_wall_s(),
+            "max_rss_mb": _max_rss_mb(),
+            "stages": self.records,
+        }
+        with open(json_path, "w") as f:
+            json.dump(report, f, indent=2)
+
+        with open(csv_path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+            writer.writeheader()
+            writer.writerows(self.records)
+
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+        return json_path, csv_path
@@ -0,0 +1,116 @@
+"""
+Small DAG scheduler for independent pipeline steps.
+
+Each Step declares the columns it reads and writes. A step depends on every
+earlier step that writes a column it reads; steps without unfinished
+dependencies run concurrently on a thread or process pool and, for frame
+steps, their output columns are joined back into the frame. Steps always see
+the same inputs as in a serial run, so results do not depend on the executor.
+
+    steps = [Step("edge_distances", car_edge_distances, reads=[...], writes=[...],
+                  kwargs={"track_left": left, "track_right": right}), ...]
+    df, _ = run_steps(steps, data=df, executor="thread")
+"""
+
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from .config import SCHEDULER_EXECUTOR, SCHEDULER_WORKERS
+
+
+EXECUTORS = ["serial", "thread", "process"]
+
+
+class Step:
+    ''' One schedulable pipeline step.
+
+    Attributes
+    ----------
+    name : str
+        Step name (also its profiler stage name in serial runs).
+    fn : callable
+        Frame steps (run_steps with data) are called as fn(data[reads], *args, **kwargs)
+        and return a frame, row-aligned with its input, holding the `writes` columns;
+        other steps are called as fn(*args, **kwargs). Must be picklable (module-level)
+        for the process executor.
+    reads, writes : list
+        Columns the step reads and the columns it adds.
+    '''
+
+    def __init__(self, name, fn, reads=(), writes=(), args=(), kwargs=None):
+        self.name = name
+        self.fn = fn
+        self.reads = list(reads)
+        self.writes = list(writes)
+        self.args = tuple(args)
+        self.kwargs = kwargs or {}
+
+    def __repr__(self):
+        return f"Step({self.name!r}, reads={self.reads}, writes={self.writes})"
+
+
+def dependencies(steps):
+    ''' Step name -> names of the earlier steps writing a column it reads. '''
+    deps = {}
+    for i, step in enumerate(steps):
+        deps[step.name] = {other.name for other in steps[:i]
+                           if set(other.writes) & set(step.reads)}
+    return deps
+
+
+def _call(fn, frame, args, kwargs):
+    return fn(*args, **kwargs) if frame is None else fn(frame, *args, **kwargs)
+
+
+def run_steps(steps, data=None, executor=SCHEDULER_EXECUTOR, workers=SCHEDULER_WORKERS,
+              profiler=None):
+    ''' Run `steps` in dependency order and return (data, results).
+
+    With data (a DataFrame), every step gets data[step.reads] (including columns written
+    by its dependencies) and its `writes` columns are joined into the returned frame, in
+    step order after the original columns; without data, data is returned as None.
+    results maps step name -> the step's return value (frame steps: the written columns).
+    executor is "serial", "thread" or "process" with `workers` pool slots (default
+    os.cpu_count()). A profiler gets one stage per step in serial runs.
+    '''
+    if executor not in EXECUTORS:
+        raise ValueError(f"Unknown executor {executor!r}, expected one of {EXECUTORS}")
+    deps = dependencies(steps)
+    frame = None if data is None else data.copy(deep=False)
+    results = {}
+
+    def inputs(step):
+        return None if frame is None else frame[step.reads]
+
+    def finish(step, result):
+        if frame is not None:
+            result = result[step.writes]
+            for column in step.writes:
+                frame[column] = result[column].to_numpy()
+        results[step.name] = result
+
+    if executor == "serial":
+        for step in steps:
+            if profiler is None:
+                finish(step, _call(step.fn, inputs(step), step.args, step.kwargs))
+                continue
+            with profiler.stage(step.name, rows_in=None if frame is None else len(frame)):
+                finish(step, _call(step.fn, inputs(step), step.args, step.kwargs))
+    else:
+        pool_class = ThreadPoolExecutor if executor == "thread" else ProcessPoolExecutor
+        pending = list(steps)
+        running = {}
+        with pool_class(workers or os.cpu_count() or 1) as pool:
+            while pending or running:
+                for step in [s for s in pending if deps[s.name] <= results.keys()]:
+                    pending.remove(step)
+                    future = pool.submit(_call, step.fn, inputs(step), step.args, step.kwargs)
+                    running[future] = step
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    finish(running.pop(future), future.result())
+
+    if frame is not None:
+        written = [c for step in steps for c in step.writes]
+        frame = frame[[c for c in data.columns if c not in written] + written]
+    return frame, results
@@ -0,0 +1,120 @@
+"""
+Per-lap aggregates over track windows (corners or distance ranges).
+
+For every lap and window:
+    <W>_MIN_SPEED, <W>_MEAN_SPEED      over the frames in the window
+    <W>_BRAKE_ENERGY                    integral of BRAKE over LAPDISTANCE (trapezoids)
+    <W>_TIME_BRAKING, <W>_TIME_COASTING, <W>_TIME_FULL_THROTTLE
+                                        ms from each frame to the next, by the frame's phase
+    <W>_MAX_OFFSET                      largest proj_from_ref (when the column is present)
+All windows and laps are reduced in one pass with bincount / ufunc.at over
+(lap, window) segment ids.
+"""
+
+import numpy as np
+import pandas as pd
+
+from .config import SEGMENT_BRAKE_ON, SEGMENT_COAST_THROTTLE, SEGMENT_FULL_THROTTLE
+from .geometry_utils import distance_name
+from .lap_table import as_lap_table
+
+
+def corner_windows(turns):
+    ''' One window per f1sim-ref-turns corner box, named T<TURN>. '''
+    return pd.DataFrame({
+        "name": [f"T{turn}" for turn in turns["TURN"]],
+        "X_MIN": turns[["CORNER_X1", "CORNER_X2"]].min(axis=1).to_numpy(),
+        "X_MAX": turns[["CORNER_X1", "CORNER_X2"]].max(axis=1).to_numpy(),
+        "Y_MIN": turns[["CORNER_Y1", "CORNER_Y2"]].min(axis=1).to_numpy(),
+        "Y_MAX": turns[["CORNER_Y1", "CORNER_Y2"]].max(axis=1).to_numpy(),
+    })
+
+
+def distance_windows(ranges):
+    ''' One window per (start, end) LAPDISTANCE range, named SEG_<start>_<end>. '''
+    return pd.DataFrame({
+        "name": [f"SEG_{distance_name(a)}_{distance_name(b)}" for a, b in ranges],
+        "LD_MIN": [float(a) for a, _ in ranges],
+        "LD_MAX": [float(b) for _, b in ranges],
+    })
+
+
+def _membership(laps, windows, x_col, y_col):
+    # frames x windows: True where the frame lies in the window's box and/or distance range
+    inside = np.ones((laps.n_frames, len(windows)), dtype=bool)
+    bounds = [("X_MIN", "X_MAX", x_col), ("Y_MIN", "Y_MAX", y_col),
+              ("LD_MIN", "LD_MAX", laps.distance_col)]
+    for low, high, column in bounds:
+        if low not in windows.columns:
+            continue
+        values = laps.column(column).astype(np.float64)[:, None]
+        lo = windows[low].to_numpy(dtype=np.float64)
+        hi = windows[high].to_numpy(dtype=np.float64)
+        inside &= (np.isnan(lo) | (values >= lo)) & (np.isnan(hi) | (values <= hi))
+    return inside
+
+
+def segment_features(data, windows, x_col="WORLDPOSITIONX", y_col="WORLDPOSITIONY",
+                     brake_on=SEGMENT_BRAKE_ON, coast_throttle=SEGMENT_COAST_THROTTLE,
+                     full_throttle=SEGMENT_FULL_THROTTLE):
+    ''' Aggregate every window (rows of corner_windows / distance_windows, which may be
+    concatenated) for every lap of a LapTable or frame DataFrame.
+    Returns a DataFrame indexed by lap_id with one column per window and aggregate.
+    '''
+    laps = as_lap_table(data)
+    n_laps, n_windows = len(laps), len(windows)
+
+    def column(name):
+        return laps.column(name).astype(np.float64)
+
+    speed, brake, throttle = column("SPEED"), column("BRAKE"), column("THROTTLE")
+    distance, time = column(laps.distance_col), column("CURRENTLAPTIMEINMS")
+
+    # quantities from each frame to the next frame of the same lap (0 on a lap's last frame)
+    has_next = np.zeros(laps.n_frames, dtype=bool)
+    has_next[:-1] = laps.codes[1:] == laps.codes[:-1]
+    dt = np.zeros(laps.n_frames)
+    area = np.zeros(laps.n_frames)
+    dt[:-1] = np.where(has_next[:-1], time[1:] - time[:-1], 0.0)
+    area[:-1] = np.where(has_next[:-1],
+                         0.5 * (brake[1:] + brake[:-1]) * (distance[1:] - distance[:-1]), 0.0)
+    dt, area = np.nan_to_num(dt), np.nan_to_num(area)
+
+    braking = brake > brake_on
+    coasting = ~braking & (throttle <= coast_throttle)
+    flat_out = throttle >= full_throttle
+
+    # (frame, window) memberships as segment ids lap * n_windows + window
+    frame, window = np.nonzero(_membership(laps, windows, x_col, y_col))
+    segment = laps.codes[frame] * n_windows + window
+    n_segments = n_laps * n_windows
+
+    def total(weights):
+        return np.bincount(segment, weights=weights[frame], minlength=n_segments)
+
+    def extreme(ufunc, values):
+        out = np.full(n_segments, np.nan)
+        ufunc.at(out, segment, values[frame])
+        return out
+
+    n_speed = np.bincount(segment, weights=~np.isnan(speed[frame]), minlength=n_segments)
+    present = np.bincount(segment, minlength=n_segments) > 0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        aggregates = {
+            "MIN_SPEED": extreme(np.fmin, speed),
+            "MEAN_SPEED": total(np.nan_to_num(speed)) / n_speed,
+            "BRAKE_ENERGY": total(area),
+            "TIME_BRAKING": total(dt * braking),
+            "TIME_COASTING": total(dt * coasting),
+            "TIME_FULL_THROTTLE": total(dt * flat_out),
+        }
+    if "proj_from_ref" in laps.data.columns:
+        aggregates["MAX_OFFSET"] = extreme(np.fmax, column("proj_from_ref"))
+
+    names = windows["name"].tolist()
+    result = {}
+    for name_idx, name in enumerate(names):
+        for aggregate, values in aggregates.items():
+            values = np.where(present, values, np.nan).reshape(n_laps, n_windows)
+            result[f"{name}_{aggregate}"] = values[:, name_idx]
+    return pd.DataFrame(result, index=pd.Index(laps.lap_ids, name=laps.lap_col))
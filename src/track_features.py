@@ -1,149 +1,101 @@
 import pandas as pd
 import numpy as np
 from scipy.spatial import KDTree
-from tqdm import tqdm
-from .geometry_utils import euclidean_distance, projection_values, angle_between
+from .profiling import progress
+from .geometry_utils import (
+    euclidean_distance, projection_values, angle_between, track_polyline, lap_order
+)
+from .config import (
+    CAR_COL, NEAREST_SEGMENT_SEARCH, TRACKING_WINDOW, TRACKING_JUMP
+)
 
 
 x_col = "WORLDPOSITIONX"
 y_col = "WORLDPOSITIONY"
 
 
-def car_edge_distances(data, track_left, track_right, x_col=x_col, y_col=y_col):
+def _tracked_segments(data, polyline_df, x_col, y_col):
+    # search="tracking": nearest polyline segment per frame, frames walked per lap in time order
+    order, lap_lengths = lap_order(data)
+    polyline = polyline_df[["WORLDPOSX", "WORLDPOSY"]].to_numpy(dtype=np.float64)
+    points = data[[x_col, y_col]].to_numpy(dtype=np.float64)[order]
+    seg, t, dist = track_polyline(points, lap_lengths, polyline,
+                                  window=TRACKING_WINDOW, jump=TRACKING_JUMP)
+    out_seg, out_t, out_dist = (np.empty_like(seg), np.empty_like(t), np.empty_like(dist))
+    out_seg[order], out_t[order], out_dist[order] = seg, t, dist
+    return out_seg, out_t, out_dist
+
+
+def car_edge_distances(data, track_left, track_right, x_col=x_col, y_col=y_col,
+                       search=NEAREST_SEGMENT_SEARCH):
     ''' For each point in data, find the closest points on the left and right track edges.
     by:
     1. finding the two closest points on each
     2. projecting the point onto the line segment defined by those two points
     Returns a DataFrame with distances and track widths at the closest points.
     Assumes track_left and track_right have 'width' columns from calculate_track_width().
-    '''
-
-    # Fix: Use correct column names for track edges
-    left_points = np.vstack(
-        [track_left["WORLDPOSX"], track_left["WORLDPOSY"]]).T
-    right_points = np.vstack(
-        [track_right["WORLDPOSX"], track_right["WORLDPOSY"]]).T
 
-    left_tree = KDTree(left_points)
-    right_tree = KDTree(right_points)
+    search="tracking" instead follows each lap frame by frame along the edge polylines
+    (geometry_utils.track_polyline) and always projects onto a real edge segment, with
+    widths taken from that segment's nearer end point.
+    '''
+    if search == "tracking":
+        df = data.copy()
+        for side, edge in [("left", track_left), ("right", track_right)]:
+            seg, t, dist = _tracked_segments(data, edge, x_col, y_col)
+            df[f"{side}_dist"] = dist
+            df[f"{side[0]}_width"] = edge["width"].to_numpy()[seg + (t > 0.5)]
+        return df[list(data.columns) + ["left_dist", "right_dist", "l_width", "r_width"]]
+
+    left_points = track_left[["WORLDPOSX", "WORLDPOSY"]].to_numpy(dtype=np.float64)
+    right_points = track_right[["WORLDPOSX", "WORLDPOSY"]].to_numpy(dtype=np.float64)
+    car_points = data[[x_col, y_col]].to_numpy(dtype=np.float64)
+
+    # widths come from the closest edge point, read from plain arrays
+    left_dists, left_idx = _nearest_projection(car_points, left_points, KDTree(left_points))
+    right_dists, right_idx = _nearest_projection(car_points, right_points, KDTree(right_points))
 
     df = data.copy()
-
-    # Pre-allocate arrays for faster assignment
-    left_dists = np.zeros(len(df))
-    right_dists = np.zeros(len(df))
-    l_widths = np.zeros(len(df))
-    r_widths = np.zeros(len(df))
-
-    # Extract car points as numpy array for faster access
-    car_points = df[[x_col, y_col]].values
-
-    for i in tqdm(range(len(df)), desc="Processing car positions"):
-        car_point = car_points[i]
-
-        # Find two closest points on track edges
-        left_dist_vals, left_idxs = left_tree.query(car_point, k=2)
-        right_dist_vals, right_idxs = right_tree.query(car_point, k=2)
-
-        # Get left edge points
-        left_p1 = left_points[left_idxs[0]]
-        left_p2 = left_points[left_idxs[1]]
-        left_proj = projection_values(car_point, left_p1, left_p2)
-
-        # Get right edge points
-        right_p1 = right_points[right_idxs[0]]
-        right_p2 = right_points[right_idxs[1]]
-        right_proj = projection_values(car_point, right_p1, right_p2)
-
-        # Use projection distance if on segment, otherwise closest point distance
-        if 0 <= left_proj['c'] <= 1:
-            left_dists[i] = left_proj['d']
-            # Get width from closest point (first one)
-            closest_left_idx = left_idxs[0]
-        else:
-            left_dists[i] = left_dist_vals[0]
-            closest_left_idx = left_idxs[0]
-
-        if 0 <= right_proj['c'] <= 1:
-            right_dists[i] = right_proj['d']
-            closest_right_idx = right_idxs[0]
-        else:
-            right_dists[i] = right_dist_vals[0]
-            closest_right_idx = right_idxs[0]
-
-        # Get track widths from the closest edge points
-        l_widths[i] = track_left.iloc[closest_left_idx]['width']
-        r_widths[i] = track_right.iloc[closest_right_idx]['width']
-
-    # Assign all at once (faster than individual loc assignments)
     df["left_dist"] = left_dists
     df["right_dist"] = right_dists
-    df["l_width"] = l_widths
-    df["r_width"] = r_widths
+    df["l_width"] = track_left["width"].to_numpy()[left_idx]
+    df["r_width"] = track_right["width"].to_numpy()[right_idx]
 
     return df
 
 
+def _nearest_projection(points, line_points, tree):
+    ''' Vectorised form of the per-point rule used for edge distances and widths: project
+    each point onto the line through its two nearest line points and use that distance when
+    the projection falls between them, otherwise the distance to the nearest point.
+    Returns (distance, index of the nearest line point).
+    '''
+    dists, idxs = tree.query(points, k=2)
+    p1, p2 = line_points[idxs[:, 0]], line_points[idxs[:, 1]]
+    ab1 = points - p1
+    b1b2 = p2 - p1
+    distance_sq = euclidean_distance(p1.T, p2.T) ** 2
+    degenerate = distance_sq < 1e-12
+    with np.errstate(invalid="ignore", divide="ignore"):
+        c = (ab1[:, 0] * b1b2[:, 0] + ab1[:, 1] * b1b2[:, 1]) / distance_sq
+    c[degenerate] = 0.0
+    proj = p1 + c[:, None] * b1b2
+    d = euclidean_distance(points.T, proj.T)
+    on_segment = (c >= 0) & (c <= 1) & ~degenerate
+    return np.where(on_segment, d, dists[:, 0]), idxs[:, 0]
+
+
 def calculate_track_width(track_left, track_right):
     ''' For each point on track_left, calculate the width by projecting to the closest 2 points on track_right.
     Returns track_left and track_right DataFrames with added 'width' column.
     '''
+    left_points = track_left[["WORLDPOSX", "WORLDPOSY"]].to_numpy(dtype=np.float64)
+    right_points = track_right[["WORLDPOSX", "WORLDPOSY"]].to_numpy(dtype=np.float64)
 
-    # Prepare points for KD tree
-    left_points = np.vstack(
-        [track_left["WORLDPOSX"], track_left["WORLDPOSY"]]).T
-    right_points = np.vstack(
-        [track_right["WORLDPOSX"], track_right["WORLDPOSY"]]).T
-
-    left_tree = KDTree(left_points)
-    right_tree = KDTree(right_points)
-
-    # Calculate width for left edge points
     left_df = track_left.copy()
-    left_widths = np.zeros(len(left_df))
-
-    for i in tqdm(range(len(left_df)), desc="Calculating left edge widths"):
-        left_point = left_points[i]
-
-        # Find two closest points on right edge
-        right_dist_vals, right_idxs = right_tree.query(left_point, k=2)
-
-        # Get right edge points
-        right_p1 = right_points[right_idxs[0]]
-        right_p2 = right_points[right_idxs[1]]
-        right_proj = projection_values(left_point, right_p1, right_p2)
-
-        # Use projection distance if on segment, otherwise closest point distance
-        if 0 <= right_proj['c'] <= 1:
-            left_widths[i] = right_proj['d']
-        else:
-            left_widths[i] = right_dist_vals[0]
-
-    left_df["width"] = left_widths
-
-    # Calculate width for right edge points
     right_df = track_right.copy()
-    right_widths = np.zeros(len(right_df))
-
-    for i in tqdm(range(len(right_df)), desc="Calculating right edge widths"):
-        right_point = right_points[i]
-
-        # Find two closest points on left edge
-        left_dist_vals, left_idxs = left_tree.query(right_point, k=2)
-
-        # Get left edge points
-        left_p1 = left_points[left_idxs[0]]
-        left_p2 = left_points[left_idxs[1]]
-        left_proj = projection_values(right_point, left_p1, left_p2)
-
-        # Use projection distance if on segment, otherwise closest point distance
-        if 0 <= left_proj['c'] <= 1:
-            right_widths[i] = left_proj['d']
-        else:
-            right_widths[i] = left_dist_vals[0]
-
-    right_df["width"] = right_widths
-
+    left_df["width"] = _nearest_projection(left_points, right_points, KDTree(right_points))[0]
+    right_df["width"] = _nearest_projection(right_points, left_points, KDTree(left_points))[0]
     return left_df, right_df
 
 
@@ -193,13 +145,14 @@ def id_outoftrack(df, buffer=0.53, start=350, end=600, inplace=True):
     df_small["within_bounds"] = (df_small["left_dist"] + df_small["right_dist"]) < \
         (df_small["l_width"] + df_small["r_width"]) / 2 + buffer
 
-    invalid_laps = df_small[df_small["within_bounds"] == False][[
-        "SESSIONUID", "CURRENTLAPNUM"]].drop_duplicates()
+    # laps are keyed by lap_id once add_lap_id has run (it tells cars apart in multi-car data)
+    keys = ["lap_id"] if "lap_id" in df.columns else ["SESSIONUID", "CURRENTLAPNUM"]
+    invalid_laps = df_small[df_small["within_bounds"] == False][keys].drop_duplicates()
 
     invalid_laps["invalid_lap"] = 1
     df = df.merge(
         invalid_laps,
-        on=["SESSIONUID", "CURRENTLAPNUM"],
+        on=keys,
         how="left"
     )
     df["invalid_lap"] = df["invalid_lap"].fillna(0).astype(int)
@@ -212,12 +165,25 @@ def id_outoftrack(df, buffer=0.53, start=350, end=600, inplace=True):
 #     return df
 
 def add_lap_id(df):
-    df['lap_id'] = df['SESSIONUID'].astype(
-        str) + "_" + df['CURRENTLAPNUM'].astype(str)
+    session = df['SESSIONUID'].astype(str)
+    if CAR_COL in df.columns:
+        # multi-car data: <session>_<car>_<lap>
+        session = session + "_" + df[CAR_COL].astype(str)
+    df['lap_id'] = session + "_" + df['CURRENTLAPNUM'].astype(str)
     return df
 
 
-def car_from_ref_line(data, ref_line, x_col=x_col, y_col=y_col):
+def car_from_ref_line(data, ref_line, x_col=x_col, y_col=y_col, search=NEAREST_SEGMENT_SEARCH):
+    ''' Distance from each frame to the reference line ("proj_from_ref").
+    search="kd" projects onto the line through the two nearest reference points;
+    search="tracking" follows each lap along the reference polyline and measures the
+    distance to the nearest real segment.
+    '''
+    if search == "tracking":
+        df = data.copy()
+        df["proj_from_ref"] = _tracked_segments(data, ref_line, x_col, y_col)[2]
+        return df
+
     ref_points = np.vstack([ref_line["WORLDPOSX"], ref_line["WORLDPOSY"]]).T
     tree = KDTree(ref_points)
 
@@ -226,7 +192,7 @@ def car_from_ref_line(data, ref_line, x_col=x_col, y_col=y_col):
     car_points = df[[x_col, y_col]].values
     car_forward = df[["WORLDFORWARDDIRX", "WORLDFORWARDDIRY"]].values
 
-    for i in tqdm(range(len(df)), desc="Referencing relative ref line"):
+    for i in progress(range(len(df)), desc="Referencing relative ref line", per_row=True):
         car_point = car_points[i]
         dist_vals, idxs = tree.query(car_point, k=2)
         p0, p1 = ref_points[idxs[0]], ref_points[idxs[1]]
@@ -4,12 +4,16 @@ from scipy.spatial import KDTree
 from tqdm import tqdm
 
 from .geometry_utils import interpolate_at_distance
+from .lap_table import as_lap_table
+from .signals import window_diff, window_sign_change
 from .config import FEATURES
 
 
 def moment_generator(data, moment_name, feature_names, moment_LD, extrema_LD=None, epsilon=0.1):
     # from the point row data -> transform into lap row data
     # Expects moment_LD to be a DataFrame with 'lap_id' and a distance column, or a Series with lap_id as index
+    # data is a LapTable or a frame DataFrame (sorted into a LapTable once here)
+    laps = as_lap_table(data)
 
     # Convert to DataFrame format if it's a Series
     if isinstance(moment_LD, pd.Series):
@@ -45,7 +49,7 @@ def moment_generator(data, moment_name, feature_names, moment_LD, extrema_LD=Non
         entry = {"lap_id": lap_id}
 
         # Extract this lap's data
-        lap_data = data[data["lap_id"] == lap_id]
+        lap_data = laps.lap(lap_id)
 
         if lap_data.empty or pd.isna(target_LD):
             # Add NaN values for all features to preserve structure
@@ -129,10 +133,12 @@ def get_throttle_points(df, distance_range=(10, 710), lift_threshold=0.02):
     """
     results = []
 
-    for lap_id, group in df.groupby("lap_id"):
-        group = group.sort_values("LAPDISTANCE").reset_index(drop=True)
-        group = group[(group["LAPDISTANCE"] >= distance_range[0]) &
-                      (group["LAPDISTANCE"] <= distance_range[1])]
+    laps = as_lap_table(df)
+    begin, stop = laps.window(*distance_range)
+
+    for i, lap_id in enumerate(laps.lap_ids):
+        # frames in range, labelled by their position in the lap's distance order
+        group = laps.data.iloc[begin[i]:stop[i]]
 
         if group["THROTTLE"].isna().all():
             results.append({
@@ -144,10 +150,9 @@ def get_throttle_points(df, distance_range=(10, 710), lift_threshold=0.02):
             })
             continue
 
-        # Smooth throttle to reduce noise
-        # .rolling(3, center=True, min_periods=1).mean()
-        throttle = group["THROTTLE"]
-        d_throttle = throttle.diff()
+        # Raw per-frame change; the smoothed channel (rolling(3, center=True)) is
+        # available as THROTTLE_SMOOTH / THROTTLE_D1 from add_signal_columns(derivatives=True)
+        d_throttle = window_diff(group, "THROTTLE")
 
         # Find first lift
         lift_points = d_throttle[d_throttle < -lift_threshold]
@@ -171,8 +176,7 @@ def get_throttle_points(df, distance_range=(10, 710), lift_threshold=0.02):
 
         # First "back on" point
         after_min = group.loc[min_idx:]
-        # .rolling(3, center=True, min_periods=1).mean()
-        d_throttle_after_min = after_min["THROTTLE"].diff()
+        d_throttle_after_min = window_diff(after_min, "THROTTLE")
         back_on_points = d_throttle_after_min[d_throttle_after_min >
                                               lift_threshold]
 
@@ -204,10 +208,12 @@ def get_throttle_points(df, distance_range=(10, 710), lift_threshold=0.02):
 def get_braking_points(df, distance_range=(10, 800)):
     results = []
 
-    for lap_id, group in df.groupby("lap_id"):
-        group = group.sort_values("LAPDISTANCE").reset_index(drop=True)
-        group = group[(group["LAPDISTANCE"] >= distance_range[0])
-                      & (group["LAPDISTANCE"] <= distance_range[1])]
+    laps = as_lap_table(df)
+    begin, stop = laps.window(*distance_range)
+
+    for i, lap_id in enumerate(laps.lap_ids):
+        # frames in range, labelled by their position in the lap's distance order
+        group = laps.data.iloc[begin[i]:stop[i]]
 
         if group["BRAKE"].isna().all():
             results.append({
@@ -249,9 +255,8 @@ def get_braking_points(df, distance_range=(10, 800)):
         brake_end_LD = None
 
         if not after_max.empty:
-            brake_values = after_max["BRAKE"].values
-            diffs = pd.Series(brake_values).diff().fillna(0)
-            dec_indices = after_max.index[diffs < 0]
+            diffs = window_diff(after_max, "BRAKE").fillna(0)
+            dec_indices = after_max.index[(diffs < 0).to_numpy()]
 
             if len(dec_indices) > 0:
                 first_dec_idx = dec_indices[0]
@@ -281,20 +286,15 @@ def get_apex_points(data, apex_columns=["dist_apex_1", "dist_apex_2"]):
     """
     Find the LAPDISTANCE where each apex distance column is minimized for each lap.
     """
-    results = []
+    laps = as_lap_table(data)
+    lap_distance = laps.column("LAPDISTANCE").astype(np.float64)
+    results = {"lap_id": laps.lap_ids}
 
-    for lap_id, group in data.groupby("lap_id"):
-        group = group.set_index("LAPDISTANCE")
-
-        entry = {"lap_id": lap_id}
-
-        for apex_col in apex_columns:
-            min_lapdistance = group[apex_col].idxmin()
-            # Extract apex number or use full column name
-            apex_name = apex_col.replace("dist_", "").replace("apex_", "apex")
-            entry[f"{apex_name}_LD"] = min_lapdistance
-
-        results.append(entry)
+    for apex_col in apex_columns:
+        rows = laps.argextreme(apex_col, "min")
+        # Extract apex number or use full column name
+        apex_name = apex_col.replace("dist_", "").replace("apex_", "apex")
+        results[f"{apex_name}_LD"] = np.where(rows >= 0, lap_distance[rows], np.nan)
 
     return pd.DataFrame(results)
 
@@ -302,10 +302,12 @@ def get_apex_points(data, apex_columns=["dist_apex_1", "dist_apex_2"]):
 def get_steering_points(df, distance_range=(10, 800)):
     results = []
 
-    for lap_id, group in df.groupby("lap_id"):
-        group = group.sort_values("LAPDISTANCE").reset_index(drop=True)
-        group = group[(group["LAPDISTANCE"] >= distance_range[0])
-                      & (group["LAPDISTANCE"] <= distance_range[1])]
+    laps = as_lap_table(df)
+    begin, stop = laps.window(*distance_range)
+
+    for i, lap_id in enumerate(laps.lap_ids):
+        # frames in range, labelled by their position in the lap's distance order
+        group = laps.data.iloc[begin[i]:stop[i]]
 
         if group["STEER"].isna().all():
             results.append({
@@ -342,7 +344,7 @@ def get_steering_points(df, distance_range=(10, 800)):
 
         if not after_max_pos.empty:
             steer_series = after_max_pos["STEER"]
-            sign_change = steer_series.shift(1) * steer_series < 0
+            sign_change = window_sign_change(after_max_pos, "STEER")
 
             if sign_change.any():
                 change_idx = sign_change.idxmax()
@@ -361,7 +363,7 @@ def get_steering_points(df, distance_range=(10, 800)):
 
         if not after_max_neg.empty:
             steer_series = after_max_neg["STEER"]
-            sign_change = steer_series.shift(1) * steer_series < 0
+            sign_change = window_sign_change(after_max_neg, "STEER")
 
             if sign_change.any():
                 change_idx = sign_change.idxmax()
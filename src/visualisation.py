@@ -3,8 +3,77 @@ import numpy as np
 from matplotlib import pyplot as plt
 from scipy.spatial import KDTree
 
+from .lap_table import LapTable, as_lap_table
 
-def plot_k_turns(data, turns, track_left, track_right, x_col="WORLDPOSITIONX", y_col="WORLDPOSITIONY", k=3, color_col="M_SPEED_1", title="Track Sections Near Turns", cmap="viridis"):
+
+def rasterize(x, y, bins=(600, 300), extent=None, values=None):
+    """
+    Bin points into a bins[0] x bins[1] raster over extent (xmin, xmax, ymin, ymax;
+    default: the data range). Without values each pixel holds the point count, with
+    values it holds their mean (NaN where empty). Returns (image, extent) ready for
+    imshow(image, extent=extent, origin="lower"); cost is one pass over the points.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    keep = np.isfinite(x) & np.isfinite(y)
+    if values is not None:
+        values = np.asarray(values, dtype=np.float64)
+        keep &= np.isfinite(values)
+        values = values[keep]
+    x, y = x[keep], y[keep]
+    if extent is None:
+        extent = (x.min(), x.max(), y.min(), y.max()) if len(x) else (0, 1, 0, 1)
+
+    edges = [np.linspace(extent[0], extent[1], bins[0] + 1),
+             np.linspace(extent[2], extent[3], bins[1] + 1)]
+    counts, _, _ = np.histogram2d(x, y, bins=edges)
+    if values is None:
+        return counts.T, extent
+    sums, _, _ = np.histogram2d(x, y, bins=edges, weights=values)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (sums / counts).T, extent
+
+
+def _draw_raster(ax, image, extent, cmap, density):
+    # empty pixels stay transparent; counts are shown on a log scale
+    from matplotlib.colors import LogNorm
+    image = np.ma.masked_where(~np.isfinite(image) | ((image == 0) & density), image)
+    norm = LogNorm() if density and image.count() else None
+    return ax.imshow(image, extent=extent, origin="lower", aspect="auto",
+                     interpolation="nearest", cmap=cmap, norm=norm)
+
+
+def lttb(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets downsampling of a line to n_out points.
+    Returns the indices of the kept points (always including the first and last).
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    kept = np.empty(n_out, dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+    prev = 0
+    for b in range(n_out - 2):
+        lo, hi = edges[b], edges[b + 1]
+        # average of the next bucket (or the last point) as the third triangle vertex
+        nxt_lo, nxt_hi = hi, edges[b + 2] if b + 2 < len(edges) else n
+        ax_, ay_ = x[nxt_lo:nxt_hi].mean(), y[nxt_lo:nxt_hi].mean()
+        area = np.abs((x[prev] - ax_) * (y[lo:hi] - y[prev])
+                      - (x[prev] - x[lo:hi]) * (ay_ - y[prev]))
+        prev = lo + int(np.argmax(area))
+        kept[b + 1] = prev
+    return kept
+
+
+def plot_k_turns(data, turns, track_left, track_right, x_col="WORLDPOSITIONX", y_col="WORLDPOSITIONY", k=3, color_col="M_SPEED_1", title="Track Sections Near Turns", cmap="viridis",
+                 mode="scatter", bins=(300, 300)):
+    # mode="scatter" draws every point; "mean" rasterizes the mean of color_col over x*y
+    # pixels and "density" the point count, so the cost no longer grows with the rows drawn
     fig, axs = plt.subplots(1, k, figsize=(18, 6))
 
     for i in range(k):
@@ -23,8 +92,15 @@ def plot_k_turns(data, turns, track_left, track_right, x_col="WORLDPOSITIONX", y
         tr_t2 = track_right[(track_right["WORLDPOSX"] >= x_min) & (track_right["WORLDPOSX"] <= x_max) &
                             (track_right["WORLDPOSY"] >= y_min) & (track_right["WORLDPOSY"] <= y_max)]
 
-        scatter = axs[i].scatter(near_turn_n[x_col], near_turn_n[y_col],
-                                 c=near_turn_n[color_col[i] if type(color_col) == list else color_col], cmap=cmap, s=3)
+        colour = color_col[i] if type(color_col) == list else color_col
+        if mode == "scatter":
+            scatter = axs[i].scatter(near_turn_n[x_col], near_turn_n[y_col],
+                                     c=near_turn_n[colour], cmap=cmap, s=3)
+        else:
+            image, extent = rasterize(near_turn_n[x_col], near_turn_n[y_col], bins,
+                                      extent=(x_min, x_max, y_min, y_max),
+                                      values=near_turn_n[colour] if mode == "mean" else None)
+            scatter = _draw_raster(axs[i], image, extent, cmap, density=mode == "density")
 
         axs[i].scatter(turn_n["APEX_X1"], turn_n["APEX_Y1"],
                        color="black", s=20, label="Apex")
@@ -42,14 +118,16 @@ def plot_k_turns(data, turns, track_left, track_right, x_col="WORLDPOSITIONX", y
 
 def plot_laps(data, y_col="BRAKE", distance_range=(0, 300),
               exclude_laps=None, only_valid=False,
-              figsize=(12, 8), point_size=1, ax=None, c = None):
+              figsize=(12, 8), point_size=1, ax=None, c = None,
+              mode="scatter", bins=(600, 300), max_points=500, value_col=None):
     """
     Plot lap data with LAPDISTANCE on the x-axis and a chosen column on the y-axis.
 
     Parameters
     ----------
-    data : pd.DataFrame
-        The cleaned lap data.
+    data : pd.DataFrame or LapTable
+        The cleaned lap data. A LapTable is sliced by its lap offsets and distance
+        windows instead of being filtered row by row.
     y_col : str, default="BRAKE"
         Column to plot against LAPDISTANCE.
     distance_range : tuple, default=(0, 300)
@@ -64,30 +142,75 @@ def plot_laps(data, y_col="BRAKE", distance_range=(0, 300),
         Scatter point size.
     ax : matplotlib.axes.Axes, optional
         Axis to draw on. If None, a new figure/axis is created.
+    mode : str, default="scatter"
+        "scatter" draws every point. "density" (point count) and "mean" (mean of
+        value_col) bin LAPDISTANCE x y_col into a `bins` raster drawn with imshow.
+        "lines" draws one line per lap, LTTB-downsampled to `max_points` points.
+    value_col : str, optional
+        Column averaged per bin in "mean" mode (required there).
     """
 
     plot_true = True if ax is None else False
-    d = data.copy()
+
+    if isinstance(data, LapTable):
+        laps = np.ones(len(data), dtype=bool)
+        if exclude_laps is not None:
+            laps &= ~np.isin(data.lap_ids, list(exclude_laps))
+        d = data.select(*data.window(*distance_range), laps=laps)
+        if only_valid:
+            d = d[d["invalid_lap"] == 0]
+        return _draw_laps(d, y_col, figsize, point_size, ax, c, plot_true,
+                          mode, bins, distance_range, max_points, value_col)
+
+    # one combined mask, so the frame is only copied once by the final selection
+    keep = ((data["LAPDISTANCE"] >= distance_range[0]) &
+            (data["LAPDISTANCE"] <= distance_range[1])).to_numpy()
 
     # Filter invalid laps
     if only_valid:
-        d = d[d["invalid_lap"] == 0]
+        keep &= (data["invalid_lap"] == 0).to_numpy()
 
     # Exclude laps
     if exclude_laps is not None:
-        d = d[~d["lap_id"].isin(exclude_laps)]
+        keep &= ~data["lap_id"].isin(exclude_laps).to_numpy()
+
+    d = data[keep]
+
+    return _draw_laps(d, y_col, figsize, point_size, ax, c, plot_true,
+                      mode, bins, distance_range, max_points, value_col)
 
-    # Distance filter
-    d = d[(d["LAPDISTANCE"] >= distance_range[0]) &
-          (d["LAPDISTANCE"] <= distance_range[1])]
+
+def _draw_laps(d, y_col, figsize, point_size, ax, c, plot_true,
+               mode="scatter", bins=(600, 300), distance_range=None, max_points=500,
+               value_col=None):
+    if mode == "mean" and value_col is None:
+        raise ValueError('mode="mean" needs value_col, the column to average per bin')
+    if mode == "mean" and value_col not in d.columns:
+        raise ValueError(f"value_col {value_col!r} is not a column of the lap data")
 
     # Make axis if not supplied
     if ax is None:
         fig, ax = plt.subplots(figsize=figsize)
 
     # Plot
-    sc = ax.scatter(d["LAPDISTANCE"], d[y_col],
-                    s=point_size, c=c) #, c=d["lap_id"]
+    if mode in ("density", "mean"):
+        y = d[y_col].to_numpy(dtype=np.float64)
+        finite = y[np.isfinite(y)]
+        extent = (distance_range[0], distance_range[1],
+                  finite.min() if len(finite) else 0, finite.max() if len(finite) else 1)
+        image, extent = rasterize(d["LAPDISTANCE"], y, bins, extent=extent,
+                                  values=d[value_col] if mode == "mean" else None)
+        sc = _draw_raster(ax, image, extent, "viridis", density=mode == "density")
+        if plot_true:
+            plt.colorbar(sc, ax=ax, label="frames" if mode == "density" else value_col)
+    elif mode == "lines":
+        for _, lap in as_lap_table(d):
+            idx = lttb(lap["LAPDISTANCE"].to_numpy(), lap[y_col].to_numpy(), max_points)
+            ax.plot(lap["LAPDISTANCE"].to_numpy()[idx], lap[y_col].to_numpy()[idx],
+                    lw=0.5, alpha=0.5)
+    else:
+        sc = ax.scatter(d["LAPDISTANCE"], d[y_col],
+                        s=point_size, c=c) #, c=d["lap_id"]
     ax.set_xlabel("LAPDISTANCE")
     ax.set_ylabel(y_col)
     ax.set_title(f"{y_col} vs LAPDISTANCE")
@@ -100,7 +223,7 @@ def plot_laps(data, y_col="BRAKE", distance_range=(0, 300),
 def plot_lap(data, track_left, track_right, turns,
              x_col="WORLDPOSITIONX", y_col="WORLDPOSITIONY",
              color_col="M_SPEED_1", title="Full Lap with Local Track Boundaries",
-             cmap="viridis", radius=30, ax=None):
+             cmap="viridis", radius=30, ax=None, near=None):
     """
     Plot a full lap trajectory, showing only track boundaries and apex points
     within a specified radius (in meters) of the lap line.
@@ -115,28 +238,34 @@ def plot_lap(data, track_left, track_right, turns,
         Apex point data (expects columns 'APEX_X1', 'APEX_Y1').
     radius : float
         Radius (m) around lap path within which to show boundaries/apexes.
+    near : tuple, optional
+        Precomputed (track_left, track_right, apex) points near the lap, e.g. from
+        lap_reports.TrackGeometry.nearby; skips building a KD-tree for the lap.
     """
 
     plot_true = True if ax is None else False
 
-    # Build KDTree for the lap path
-    lap_points = np.vstack([data[x_col], data[y_col]]).T
-    lap_tree = KDTree(lap_points)
+    if near is not None:
+        tl_near, tr_near, apex_near = near
+    else:
+        # Build KDTree for the lap path
+        lap_points = np.vstack([data[x_col], data[y_col]]).T
+        lap_tree = KDTree(lap_points)
 
-    # Helper function to get nearby points
-    def filter_nearby(df, x="WORLDPOSX", y="WORLDPOSY"):
-        pts = np.vstack([df[x], df[y]]).T
-        idx = lap_tree.query_ball_point(pts, r=radius)
-        mask = np.array([len(i) > 0 for i in idx])
-        return df[mask]
+        # Helper function to get nearby points
+        def filter_nearby(df, x="WORLDPOSX", y="WORLDPOSY"):
+            pts = np.vstack([df[x], df[y]]).T
+            idx = lap_tree.query_ball_point(pts, r=radius)
+            mask = np.array([len(i) > 0 for i in idx])
+            return df[mask]
 
-    # Filter left/right track points within radius
-    tl_near = filter_nearby(track_left)
-    tr_near = filter_nearby(track_right)
+        # Filter left/right track points within radius
+        tl_near = filter_nearby(track_left)
+        tr_near = filter_nearby(track_right)
 
-    # Filter apex points near lap
-    apex_points = turns[["APEX_X1", "APEX_Y1"]].dropna()
-    apex_near = filter_nearby(apex_points, x="APEX_X1", y="APEX_Y1")
+        # Filter apex points near lap
+        apex_points = turns[["APEX_X1", "APEX_Y1"]].dropna()
+        apex_near = filter_nearby(apex_points, x="APEX_X1", y="APEX_Y1")
 
     # Plot
     if ax is None:
@@ -161,3 +290,5 @@ def plot_lap(data, track_left, track_right, turns,
     if plot_true:
         plt.axis("equal")
         plt.show()
+
+    return ax